@@ -0,0 +1,152 @@
+"""
+Simple key-value caches with expiry, used to avoid repeating expensive work
+between requests.
+
+Backends share a small interface: get(key) returns None on a miss,
+set(key, value) stores a value, delete(key) removes one and clear(prefix)
+removes those whose keys start with prefix, or all of them.
+"""
+import cPickle as pickle
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+
+class LRUCache(object):
+
+    """An in-process cache holding at most max_size entries, each of which
+    expires ttl seconds after it was set
+
+    >>> cache = LRUCache(max_size=2, ttl=60)
+    >>> cache.set('a', 1)
+    >>> cache.set('b', 2)
+    >>> cache.get('a')
+    1
+    >>> cache.set('c', 3)
+    >>> cache.get('b') is None
+    True
+    >>> cache.get('a'), cache.get('c')
+    (1, 3)
+    """
+
+    def __init__(self, max_size, ttl, clock=time.time):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= self._clock():
+                return None
+            # re-inserting marks the entry as most recently used
+            self._entries[key] = entry
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (self._clock() + self.ttl, value)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self, prefix=''):
+        """
+        >>> cache = LRUCache(max_size=3, ttl=60)
+        >>> cache.set('foo:a', 1)
+        >>> cache.set('bar:a', 2)
+        >>> cache.clear('foo:')
+        >>> cache.get('foo:a') is None, cache.get('bar:a')
+        (True, 2)
+        """
+        with self._lock:
+            for key in [key for key in self._entries
+                        if key.startswith(prefix)]:
+                del self._entries[key]
+
+
+class RedisCache(object):
+
+    """A cache shared between processes. Values are pickled, expire after
+    ttl seconds, and size is bounded by the Redis maxmemory policy.
+
+    Redis being unavailable is treated as a cache miss rather than an error,
+    and deletes which fail are logged, leaving entries to expire.
+    """
+
+    def __init__(self, redis_client, ttl, prefix='backdrop:cache:'):
+        self._redis = redis_client
+        self.ttl = ttl
+        self._prefix = prefix
+
+    @classmethod
+    def from_url(cls, url, ttl, prefix='backdrop:cache:'):
+        return cls(redis.StrictRedis.from_url(url), ttl, prefix)
+
+    def get(self, key):
+        try:
+            value = self._redis.get(self._prefix + key)
+        except redis.RedisError as e:
+            logger.warning('Cache get failed: {}'.format(e))
+            return None
+        if value is None:
+            return None
+        return pickle.loads(value)
+
+    def set(self, key, value):
+        try:
+            self._redis.setex(self._prefix + key, self.ttl,
+                              pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        except redis.RedisError as e:
+            logger.warning('Cache set failed: {}'.format(e))
+
+    def delete(self, key):
+        try:
+            self._redis.delete(self._prefix + key)
+        except redis.RedisError as e:
+            logger.warning('Cache delete failed: {}'.format(e))
+
+    def clear(self, prefix=''):
+        try:
+            for key in self._redis.scan_iter(
+                    match=self._prefix + prefix + '*'):
+                self._redis.delete(key)
+        except redis.RedisError as e:
+            logger.warning('Cache clear failed: {}'.format(e))
+
+
+def create_cache(backend, max_size=1000, ttl=300, redis_url=None,
+                 prefix='backdrop:cache:'):
+    """Create a cache backend by name, or None if caching is switched off
+
+    >>> create_cache(None)
+    >>> create_cache('lru', max_size=10).max_size
+    10
+    >>> create_cache('memcached')
+    Traceback (most recent call last):
+        ...
+    NotImplementedError: Cache backend not implemented "memcached"
+    """
+    if not backend:
+        return None
+    elif backend == 'lru':
+        return LRUCache(max_size, ttl)
+    elif backend == 'redis':
+        return RedisCache.from_url(redis_url, ttl, prefix)
+    else:
+        raise NotImplementedError(
+            'Cache backend not implemented "%s"' % backend)
@@ -0,0 +1,163 @@
+"""
+Caches data set configs fetched from Stagecraft so that reads and writes do
+not wait on, or fail with, Stagecraft.
+
+Configs are fresh for ttl seconds. After that a cached config is still
+served while it is refreshed in the background, until it is stale_ttl
+seconds past fresh, after which it is fetched again as part of the request.
+If a background refresh fails the stale config keeps being served.
+
+Configs hold the bearer tokens which authorise writes, so the write API
+doesn't serve stale configs: once a config is past ttl it is fetched again
+as part of the request, and the request fails if Stagecraft does. A revoked
+token is accepted for at most ttl seconds, unless Stagecraft calls
+DELETE /_cache/data-sets/<name> when the token changes, which takes effect
+straight away.
+"""
+import logging
+import threading
+import time
+
+from backdrop import statsd
+from .cache import create_cache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL = 60
+DEFAULT_STALE_TTL = 3600
+
+
+def create_caching_admin_api(admin_api, config, serve_stale=True):
+    """Wrap an AdminAPI using the CONFIG_CACHE_* settings in a flask app
+    config"""
+    ttl = config.get('CONFIG_CACHE_TTL', DEFAULT_TTL)
+    stale_ttl = config.get('CONFIG_CACHE_STALE_TTL', DEFAULT_STALE_TTL) \
+        if serve_stale else 0
+    cache = create_cache(
+        config.get('CONFIG_CACHE_BACKEND'),
+        max_size=config.get('CONFIG_CACHE_SIZE', 1000),
+        ttl=ttl + stale_ttl,
+        redis_url=config.get('CONFIG_CACHE_REDIS_URL'),
+        prefix='backdrop:config:')
+    return CachingAdminAPI(admin_api, cache, ttl, serve_stale=serve_stale)
+
+
+class CachingAdminAPI(object):
+
+    """Wraps a performanceplatform AdminAPI, caching the data set configs
+    returned by get_data_set and get_data_set_by_name. Any other method is
+    passed straight through. With no cache every call goes to Stagecraft.
+
+    The cache backend's own expiry sets how long a stale config may be
+    served for. Without serve_stale, configs past ttl are fetched again
+    before they are returned.
+    """
+
+    def __init__(self, admin_api, cache, ttl, clock=time.time,
+                 serve_stale=True):
+        self._admin_api = admin_api
+        self._cache = cache
+        self._ttl = ttl
+        self._serve_stale = serve_stale
+        self._clock = clock
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self._admin_api, name)
+
+    def get_data_set(self, data_group, data_type):
+        return self._get(_group_key(data_group, data_type),
+                         self._admin_api.get_data_set, data_group, data_type)
+
+    def get_data_set_by_name(self, name):
+        return self._get(_name_key(name),
+                         self._admin_api.get_data_set_by_name, name)
+
+    def invalidate(self, name=None):
+        """Forget the config for a data set, or every config if no name is
+        given"""
+        if self._cache is None:
+            return
+        if name is None:
+            self._cache.clear()
+            return
+
+        entry = self._cache.get(_name_key(name))
+        self._cache.delete(_name_key(name))
+        if entry is not None:
+            group_key = _group_key_for(entry[1])
+            if group_key:
+                self._cache.delete(group_key)
+
+    def _get(self, key, fetch, *args):
+        if self._cache is None:
+            return fetch(*args)
+
+        entry = self._cache.get(key)
+        if entry is None:
+            statsd.incr('config_cache.miss')
+            return self._fetch(fetch, *args)
+
+        fetched_at, config = entry
+        if self._clock() - fetched_at < self._ttl:
+            statsd.incr('config_cache.hit')
+        elif not self._serve_stale:
+            statsd.incr('config_cache.expired')
+            config = self._fetch(fetch, *args)
+            if config is None:
+                self._cache.delete(key)
+        else:
+            statsd.incr('config_cache.stale')
+            self._refresh_in_background(key, fetch, *args)
+        return config
+
+    def _fetch(self, fetch, *args):
+        config = fetch(*args)
+        # Missing data sets aren't cached so that new ones can be written
+        # to as soon as Stagecraft has created them.
+        if config is not None:
+            entry = (self._clock(), config)
+            self._cache.set(_name_key(config['name']), entry)
+            group_key = _group_key_for(config)
+            if group_key:
+                self._cache.set(group_key, entry)
+        return config
+
+    def _refresh_in_background(self, key, fetch, *args):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+        _in_background(self._refresh, key, fetch, *args)
+
+    def _refresh(self, key, fetch, *args):
+        try:
+            if self._fetch(fetch, *args) is None:
+                self._cache.delete(key)
+        except Exception as e:
+            logger.warning(
+                'Could not refresh data set config, serving stale: {}'.format(
+                    e))
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+
+def _in_background(fn, *args):
+    thread = threading.Thread(target=fn, args=args)
+    thread.daemon = True
+    thread.start()
+
+
+def _name_key(name):
+    return u'name:{}'.format(name)
+
+
+def _group_key(data_group, data_type):
+    return u'group:{}:{}'.format(data_group, data_type)
+
+
+def _group_key_for(config):
+    if config.get('data_group') and config.get('data_type'):
+        return _group_key(config['data_group'], config['data_type'])
@@ -1,28 +1,44 @@
 from flask import logging
-from .records import add_auto_ids, parse_timestamps, validate_record,\
-    add_period_keys, encode_unicode_records
-from .validation import validate_record_schema
+from .records import process_records
 from .nested_merge import nested_merge, flat_merge
-from .errors import InvalidSortError
+from .errors import DataSetCreationError, InvalidSortError
+from .rollups import PeriodRollups, rollup_days
 from backdrop.core.response import (FlatData, GroupedData, PeriodData,
                                     PeriodGroupedData, PeriodFlatData,
                                     SimpleData)
 
 import timeutils
 import datetime
+import tempfile
+import cPickle as pickle
+from collections import namedtuple
+from itertools import islice
 
 log = logging.getLogger(__name__)
 
 DEFAULT_MAX_AGE_EXPECTED = 2678400
+DEFAULT_STORE_CHUNK_SIZE = 1000
+# Prepared records are held in memory up to this many bytes when streaming,
+# and written to a temporary file beyond it
+STORE_SPOOL_SIZE = 1024 * 1024
+
+StoredRecords = namedtuple('StoredRecords', 'errors count earliest latest')
 
 
 class DataSet(object):
 
-    def __init__(self, storage, config):
+    def __init__(self, storage, config, period_rollups=False,
+                 queue_rollup_update=None):
+        """Rollups are updated as part of each write, unless a
+        queue_rollup_update function is given, which is passed the name of
+        the data set and the days to update."""
         self.storage = storage
         self.config = config
 
         self._last_updated = None
+        self._rollups = PeriodRollups(storage, self.name) \
+            if period_rollups else None
+        self._queue_rollup_update = queue_rollup_update
 
     @property
     def name(self):
@@ -44,6 +60,13 @@ class DataSet(object):
             self._last_updated = self.storage.get_last_updated(self.name)
             return self._last_updated
 
+    def get_rollups_last_updated(self, query):
+        """When the rollups which may answer the query were last updated,
+        or None if they can't answer it"""
+        if self._rollups is None:
+            return None
+        return self._rollups.get_last_updated(query)
+
     def get_seconds_out_of_date(self):
         now = timeutils.now()
         max_age_expected = self.get_max_age_expected()
@@ -68,65 +91,166 @@ class DataSet(object):
         ).total_seconds())
 
     def create_if_not_exists(self):
-        if not self.storage.data_set_exists(self.name):
-            self.storage.create_data_set(self.name, self.config['capped_size'])
+        """Create the data set if it doesn't exist, and return whether it
+        didn't, in which case it needs its indexes ensured"""
+        if self.storage.data_set_exists(self.name):
+            return False
+        try:
+            self.storage.create_data_set(
+                self.name, self.config['capped_size'])
+        except DataSetCreationError:
+            # Created by another process since we looked
+            pass
+        return True
+
+    def ensure_indexes(self):
+        """Index the fields in the data set's indexed_fields config. This
+        can take as long as the table takes to scan, so it isn't part of
+        writes."""
+        self.storage.ensure_indexes(
+            self.name, self.config.get('indexed_fields') or [])
 
     def patch(self, record_id, record):
-        if self.storage.find_record(self.name, record_id) is not None:
-            return self.storage.update_record(self.name, record_id, record)
-        else:
+        if self.patch_records({record_id: record}):
             return 'No record found with id {}'.format(record_id)
 
+    def patch_records(self, patches):
+        """Set fields on existing records, given a dict of fields by record
+        id, and return the ids of the records which were not found"""
+        previous = self.storage.patch_records(self.name, patches)
+        self._update_rollups(
+            previous.values() +
+            [patches[record_id].get('_timestamp') for record_id in previous])
+        return [record_id for record_id in patches
+                if record_id not in previous]
+
     def delete(self, record_id):
-        if self.storage.find_record(self.name, record_id) is not None:
-            return self.storage.delete_record(self.name, record_id)
-        return 'No record found with id {}'.format(record_id)
+        if self.delete_records([record_id]):
+            return 'No record found with id {}'.format(record_id)
+
+    def delete_records(self, record_ids):
+        """Delete records by id and return the ids which were not found"""
+        previous = self.storage.delete_records(self.name, record_ids)
+        self._update_rollups(previous.values())
+        return [record_id for record_id in record_ids
+                if record_id not in previous]
+
+    def delete_between(self, start_at, end_at):
+        """Delete the records with a _timestamp from start_at up to end_at
+        and return how many were deleted"""
+        deleted = self.storage.delete_records_between(
+            self.name, start_at, end_at)
+        if deleted and self._rollups is not None:
+            self._rollups.delete_between(start_at, end_at)
+        return deleted
 
     def empty(self):
-        return self.storage.empty_data_set(self.name)
+        result = self.storage.empty_data_set(self.name)
+        if self._rollups is not None:
+            self._rollups.rebuild()
+        return result
+
+    def rebuild_rollups(self):
+        """Returns False if the data set was written to during the rebuild,
+        which leaves the rollups unused until they are rebuilt again"""
+        if self._rollups is None:
+            raise ValueError('Period rollups are not enabled')
+        return self._rollups.rebuild()
+
+    def _update_rollups(self, timestamps):
+        if self._rollups is None:
+            return
+        days = rollup_days(timestamps)
+        if not days:
+            return
+        if self._queue_rollup_update is not None:
+            self._queue_rollup_update(self.name, days)
+        else:
+            self._rollups.update(days)
 
-    def store(self, records):
+    def store(self, records, chunk_size=DEFAULT_STORE_CHUNK_SIZE):
         log.info('received {} records'.format(len(records)))
 
-        records = encode_unicode_records(records)
-
-        # Validate schema
-        errors = []
-        if 'schema' in self.config:
-            for record in records:
-                # doesn't change data, no need to return records
-                errors += validate_record_schema(record, self.config['schema'])
-
-        # Add auto-id keys
-        records, auto_id_errors = add_auto_ids(
-            records,
-            self.config.get('auto_ids', None))
-        errors += auto_id_errors
-
-        # Parse timestamps
-        records, timestamp_errors = separate_errors_and_records(
-            map(parse_timestamps, records))
-        errors += timestamp_errors
-
-        # Custom record validations
-        # doesn't change data, no need to return records
-        errors += filter(None, map(validate_record, records))
-
-        # Add period data returns no errors so
-        # return if we have errors before this point
+        # Nothing is saved unless every record is valid
+        errors = self.prepare(records)
         if errors:
             return errors
-        else:
-            # Add period data
-            records = map(add_period_keys, records)
 
-            for record in records:
-                self.storage.save_record(self.name, record)
-            # errors should be empty
-            return errors
+        self.save_prepared(records, chunk_size)
+        # errors should be empty
+        return errors
+
+    def prepare(self, records):
+        """Validate records, and add auto ids and period keys to them, in a
+        single pass and in place. Returns a list of errors."""
+        errors = []
+        for index, record, record_errors in process_records(
+                records,
+                self.config.get('schema'),
+                self.config.get('auto_ids')):
+            if record_errors:
+                log.debug('record {} is invalid: {}'.format(
+                    index, record_errors))
+                errors += record_errors
+        return errors
+
+    def save_prepared(self, records, chunk_size=DEFAULT_STORE_CHUNK_SIZE):
+        """Save records which have already been through prepare"""
+        for chunk in chunks(records, chunk_size):
+            self.storage.save_records(self.name, chunk)
+        self._update_rollups(record.get('_timestamp') for record in records)
+
+    def store_stream(self, records, chunk_size=DEFAULT_STORE_CHUNK_SIZE):
+        """Store records from any iterable, holding at most chunk_size of
+        them in memory at once.
+
+        Records are prepared as they arrive and spooled to a temporary file
+        until the last one has been validated, so, as with store, nothing
+        is saved unless every record is valid. Errors are prefixed with the
+        index of the record they are for.
+
+        Returns a StoredRecords of the errors, the number of records, and
+        the earliest and latest _timestamp stored.
+        """
+        errors = []
+        count = 0
+        earliest = latest = None
+        days = set()
+
+        with tempfile.SpooledTemporaryFile(STORE_SPOOL_SIZE) as spool:
+            for index, record, record_errors in process_records(
+                    records,
+                    self.config.get('schema'),
+                    self.config.get('auto_ids')):
+                count += 1
+                if record_errors:
+                    errors += ['record {}: {}'.format(index, error)
+                               for error in record_errors]
+                elif not errors:
+                    pickle.dump(record, spool, pickle.HIGHEST_PROTOCOL)
+                    timestamp = record.get('_timestamp')
+                    if timestamp is not None:
+                        earliest = min(earliest or timestamp, timestamp)
+                        latest = max(latest or timestamp, timestamp)
+                        days.add(record['_day_start_at'])
+
+            log.info('received {} records'.format(count))
+            if errors:
+                return StoredRecords(errors, count, None, None)
+
+            spool.seek(0)
+            for chunk in chunks(_unpickle_all(spool), chunk_size):
+                self.storage.save_records(self.name, chunk)
+
+        self._update_rollups(days)
+        return StoredRecords(errors, count, earliest, latest)
 
     def execute_query(self, query):
-        results = self.storage.execute_query(self.name, query)
+        results = None
+        if self._rollups is not None:
+            results = self._rollups.execute_query(query)
+        if results is None:
+            results = self.storage.execute_query(self.name, query)
 
         data = build_data(results, query)
 
@@ -137,6 +261,16 @@ class DataSet(object):
 
         return data.data()
 
+    def iter_query(self, query, stream_after=None):
+        """Iterate over the records matched by a raw query without holding
+        them all in memory. Records after the first stream_after are to be
+        streamed to a client, which limits how many queries may do so at
+        once."""
+        if query.is_grouped:
+            raise ValueError('Only raw queries can be iterated over')
+        return self.storage.iter_query(
+            self.name, query, stream_after=stream_after)
+
 
 def build_data(results, query):
     if not query.is_grouped:
@@ -199,16 +333,27 @@ def _limit_grouped_results(results, limit):
     return results[:limit] if limit else results
 
 
-def separate_errors_and_records(errors_and_records):
-    """
-    >>> errors_and_records = [({'the_record':'foo'}, "ERROR"),
-    ...                       ({'another':'thing'}, None)]
-    >>> separate_errors_and_records(errors_and_records)
-    ([{'the_record': 'foo'}, {'another': 'thing'}], ['ERROR'])
+def _unpickle_all(fileobj):
+    while True:
+        try:
+            yield pickle.load(fileobj)
+        except EOFError:
+            return
+
+
+def chunks(items, size):
+    """Split an iterable into consecutive lists of at most size items
+
+    >>> list(chunks([1, 2, 3, 4, 5], 2))
+    [[1, 2], [3, 4], [5]]
+    >>> list(chunks(iter([1, 2, 3]), 2))
+    [[1, 2], [3]]
+    >>> list(chunks([], 2))
+    []
     """
-    records = map(lambda item: item[0],
-                  errors_and_records)
-    errors = map(lambda item: item[1],
-                 filter(lambda item: item[1] is not None,
-                        errors_and_records))
-    return (records, errors)
+    items = iter(items)
+    while True:
+        chunk = list(islice(items, size))
+        if not chunk:
+            return
+        yield chunk
@@ -1,6 +1,6 @@
 from werkzeug.routing import BaseConverter, ValidationError
 from backdrop.core.validation import data_set_is_valid
-from flask import request
+from flask import has_request_context, request
 
 
 class DataSetConverter(BaseConverter):
@@ -12,4 +12,8 @@ class DataSetConverter(BaseConverter):
 
 
 def generate_request_id():
+    # Stagecraft is also called from background threads, such as when
+    # refreshing cached data set configs, where there is no request.
+    if not has_request_context():
+        return ''
     return request.headers.get('Govuk-Request-Id', '')
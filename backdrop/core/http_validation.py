@@ -11,6 +11,9 @@ def etag(func):
     @wraps(func)
     def new_func(*args, **kwargs):
         resp = make_response(func(*args, **kwargs))
+        # Hashing a streamed response would read it all into memory
+        if resp.is_streamed:
+            return resp
         resp.set_etag(hashlib.sha1(resp.data).hexdigest())
         resp.make_conditional(request)
         return resp
@@ -0,0 +1,133 @@
+"""
+Incremental parsing of JSON documents read from a stream.
+
+Write payloads are usually a top-level array of records. Parsing the whole
+document at once holds every record in memory together; iter_json_items
+reads the stream a block at a time and yields the records one by one.
+"""
+import json
+import re
+
+from .errors import ParseError
+
+DEFAULT_READ_SIZE = 64 * 1024
+
+_WHITESPACE = ' \t\n\r'
+_NUMBER_CHARACTERS = '0123456789.eE+-'
+_ERROR_POSITION = re.compile(r'^(.*?): line \d+ column \d+ \(char (\d+)\)')
+
+
+def iter_json_items(stream, read_size=DEFAULT_READ_SIZE):
+    """Yield the items of a top-level JSON array read from stream, or the
+    document itself if it isn't an array. Raises ParseError for invalid
+    JSON, once the items before the error have been yielded.
+
+    >>> from io import BytesIO
+    >>> list(iter_json_items(BytesIO('[{"a": 1}, 23, "four"]'), read_size=2))
+    [{u'a': 1}, 23, u'four']
+    >>> list(iter_json_items(BytesIO('{"a": 1}')))
+    [{u'a': 1}]
+    >>> list(iter_json_items(BytesIO('[1, 2')))
+    Traceback (most recent call last):
+        ...
+    ParseError: Expecting , delimiter or ] at character 5
+    """
+    reader = _JsonReader(stream, read_size)
+
+    if reader.peek() != '[':
+        value = reader.value()
+        reader.expect_end()
+        yield value
+        return
+
+    reader.advance()
+    if reader.peek() == ']':
+        reader.advance()
+    else:
+        while True:
+            yield reader.value()
+            delimiter = reader.peek()
+            if delimiter not in (',', ']'):
+                reader.error('Expecting , delimiter or ]')
+            reader.advance()
+            if delimiter == ']':
+                break
+    reader.expect_end()
+
+
+class _JsonReader(object):
+
+    """A window onto a stream holding at least the JSON value being parsed.
+    Values are decoded with the json module, reading further into the stream
+    and retrying when one runs past the end of what has been read."""
+
+    def __init__(self, stream, read_size):
+        self._stream = stream
+        self._read_size = read_size
+        self._decoder = json.JSONDecoder()
+        self._buffer = b''
+        self._pos = 0
+        # the position in the stream of the start of the buffer
+        self._offset = 0
+        self._eof = False
+
+    def peek(self):
+        """Skip whitespace and return the next character, or '' at the end
+        of the stream"""
+        while True:
+            while (self._pos < len(self._buffer) and
+                   self._buffer[self._pos] in _WHITESPACE):
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._read(self._read_size):
+                return ''
+
+    def advance(self):
+        self._pos += 1
+
+    def value(self):
+        self.peek()
+        read_size = self._read_size
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+                # a number running up to the end of what has been read, or
+                # cut off part way through, may continue after it
+                if self._eof or (end < len(self._buffer) and
+                                 self._buffer[end] not in _NUMBER_CHARACTERS):
+                    self._pos = end
+                    return value
+            except ValueError as e:
+                if self._eof:
+                    self._decode_error(e)
+            # read more each time, so that a large value isn't decoded from
+            # the start over and over again
+            self._read(read_size)
+            read_size *= 2
+
+    def expect_end(self):
+        if self.peek() != '':
+            self.error('Extra data')
+
+    def error(self, message):
+        raise ParseError('{} at character {}'.format(
+            message, self._offset + self._pos))
+
+    def _decode_error(self, e):
+        match = _ERROR_POSITION.match(str(e))
+        if match is None:
+            self.error(str(e))
+        message, position = match.groups()
+        self._pos = int(position)
+        self.error(message)
+
+    def _read(self, size):
+        data = self._stream.read(size)
+        if not data:
+            self._eof = True
+            return False
+        self._offset += self._pos
+        self._buffer = self._buffer[self._pos:] + data
+        self._pos = 0
+        return True
@@ -1,5 +1,6 @@
 from .errors import InvalidOperationError
 
+from collections import OrderedDict
 from operator import add
 import itertools
 
@@ -12,6 +13,62 @@ def _multi_itemgetter(items):
     return lambda obj: tuple(obj[item] for item in items)
 
 
+class CollectedValues(object):
+
+    """The values of a collect field for one group, already summarised by
+    the storage engine rather than returned as a list
+
+    Only the parts needed by the requested collect methods are filled in.
+    Summaries can be added together, like lists, to combine subgroups.
+
+    >>> values = CollectedValues(sum=3, count=2) + CollectedValues(sum=4, count=1)
+    >>> values.reduce('sum'), values.reduce('count'), values.reduce('mean')
+    (7, 3, 2.3333333333333335)
+    >>> CollectedValues(distinct=['b', 'a']).reduce('set')
+    ['a', 'b']
+    >>> CollectedValues(sum=3, non_numeric=1).reduce('sum')
+    Traceback (most recent call last):
+        ...
+    InvalidOperationError: Unable to sum that data
+    >>> CollectedValues(sum=0, count=0).reduce('mean')
+    Traceback (most recent call last):
+        ...
+    InvalidOperationError: Unable to find the mean of that data
+    """
+
+    def __init__(self, sum=None, count=None, distinct=None, non_numeric=0):
+        self.sum = sum
+        self.count = count
+        self.distinct = distinct
+        self.non_numeric = non_numeric
+
+    def __add__(self, other):
+        def add_if_present(a, b):
+            return None if a is None or b is None else a + b
+
+        return CollectedValues(
+            sum=add_if_present(self.sum, other.sum),
+            count=add_if_present(self.count, other.count),
+            distinct=add_if_present(self.distinct, other.distinct),
+            non_numeric=self.non_numeric + other.non_numeric)
+
+    def reduce(self, method):
+        if method == 'sum':
+            if self.non_numeric:
+                raise InvalidOperationError("Unable to sum that data")
+            return self.sum
+        if method == 'count':
+            return self.count
+        if method == 'mean':
+            if self.non_numeric or not self.count or self.sum is None:
+                raise InvalidOperationError(
+                    "Unable to find the mean of that data")
+            return self.sum / float(self.count)
+        if method == 'set':
+            return sorted(list(set(self.distinct)))
+        raise ValueError("Unknown collection method {}".format(method))
+
+
 def nested_merge(keys, collect, data):
     if len(keys) > 1:
         data = group_by(data, keys)
@@ -136,6 +193,18 @@ def replace_default_method(method):
     return "set" if method == "default" else method
 
 
+def get_collect_methods(collect):
+    """Group the requested collect methods by field
+
+    >>> get_collect_methods([('foo', 'sum'), ('bar', 'default'), ('foo', 'mean')])
+    [('foo', set(['sum', 'mean'])), ('bar', set(['set']))]
+    """
+    methods = OrderedDict()
+    for field, method in collect:
+        methods.setdefault(field, set()).add(replace_default_method(method))
+    return methods.items()
+
+
 def collect_key(key, method):
     """Return the key for a given collect field and method
 
@@ -149,7 +218,10 @@ def collect_key(key, method):
 
 def collect_value(group, key, method):
     reducer = collect_reducer(method)
-    return reducer(collect_all_values(group, key))
+    values = collect_all_values(group, key)
+    if isinstance(values, CollectedValues):
+        return values.reduce(replace_default_method(method))
+    return reducer(values)
 
 
 def collect_all_values(group, key):
@@ -214,10 +286,14 @@ def collect_reducer_mean(values):
     Traceback (most recent call last):
         ...
     InvalidOperationError: Unable to find the mean of that data
+    >>> collect_reducer_mean([])
+    Traceback (most recent call last):
+        ...
+    InvalidOperationError: Unable to find the mean of that data
     """
     try:
         return sum(values) / float(len(values))
-    except TypeError:
+    except (TypeError, ZeroDivisionError):
         raise InvalidOperationError("Unable to find the mean of that data")
 
 
@@ -2,27 +2,120 @@ import StringIO
 import csv
 import itertools
 
+DEFAULT_HEADER_LOOKAHEAD = 1000
+ROWS_PER_CHUNK = 100
+SUBGROUP_KEYS = ['values', '_subgroup']
+
 
 def json_to_csv(data):
     if not isinstance(data, (list, tuple)):
         return ""
 
-    string = StringIO.StringIO()
-    out = csv.writer(string)
+    return ''.join(iter_csv(data))
+
+
+def iter_csv(data, lookahead=DEFAULT_HEADER_LOOKAHEAD):
+    """Yield CSV for a list or iterator of records a chunk at a time,
+    flattening nested subgroups into rows of their own
+
+    The header is every field in the data, sorted. When data is an
+    iterator only the first `lookahead` rows are used to find the header.
+    Fields first seen after that are left out, and a warning naming them
+    is written as the last row.
+
+    >>> ''.join(iter_csv(iter([{'b': 1}, {'a': 2}, {'c': 3}]), lookahead=2))
+    'a,b\\r\\n,1\\r\\n2,\\r\\n,\\r\\nWarning: fields first seen after row 2 were left out: c\\r\\n'
+    """
+    rows = (row for row in flatten_subgroups(data) if row)
+
+    if isinstance(data, (list, tuple)):
+        header = _header(flatten_subgroups(data))
+    else:
+        head = list(itertools.islice(rows, lookahead))
+        header = _header(head)
+        rows = itertools.chain(head, rows)
 
-    header = set(itertools.chain.from_iterable(i.keys() for i in data))
-    header = sorted(list(header))
+    if not header:
+        return
 
-    parsed = []
-    for item in data:
-        if not item:
+    writer = _ChunkWriter()
+    writer.writerow(header)
+    fields = set(header)
+    left_out = set()
+    for row in rows:
+        if not fields.issuperset(row):
+            left_out.update(key for key in row if key not in fields)
+        writer.writerow([_encode(row.get(key, "")) for key in header])
+        if writer.rows >= ROWS_PER_CHUNK:
+            yield writer.flush()
+    if left_out:
+        writer.writerow([
+            'Warning: fields first seen after row {} were left out: '
+            '{}'.format(lookahead, ', '.join(
+                _encode(key) for key in sorted(left_out)))])
+    yield writer.flush()
+
+
+def flatten_subgroups(records):
+    """Replace each record that has subgroups, as in nested grouped output,
+    with one row per subgroup which also carries the record's own fields
+
+    >>> list(flatten_subgroups([
+    ...     {'a': 1, '_count': 3,
+    ...      'values': [{'b': 2, '_count': 1}, {'b': 3, '_count': 2}]},
+    ...     {'a': 2, '_count': 1}]))
+    [{'a': 1, '_count': 1, 'b': 2}, {'a': 1, '_count': 2, 'b': 3}, \
+{'a': 2, '_count': 1}]
+    """
+    for record in records:
+        subgroups = _subgroups(record)
+        if subgroups is None:
+            yield record
             continue
-        if not parsed:
-            parsed = [header]
-        line = [item.get(i, "") for i in header]
-        line = [i.encode("utf8") if isinstance(
-            i, basestring) else i for i in line]
-        parsed.append(line)
-
-    out.writerows(parsed)
-    return string.getvalue()
+
+        parent = dict((key, value) for key, value in record.items()
+                      if key not in SUBGROUP_KEYS)
+        for subgroup in flatten_subgroups(subgroups):
+            row = parent.copy()
+            row.update(subgroup)
+            yield row
+
+
+def _subgroups(record):
+    if not record:
+        return None
+    for key in SUBGROUP_KEYS:
+        value = record.get(key)
+        if isinstance(value, list) and \
+                all(isinstance(item, dict) for item in value):
+            return value
+
+
+def _header(rows):
+    return sorted(set(itertools.chain.from_iterable(
+        row.keys() for row in rows if row)))
+
+
+def _encode(value):
+    return value.encode("utf8") if isinstance(value, basestring) else value
+
+
+class _ChunkWriter(object):
+
+    """A csv writer which hands back what has been written so far"""
+
+    def __init__(self):
+        self._buffer = StringIO.StringIO()
+        self._writer = csv.writer(self._buffer)
+        self.rows = 0
+
+    def writerow(self, row):
+        self._writer.writerow(row)
+        self.rows += 1
+
+    def flush(self):
+        chunk = self._buffer.getvalue()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        self.rows = 0
+        return chunk
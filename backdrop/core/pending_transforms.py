@@ -0,0 +1,141 @@
+"""
+Coalescing of transform dispatch for data sets which are written to often.
+
+Every write used to send its own dispatch entrypoint task, each of which
+looks up the data set's transforms in Stagecraft and re-runs all of them.
+With a debounce interval set, the time range of each write is merged into
+a pending window for its data set in Redis instead, and only the first
+write in a window schedules a dispatch_pending task, to run once the
+interval has passed. That task takes the whole window, covering the union
+of every write's time range, and dispatches the transforms once for it.
+
+If that task is lost, the mark that it was scheduled expires soon after it
+was due, so the next write to the data set schedules another for the same
+window.
+"""
+import calendar
+import logging
+
+import redis
+
+from .timeutils import parse_time_as_utc
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PENDING_TTL = 60 * 60
+# How long after it was due a dispatch which hasn't taken its window is
+# taken to have been lost
+LOST_DISPATCH_AFTER = 5 * 60
+
+ENTRYPOINT_TASK = 'backdrop.transformers.dispatch.entrypoint'
+DISPATCH_PENDING_TASK = 'backdrop.transformers.dispatch.dispatch_pending'
+
+
+class PendingTransforms(object):
+
+    """The windows of writes waiting for transforms to be dispatched, kept
+    in Redis so that they are shared by every write process.
+
+    A window is a sorted set of timestamps scored by time, trimmed to its
+    earliest and latest on every write. Windows expire after ttl seconds in
+    case the task which should take one is lost and nothing more is written.
+    The mark that a dispatch is scheduled expires LOST_DISPATCH_AFTER
+    seconds after the dispatch is due, so that later writes can schedule
+    another.
+    """
+
+    def __init__(self, redis_client, ttl=DEFAULT_PENDING_TTL,
+                 prefix='backdrop:transforms:', debounce=0):
+        self._redis = redis_client
+        self.ttl = ttl
+        self._prefix = prefix
+        self.scheduled_ttl = min(ttl, debounce + LOST_DISPATCH_AFTER)
+
+    @classmethod
+    def from_url(cls, url, ttl=DEFAULT_PENDING_TTL, debounce=0):
+        return cls(redis.StrictRedis.from_url(url), ttl, debounce=debounce)
+
+    def add(self, data_set_name, earliest, latest):
+        """Merge a time range into the data set's pending window. Returns
+        True if there was no pending window, in which case the caller should
+        schedule a dispatch for it."""
+        earliest = parse_time_as_utc(earliest)
+        latest = parse_time_as_utc(latest)
+        window_key, scheduled_key = self._keys(data_set_name)
+
+        pipe = self._redis.pipeline()
+        pipe.zadd(window_key,
+                  _score(earliest), earliest.isoformat(),
+                  _score(latest), latest.isoformat())
+        pipe.zremrangebyrank(window_key, 1, -2)
+        pipe.expire(window_key, self.ttl)
+        # The window is added to before checking whether a dispatch is
+        # scheduled, so a dispatch taking it in between sees this write
+        pipe.set(scheduled_key, 1, ex=self.scheduled_ttl, nx=True)
+        return bool(pipe.execute()[-1])
+
+    def unschedule(self, data_set_name):
+        """Forget that a dispatch was scheduled for the data set's window,
+        when it couldn't be sent, so that the next write schedules one"""
+        _, scheduled_key = self._keys(data_set_name)
+        self._redis.delete(scheduled_key)
+
+    def take(self, data_set_name):
+        """Remove the data set's pending window and return its earliest and
+        latest times, or None if there is no window"""
+        window_key, scheduled_key = self._keys(data_set_name)
+
+        pipe = self._redis.pipeline()
+        pipe.zrange(window_key, 0, 0)
+        pipe.zrange(window_key, -1, -1)
+        pipe.delete(window_key, scheduled_key)
+        first, last, _ = pipe.execute()
+        if not first:
+            return None
+        return parse_time_as_utc(first[0]), parse_time_as_utc(last[0])
+
+    def _keys(self, data_set_name):
+        key = self._prefix + data_set_name
+        return key + ':window', key + ':scheduled'
+
+
+def create_pending_transforms(config):
+    """Create PendingTransforms from the TRANSFORM_* settings in a flask app
+    config, or return None if transforms aren't coalesced"""
+    debounce = config.get('TRANSFORM_DEBOUNCE', 0)
+    if debounce <= 0:
+        return None
+    return PendingTransforms.from_url(
+        config.get('TRANSFORM_REDIS_URL') or config['BROKER_URL'],
+        debounce + config.get('TRANSFORM_PENDING_TTL', DEFAULT_PENDING_TTL),
+        debounce)
+
+
+def dispatch_transforms(celery_app, data_set_name, earliest, latest,
+                        pending_transforms=None, debounce=0):
+    """Send the task which dispatches a data set's transforms for a time
+    range, or coalesce it with others over debounce seconds if
+    pending_transforms is given. If Redis can't be reached the transforms
+    are dispatched straight away."""
+    if pending_transforms is not None and debounce > 0:
+        try:
+            if pending_transforms.add(data_set_name, earliest, latest):
+                try:
+                    celery_app.send_task(DISPATCH_PENDING_TASK,
+                                         args=(data_set_name,),
+                                         countdown=debounce)
+                except Exception:
+                    pending_transforms.unschedule(data_set_name)
+                    raise
+            return
+        except redis.RedisError as e:
+            logger.warning('Could not coalesce transforms for {}: {}'.format(
+                data_set_name, e))
+
+    celery_app.send_task(ENTRYPOINT_TASK,
+                         args=(data_set_name, earliest, latest))
+
+
+def _score(timestamp):
+    return calendar.timegm(timestamp.utctimetuple()) + \
+        timestamp.microsecond / 1e6
@@ -0,0 +1,85 @@
+"""
+Compute the start of every period in timeseries.PERIODS for a timestamp in
+one go.
+
+Period.start works well for a single period but is slow when it is called
+six times for every stored record, mostly through relativedelta in
+Week.start. Here the hour, day and week starts are worked out with integer
+arithmetic on seconds since the epoch, and the month, quarter and year
+starts are built straight from the date fields.
+"""
+import calendar
+from datetime import datetime, timedelta
+
+from .timeseries import HOUR, DAY, WEEK, MONTH, QUARTER, YEAR
+
+_EPOCH = datetime(1970, 1, 1)
+
+_SECONDS_PER_HOUR = 60 * 60
+_SECONDS_PER_DAY = 24 * _SECONDS_PER_HOUR
+# 1970-01-01 was a Thursday, three days after the start of its week
+_EPOCH_WEEKDAY = 3
+
+
+def period_starts(timestamp, day_cache=None):
+    """Return a dict of period start_at_key to the start of that period
+    containing timestamp, keeping the timestamp's tzinfo.
+
+    Everything but the hour start only depends on the day, so passing the
+    same dict as day_cache for many timestamps works that part out once for
+    each day.
+
+    >>> starts = period_starts(datetime(2012, 12, 12, 12, 12))
+    >>> starts['_hour_start_at']
+    datetime.datetime(2012, 12, 12, 12, 0)
+    >>> starts['_week_start_at']
+    datetime.datetime(2012, 12, 10, 0, 0)
+    >>> starts['_quarter_start_at']
+    datetime.datetime(2012, 10, 1, 0, 0)
+    """
+    if day_cache is None:
+        day_starts = _day_starts(timestamp)
+    else:
+        day = (timestamp.date(), timestamp.tzinfo)
+        day_starts = day_cache.get(day)
+        if day_starts is None:
+            day_starts = day_cache[day] = _day_starts(timestamp)
+
+    hour_start = timestamp.replace(minute=0, second=0, microsecond=0)
+    return dict(day_starts, **{HOUR.start_at_key: hour_start})
+
+
+def batch_period_starts(timestamps):
+    """Return period_starts for each of a list of timestamps
+
+    >>> [a, b] = batch_period_starts([datetime(2012, 12, 12, 1),
+    ...                               datetime(2012, 12, 12, 2)])
+    >>> a['_day_start_at'] is b['_day_start_at']
+    True
+    >>> a['_hour_start_at'], b['_hour_start_at']
+    (datetime.datetime(2012, 12, 12, 1, 0), datetime.datetime(2012, 12, 12, 2, 0))
+    """
+    day_cache = {}
+    return [period_starts(timestamp, day_cache) for timestamp in timestamps]
+
+
+def _day_starts(timestamp):
+    tzinfo = timestamp.tzinfo
+    seconds = calendar.timegm(timestamp.timetuple())
+    days = seconds // _SECONDS_PER_DAY
+    week_days = days - (days + _EPOCH_WEEKDAY) % 7
+
+    year, month = timestamp.year, timestamp.month
+    quarter_month = month - (month - 1) % 3
+
+    return {
+        DAY.start_at_key: _from_epoch_days(days, tzinfo),
+        WEEK.start_at_key: _from_epoch_days(week_days, tzinfo),
+        MONTH.start_at_key: datetime(year, month, 1, tzinfo=tzinfo),
+        QUARTER.start_at_key: datetime(year, quarter_month, 1, tzinfo=tzinfo),
+        YEAR.start_at_key: datetime(year, 1, 1, tzinfo=tzinfo),
+    }
+
+
+def _from_epoch_days(days, tzinfo):
+    return (_EPOCH + timedelta(days=days)).replace(tzinfo=tzinfo)
@@ -12,7 +12,7 @@ _Query = namedtuple(
     '_Query',
     ['start_at', 'end_at', 'delta', 'period',
      'filter_by', 'filter_by_prefix', 'group_by', 'sort_by', 'limit',
-     'collect', 'flatten', 'inclusive'])
+     'collect', 'flatten', 'inclusive', 'after', 'ids'])
 
 
 class Query(_Query):
@@ -22,7 +22,7 @@ class Query(_Query):
                start_at=None, end_at=None, duration=None, delta=None,
                period=None, filter_by=None, filter_by_prefix=None,
                group_by=None, sort_by=None, limit=None, collect=None,
-               flatten=None, inclusive=None):
+               flatten=None, inclusive=None, after=None, ids=None):
         delta = None
         if duration is not None:
             date = start_at or end_at or now()
@@ -31,7 +31,7 @@ class Query(_Query):
                                                              delta)
         return Query(start_at, end_at, delta, period, filter_by or [],
                      filter_by_prefix or [], group_by or [], sort_by, limit,
-                     collect or [], flatten, inclusive)
+                     collect or [], flatten, inclusive, after, ids or [])
 
     @staticmethod
     def __calculate_start_and_end(period, date, delta):
@@ -88,6 +88,25 @@ class Query(_Query):
         """
         return bool(self.group_by) or bool(self.period)
 
+    @property
+    def is_paginated(self):
+        """Raw queries without sort_by which ask for a page with `after`
+        are returned in _timestamp and _id order, so that the next page can
+        be asked for with the last record's. An empty `after` asks for the
+        first page.
+
+        >>> Query.create(after=()).is_paginated
+        True
+        >>> Query.create(limit=10).is_paginated
+        False
+        >>> Query.create(after=(), sort_by=['foo', 'ascending']).is_paginated
+        False
+        >>> Query.create().is_paginated
+        False
+        """
+        return (not self.is_grouped and not self.sort_by and
+                self.after is not None)
+
     def get_shifted_query(self, shift):
         """Return a new Query where the date is shifted by n periods"""
         args = self._asdict()
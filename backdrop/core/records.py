@@ -2,9 +2,10 @@
 
 from base64 import b64encode
 
-from backdrop.core.timeseries import PERIODS
+from backdrop.core.period_buckets import period_starts
 from backdrop.core.timeutils import parse_time_as_utc
 from backdrop.core.validation import validate_record_data
+from backdrop.core.schema_validators import get_validator
 from .errors import ValidationError
 
 
@@ -156,13 +157,63 @@ def add_period_keys(record):
     datetime.datetime(2012, 1, 1, 0, 0, tzinfo=<UTC>)
     """
     if '_timestamp' in record:
-        for period in PERIODS:
-            record[period.start_at_key] = period.start(
-                record['_timestamp'])
+        record.update(period_starts(record['_timestamp']))
 
     return record
 
 
+def process_records(records, schema=None, auto_ids=None):
+    """Prepare records for storage, taking each record through every stage
+    in turn: encoding, schema validation, auto ids, timestamp parsing,
+    record validation and period keys.
+
+    Yields (index, record, errors) for each record as it goes, so a payload
+    can be fed through without building lists of it. Records are changed in
+    place. Period keys are only added to records without errors, and as with
+    add_auto_ids only the first missing auto id field error is reported.
+
+    >>> results = process_records([
+    ...     {'_timestamp': '2012-12-12T12:12:00Z'}, {'_timestamp': 'nope'}])
+    >>> index, record, errors = next(results)
+    >>> index, record['_week_start_at'], errors
+    (0, datetime.datetime(2012, 12, 10, 0, 0, tzinfo=<UTC>), [])
+    >>> index, record, errors = next(results)
+    >>> index, errors[-1]
+    (1, '_timestamp is not a valid datetime object')
+    """
+    validate_schema = get_validator(schema) if schema else None
+    day_cache = {}
+    auto_id_failed = False
+
+    for index, record in enumerate(records):
+        errors = []
+        encode_unicode_characters(record)
+
+        if validate_schema is not None:
+            errors += validate_schema(record)
+
+        if auto_ids:
+            try:
+                _add_auto_id(record, auto_ids)
+            except ValidationError as e:
+                if not auto_id_failed:
+                    errors.append(e.message)
+                auto_id_failed = True
+
+        record, error = parse_timestamps(record)
+        if error is not None:
+            errors.append(error)
+
+        error = validate_record(record)
+        if error is not None:
+            errors.append(error)
+
+        if not errors and '_timestamp' in record:
+            record.update(period_starts(record['_timestamp'], day_cache))
+
+        yield index, record, errors
+
+
 def validate_record(record):
     """Validate a record
 
@@ -0,0 +1,314 @@
+"""
+Period rollups: summaries of a data set by day, kept in a companion data set,
+which period queries can be answered from instead of the raw records.
+
+Each rollup record covers one UTC day. It holds the number of records and,
+for every field, the parts the collect methods need (a sum, a count, a count
+of non-numeric values and the distinct values) for the day as a whole and
+for each hour in it. Weeks, months, quarters and years are all made of whole
+days, so every period can be merged from them.
+
+Rollups for a day are rebuilt from its raw records whenever it is written
+to, which the write API leaves to the ingestion worker. A marker record
+is saved once every day has been built, and until then queries are answered
+from the raw records.
+"""
+import datetime
+
+import pytz
+
+from .nested_merge import CollectedValues, get_collect_methods
+from .query import Query
+from .timeseries import DAY, HOUR
+from .timeutils import parse_time_as_utc
+
+# Data set names can't start with an underscore, so this can't clash with
+# a data set of its own
+ROLLUP_PREFIX = '_rollups_'
+COMPLETE_ID = '_complete'
+MAX_DISTINCT_VALUES = 100
+
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=pytz.UTC)
+
+
+def rollup_data_set_name(data_set_name):
+    """
+    >>> rollup_data_set_name('foo_bar')
+    '_rollups_foo_bar'
+    """
+    return ROLLUP_PREFIX + data_set_name
+
+
+def can_use_rollups(query):
+    """Period queries without group_by or filters, whose time range falls on
+    whole days (or whole hours for hourly queries), can be answered from
+    rollups, as long as they don't collect internal fields, which rollups
+    leave out
+
+    >>> from .timeseries import WEEK
+    >>> start_at = datetime.datetime(2014, 1, 6, tzinfo=pytz.UTC)
+    >>> can_use_rollups(Query.create(period=WEEK, start_at=start_at,
+    ...                              end_at=start_at + WEEK.delta))
+    True
+    >>> can_use_rollups(Query.create(period=WEEK, group_by=['foo']))
+    False
+    >>> can_use_rollups(Query.create(
+    ...     period=WEEK, start_at=start_at + HOUR.delta))
+    False
+    >>> can_use_rollups(Query.create(
+    ...     period=HOUR, start_at=start_at + HOUR.delta))
+    True
+    >>> can_use_rollups(Query.create(period=WEEK, collect=[('_id', 'set')]))
+    False
+    """
+    granularity = HOUR if query.period is HOUR else DAY
+    return (query.period is not None and
+            not query.group_by and
+            not query.filter_by and
+            not query.filter_by_prefix and
+            not query.ids and
+            not query.inclusive and
+            not any(field.startswith('_') for field, _ in query.collect) and
+            all(timestamp is None or granularity.valid_start_at(timestamp)
+                for timestamp in [query.start_at, query.end_at]))
+
+
+def rollup_days(timestamps):
+    """The days whose rollups are changed by writes at the given timestamps
+
+    >>> rollup_days([datetime.datetime(2014, 1, 2, 9), None,
+    ...              '2014-01-01T10:00:00+00:00',
+    ...              datetime.datetime(2014, 1, 2, 10)])
+    [datetime.datetime(2014, 1, 1, 0, 0, tzinfo=<UTC>), datetime.datetime(2014, 1, 2, 0, 0, tzinfo=<UTC>)]
+    """
+    return sorted(set(DAY.start(parse_time_as_utc(timestamp))
+                      for timestamp in timestamps if timestamp is not None))
+
+
+class PeriodRollups(object):
+
+    def __init__(self, storage, data_set_name):
+        self._storage = storage
+        self._data_set_name = data_set_name
+        self.name = rollup_data_set_name(data_set_name)
+        self._complete = None
+
+    def is_complete(self):
+        """Whether the marker has been saved, looked up once per instance"""
+        if self._complete is None:
+            self._complete = bool(self._storage.execute_query(
+                self.name, Query.create(filter_by=[['_id', COMPLETE_ID]])))
+        return self._complete
+
+    def update(self, timestamps):
+        """Rebuild the rollups for the days containing the given timestamps
+        from the raw records"""
+        for day in rollup_days(timestamps):
+            records = self._storage.iter_query(
+                self._data_set_name,
+                Query.create(start_at=day, end_at=day + DAY.delta))
+            rollups = summarise_by_day(records)
+            if rollups:
+                self._storage.save_records(self.name, rollups)
+            else:
+                self._storage.delete_record(self.name, _day_id(day))
+
+    def delete_between(self, start_at, end_at):
+        """Bring the rollups up to date once the raw records from start_at
+        up to end_at have been deleted. The rollups for days wholly inside
+        the range are deleted along with them, so only the days at either
+        end need to be rebuilt."""
+        start_at = parse_time_as_utc(start_at)
+        end_at = parse_time_as_utc(end_at)
+        first_day = DAY.start(start_at)
+        if first_day < start_at:
+            first_day += DAY.delta
+        last_day = DAY.start(end_at)
+
+        if first_day < last_day:
+            # The marker shares its timestamp with the first day of 1970
+            keep_marker = first_day <= _EPOCH < last_day and \
+                self.is_complete()
+            self._storage.delete_records_between(
+                self.name, first_day, last_day)
+            if keep_marker:
+                self._storage.save_records(
+                    self.name, [{'_id': COMPLETE_ID, '_timestamp': _EPOCH}])
+
+        self.update([timestamp for timestamp in [start_at, end_at]
+                     if not DAY.valid_start_at(timestamp)])
+
+    def rebuild(self):
+        """Rebuild every rollup with a single pass over the raw records and
+        return whether they could be marked as complete.
+
+        The marker is cleared first, so that queries are answered from the
+        raw records while the rollups are rebuilt. Writes made meanwhile
+        update the rollups as usual and may be overwritten by the pass, so
+        the marker is only saved again if there were none.
+        """
+        self._storage.delete_record(self.name, COMPLETE_ID)
+        self._complete = False
+        written = self._last_written()
+
+        rollups = summarise_by_day(
+            self._storage.iter_query(self._data_set_name, Query.create()))
+        if self._last_written()[1] != written[1]:
+            return False
+
+        days = set(rollup['_id'] for rollup in rollups)
+        for rollup in self._storage.execute_query(self.name, Query.create()):
+            if rollup['_id'] not in days:
+                self._storage.delete_record(self.name, rollup['_id'])
+        self._storage.save_records(self.name, rollups)
+
+        if self._last_written()[0] != written[0]:
+            return False
+        self._storage.save_records(
+            self.name, [{'_id': COMPLETE_ID, '_timestamp': _EPOCH}])
+        self._complete = True
+        return True
+
+    def get_last_updated(self, query):
+        """When the rollups were last saved to, if they can answer the
+        query. The write API updates them after the raw records, so this
+        moves on again once they have caught up."""
+        if not can_use_rollups(query):
+            return None
+        return self._storage.get_last_updated(self.name)
+
+    def _last_written(self):
+        """When the raw records and the rollups were last saved to"""
+        return (self._storage.get_last_updated(self._data_set_name),
+                self._storage.get_last_updated(self.name))
+
+    def execute_query(self, query):
+        """Return the same results as the storage engine would for a period
+        query, or None if the rollups can't answer it"""
+        if not can_use_rollups(query) or not self.is_complete():
+            return None
+
+        start_at = query.start_at and DAY.start(query.start_at)
+        rollups = self._storage.execute_query(
+            self.name, Query.create(start_at=start_at, end_at=query.end_at))
+
+        collect_methods = get_collect_methods(query.collect)
+        results = {}
+        for timestamp, summary in _summaries(rollups, query):
+            if any('set' in methods and
+                   summary['fields'].get(field, {}).get('distinct', []) is None
+                   for field, methods in collect_methods):
+                # Too many distinct values were seen to keep them all
+                return None
+
+            row = _to_result(summary, collect_methods)
+            key = query.period.start(timestamp)
+            if key in results:
+                row = _add_results(results[key], row)
+            results[key] = row
+
+        return [dict(row, **{query.period.start_at_key: key})
+                for key, row in sorted(results.items())]
+
+
+def summarise_by_day(records):
+    """Build a rollup record for each day with records in it
+
+    >>> records = [
+    ...     {'_timestamp': datetime.datetime(2014, 1, 1, 9), 'a': 1, 'b': 'x'},
+    ...     {'_timestamp': datetime.datetime(2014, 1, 1, 10), 'a': 2}]
+    >>> [rollup] = summarise_by_day(records)
+    >>> rollup['_id'], rollup['_count']
+    ('2014-01-01', 2)
+    >>> sorted(rollup['fields']['a'].items())
+    [('count', 2), ('distinct', [1, 2]), ('non_numeric', 0), ('sum', 3)]
+    >>> sorted(rollup['hours'].keys())
+    ['09', '10']
+    """
+    rollups = {}
+    for record in records:
+        timestamp = record.get('_timestamp')
+        if timestamp is None:
+            continue
+        day = DAY.start(timestamp)
+        if day not in rollups:
+            rollups[day] = dict(_empty_summary(), _id=_day_id(day),
+                                _timestamp=day, hours={})
+        rollup = rollups[day]
+        _add_record(rollup, record)
+        _add_record(rollup['hours'].setdefault(
+            '{:02d}'.format(timestamp.hour), _empty_summary()), record)
+
+    return [rollups[day] for day in sorted(rollups)]
+
+
+def _day_id(day):
+    return day.strftime('%Y-%m-%d')
+
+
+def _empty_summary():
+    return {'_count': 0, 'fields': {}}
+
+
+def _add_record(summary, record):
+    summary['_count'] += 1
+    for field, value in record.items():
+        if field.startswith('_'):
+            continue
+
+        parts = summary['fields'].setdefault(
+            field, {'sum': 0, 'count': 0, 'non_numeric': 0, 'distinct': []})
+        parts['count'] += 1
+        # booleans are summed as 0 or 1, as they are by the storage engines
+        if isinstance(value, (int, long, float)):
+            parts['sum'] += value
+        else:
+            parts['non_numeric'] += 1
+
+        distinct = parts['distinct']
+        if distinct is not None and value not in distinct:
+            if len(distinct) >= MAX_DISTINCT_VALUES or \
+                    isinstance(value, (dict, list)):
+                parts['distinct'] = None
+            else:
+                distinct.append(value)
+
+
+def _summaries(rollups, query):
+    """Yield the start time and summary of every day, or every hour for
+    hourly queries, covered by the query"""
+    for rollup in rollups:
+        if rollup['_id'] == COMPLETE_ID:
+            continue
+
+        day = rollup['_timestamp']
+        if query.period is HOUR:
+            summaries = [(day + datetime.timedelta(hours=int(hour)), summary)
+                         for hour, summary in rollup['hours'].items()]
+        else:
+            summaries = [(day, rollup)]
+
+        for timestamp, summary in summaries:
+            if query.start_at and timestamp < query.start_at:
+                continue
+            if query.end_at and timestamp >= query.end_at:
+                continue
+            yield timestamp, summary
+
+
+def _to_result(summary, collect_methods):
+    row = {'_count': summary['_count']}
+    for field, _ in collect_methods:
+        parts = summary['fields'].get(field)
+        if parts is None:
+            row[field] = CollectedValues(sum=0, count=0, distinct=[])
+        else:
+            row[field] = CollectedValues(
+                sum=parts['sum'], count=parts['count'],
+                distinct=list(parts['distinct'] or []),
+                non_numeric=parts['non_numeric'])
+    return row
+
+
+def _add_results(a, b):
+    return dict((key, a[key] + b[key]) for key in a)
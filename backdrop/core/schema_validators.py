@@ -0,0 +1,185 @@
+"""
+Compiled JSON schema validators, cached by schema.
+
+Building a jsonschema validator (and its FormatChecker) is much more expensive
+than using one, so a validator is built once for each distinct schema and
+kept in a bounded LRU cache. A validator here is a function taking a record
+and returning a list of error messages.
+
+Most data set schemas are flat: an object with typed properties, some of which
+are required. For those, Python source for a validator is generated and
+compiled, which skips jsonschema's per-keyword dispatch entirely. It gives
+the same messages as jsonschema. Anything else uses jsonschema.
+"""
+import hashlib
+import json
+import numbers
+
+import jsonschema
+
+from .cache import LRUCache
+
+VALIDATOR_CACHE_SIZE = 100
+VALIDATOR_CACHE_TTL = 24 * 60 * 60
+
+_validators = LRUCache(max_size=VALIDATOR_CACHE_SIZE, ttl=VALIDATOR_CACHE_TTL)
+
+# Keywords with no effect on validation
+_ANNOTATIONS = frozenset(['$schema', 'id', 'title', 'description'])
+
+# Python expressions matching jsonschema's Draft 4 types. bools are ints in
+# Python but are not numbers in JSON schema.
+_TYPE_CHECKS = {
+    'array': 'isinstance(value, list)',
+    'boolean': 'isinstance(value, bool)',
+    'integer': '(isinstance(value, (int, long)) and '
+               'not isinstance(value, bool))',
+    'null': 'value is None',
+    'number': '(isinstance(value, Number) and not isinstance(value, bool))',
+    'object': 'isinstance(value, dict)',
+    'string': 'isinstance(value, basestring)',
+}
+
+
+def schema_key(schema):
+    """
+    >>> schema_key({'a': 1, 'b': 2}) == schema_key({'b': 2, 'a': 1})
+    True
+    """
+    return hashlib.sha1(json.dumps(schema, sort_keys=True)).hexdigest()
+
+
+def get_validator(schema):
+    """Return the validator for a schema, compiling it on first use"""
+    key = schema_key(schema)
+    validator = _validators.get(key)
+    if validator is None:
+        validator = compile_validator(schema)
+        _validators.set(key, validator)
+    return validator
+
+
+def compile_validator(schema, fast=True):
+    """Compile a schema into a function returning a list of error messages,
+    generating one for flat schemas unless fast is False
+
+    >>> validate = compile_validator({
+    ...     'type': 'object',
+    ...     'properties': {'count': {'type': 'integer'}},
+    ...     'required': ['name']})
+    >>> sorted(validate({'count': 'one'}))
+    ["'name' is a required property", "'one' is not of type 'integer'"]
+    """
+    if fast:
+        validator = compile_fast_validator(schema)
+        if validator is not None:
+            return validator
+
+    jsonschema_validator = jsonschema.Draft4Validator(
+        schema, format_checker=jsonschema.FormatChecker())
+
+    def validate(record):
+        return [error.message for error in
+                jsonschema_validator.iter_errors(record)]
+    return validate
+
+
+def compile_fast_validator(schema):
+    """Generate and compile a validator for a flat object schema, or return
+    None if the schema uses anything beyond type, format and enum on its
+    properties
+
+    >>> compile_fast_validator({'properties': {'a': {'minimum': 1}}}) is None
+    True
+    """
+    source = _generate_source(schema)
+    if source is None:
+        return None
+
+    namespace = {
+        'Number': numbers.Number,
+        'format_checker': jsonschema.FormatChecker(),
+    }
+    exec compile(source, '<schema validator>', 'exec') in namespace
+    return namespace['validate']
+
+
+def _generate_source(schema):
+    lines = ['def validate(record):',
+             '    errors = []',
+             '    value = record']
+
+    # Keywords are checked in the order jsonschema checks them, which is the
+    # schema's iteration order, so that messages come out in the same order
+    for keyword, argument in schema.items():
+        if keyword in _ANNOTATIONS:
+            continue
+        elif keyword == 'type':
+            check = _type_check(argument, '    ')
+            if check is None or 'object' not in _as_list(argument):
+                return None
+            lines += check
+        elif keyword in ('properties', 'required') and not argument:
+            continue
+        elif keyword == 'properties':
+            lines.append('    if isinstance(record, dict):')
+            for name, subschema in argument.items():
+                check = _property_check(name, subschema)
+                if check is None:
+                    return None
+                lines += check
+        elif keyword == 'required':
+            lines.append('    if isinstance(record, dict):')
+            for name in argument:
+                lines += [
+                    '        if {!r} not in record:'.format(name),
+                    '            errors.append({!r})'.format(
+                        '%r is a required property' % name)]
+        else:
+            return None
+
+    lines.append('    return errors')
+    return '\n'.join(lines) + '\n'
+
+
+def _property_check(name, subschema):
+    lines = ['        if {!r} in record:'.format(name),
+             '            value = record[{!r}]'.format(name)]
+    for keyword, argument in subschema.items():
+        if keyword in _ANNOTATIONS:
+            continue
+        elif keyword == 'type':
+            check = _type_check(argument, '            ')
+            if check is None:
+                return None
+            lines += check
+        elif keyword == 'format':
+            lines += [
+                '            if not format_checker.conforms('
+                'value, {!r}):'.format(argument),
+                '                errors.append({!r} % (value, {!r}))'.format(
+                    '%r is not a %r', argument)]
+        elif keyword == 'enum':
+            lines += [
+                '            if value not in {!r}:'.format(argument),
+                '                errors.append({!r} % (value, {!r}))'.format(
+                    '%r is not one of %r', argument)]
+        else:
+            return None
+    return lines
+
+
+def _type_check(types, indent):
+    types = _as_list(types)
+    if not all(isinstance(t, basestring) and t in _TYPE_CHECKS
+               for t in types):
+        return None
+    message = '%r is not of type ' + ', '.join(repr(t) for t in types)
+    return [
+        indent + 'if not ({}):'.format(
+            ' or '.join(_TYPE_CHECKS[t] for t in types)),
+        indent + '    errors.append({!r} % (value,))'.format(message)]
+
+
+def _as_list(value):
+    return value if isinstance(value, list) else [value]
@@ -3,18 +3,26 @@ import itertools
 import logging
 import os
 import re
+import time
 
 import pymongo
-from bson import Code
+from bson import Code, ObjectId
+from pymongo import InsertOne, ReplaceOne
 from pymongo.errors import AutoReconnect, CollectionInvalid
 
 from .. import timeutils
 from ..errors import DataSetCreationError
+from ..nested_merge import CollectedValues, get_collect_methods
 
 logger = logging.getLogger(__name__)
 
 __all__ = ['MongoStorageEngine']
 
+BSON_OBJECT_ID = 7
+# Seconds before the collections are listed again, to notice those created
+# or dropped by other processes
+KNOWN_COLLECTIONS_TTL = 60
+
 
 """Convert datatime values in a result to UTC
 
@@ -73,7 +81,7 @@ function(collection_names) {
 class MongoStorageEngine(object):
 
     @classmethod
-    def create(cls, database_url, ca_certificate=None):
+    def create(cls, database_url, ca_certificate=None, use_aggregation=True):
         if ca_certificate is not None:
             dir = os.path.dirname(__file__)
             filename = os.path.join(dir, 'mongodb.crt')
@@ -88,11 +96,21 @@ class MongoStorageEngine(object):
         else:
             mongo_client = pymongo.MongoClient(database_url)
 
-        return cls(mongo_client)
+        return cls(mongo_client, use_aggregation)
 
-    def __init__(self, mongo_client):
+    def __init__(self, mongo_client, use_aggregation=True,
+                 known_collections_ttl=KNOWN_COLLECTIONS_TTL):
         self._mongo_client = mongo_client
         self._db = mongo_client.get_database()
+        self._use_aggregation = use_aggregation
+        # Names of the collections in the database, listed on first use and
+        # again every known_collections_ttl seconds, and kept up to date as
+        # data sets are created and deleted here in between
+        self._known_collections = None
+        self._known_collections_ttl = known_collections_ttl
+        self._collections_listed_at = None
+        # (data set, field) pairs whose indexes this process has created
+        self._indexed_fields = set()
 
     def _collection(self, data_set_id):
         return self._db[data_set_id]
@@ -109,7 +127,28 @@ class MongoStorageEngine(object):
             self._db.name)
 
     def data_set_exists(self, data_set_id):
-        return data_set_id in self._db.collection_names()
+        now = time.time()
+        if self._known_collections is None or \
+                now - self._collections_listed_at >= \
+                self._known_collections_ttl:
+            self._list_collections(now)
+        return data_set_id in self._known_collections
+
+    def _list_collections(self, now):
+        """A collection dropped by another process may since have been
+        created again without its indexes, by a write from a process which
+        still knew of it, so every index is ensured again"""
+        self._known_collections = set(self._db.collection_names())
+        self._collections_listed_at = now
+        self._indexed_fields = set()
+
+    def _remember_collection(self, data_set_id):
+        if self._known_collections is not None:
+            self._known_collections.add(data_set_id)
+
+    def _forget_collection(self, data_set_id):
+        if self._known_collections is not None:
+            self._known_collections.discard(data_set_id)
 
     def create_data_set(self, data_set_id, size):
         try:
@@ -120,11 +159,43 @@ class MongoStorageEngine(object):
 
             self._collection(data_set_id).create_index(
                 [('_timestamp', pymongo.DESCENDING)])
+            # get_last_updated runs for every read when query results
+            # are cached, so it must not scan the collection
+            self._collection(data_set_id).create_index(
+                [('_updated_at', pymongo.DESCENDING)])
+            self._indexed_fields.update([(data_set_id, '_timestamp'),
+                                         (data_set_id, '_updated_at')])
         except CollectionInvalid as e:
+            # Another process created it since the collections were listed
+            self._remember_collection(data_set_id)
             raise DataSetCreationError(e.message)
+        self._remember_collection(data_set_id)
+
+    def ensure_indexes(self, data_set_id, fields):
+        """
+        Index fields of a data set's records which are filtered on often.
+        An ascending index serves filter_by and, as the prefix regex is
+        anchored, filter_by_prefix.
+
+        Collections created before get_last_updated needed an _updated_at
+        index are given one here too, as are collections created without
+        indexes by a write after another process dropped them.
+        """
+        indexes = [('_timestamp', pymongo.DESCENDING),
+                   ('_updated_at', pymongo.DESCENDING)] + \
+            [(field, pymongo.ASCENDING) for field in fields]
+        for field, direction in indexes:
+            if (data_set_id, field) not in self._indexed_fields:
+                self._collection(data_set_id).create_index(
+                    [(field, direction)], background=True)
+                self._indexed_fields.add((data_set_id, field))
 
     def delete_data_set(self, data_set_id):
         self._db.drop_collection(data_set_id)
+        self._forget_collection(data_set_id)
+        self._indexed_fields = set(
+            (indexed, field) for indexed, field in self._indexed_fields
+            if indexed != data_set_id)
 
     def get_last_updated(self, data_set_id):
         last_updated = self._collection(data_set_id).find_one(
@@ -133,6 +204,17 @@ class MongoStorageEngine(object):
             return timeutils.utc(last_updated['_updated_at'])
 
     def batch_last_updated(self, data_sets):
+        if not self._use_aggregation:
+            return self._eval_batch_last_updated(data_sets)
+
+        for data_set in data_sets:
+            latest = self._collection(data_set.name).find_one(
+                projection=['_timestamp'],
+                sort=[('_timestamp', pymongo.DESCENDING)])
+            data_set._last_updated = time_as_utc(
+                latest.get('_timestamp') if latest else None)
+
+    def _eval_batch_last_updated(self, data_sets):
         all_last_updated = self._db.eval(
             LAST_UPDATED_COMBINED_JS,
             [ds.name for ds in data_sets]
@@ -149,6 +231,26 @@ class MongoStorageEngine(object):
         record['_updated_at'] = timeutils.now()
         self._collection(data_set_id).save(record)
 
+    def save_records(self, data_set_id, records):
+        """Save a batch of records with a single unordered bulk write
+
+        Records with an _id are upserted, the rest are inserted. As the
+        bulk write is unordered only the last record for any given _id
+        is sent, which matches what saving them one by one would leave.
+        """
+        updated_at = timeutils.now()
+        requests = []
+        for record in _last_record_for_each_id(records):
+            record['_updated_at'] = updated_at
+            if '_id' in record:
+                requests.append(
+                    ReplaceOne({'_id': record['_id']}, record, upsert=True))
+            else:
+                requests.append(InsertOne(record))
+
+        if requests:
+            self._collection(data_set_id).bulk_write(requests, ordered=False)
+
     def find_record(self, data_set_id, record_id):
         return self._collection(data_set_id).find_one(record_id)
 
@@ -160,10 +262,62 @@ class MongoStorageEngine(object):
     def delete_record(self, data_set_id, record_id):
         self._collection(data_set_id).remove({"_id": record_id})
 
+    def patch_records(self, data_set_id, patches):
+        """Set fields on existing records, returning the previous _timestamp
+        of each record found by its id
+
+        Each record is updated and its previous timestamp read with a single
+        find_one_and_update, so nothing can change it in between. Patches
+        for records which don't exist are ignored.
+        """
+        updated_at = timeutils.now()
+        previous = {}
+        for record_id, fields in patches.items():
+            existing = self._collection(data_set_id).find_one_and_update(
+                {'_id': record_id},
+                {'$set': dict(fields, _updated_at=updated_at)},
+                projection=['_timestamp'])
+            if existing is not None:
+                previous[record_id] = existing.get('_timestamp')
+        return previous
+
+    def delete_records(self, data_set_id, record_ids):
+        """Delete records, returning the _timestamp of each record which
+        existed by its id
+
+        Each record is deleted and its timestamp read with a single
+        find_one_and_delete, so that a record saved or deleted by another
+        process in between can't be missed or counted twice. That is a
+        round trip for each id, as no bulk delete returns what it deleted.
+        """
+        collection = self._collection(data_set_id)
+        previous = {}
+        for record_id in set(record_ids):
+            existing = collection.find_one_and_delete(
+                {'_id': record_id}, projection=['_timestamp'])
+            if existing is not None:
+                previous[record_id] = existing.get('_timestamp')
+        return previous
+
+    def delete_records_between(self, data_set_id, start_at, end_at):
+        """Delete the records with a _timestamp from start_at up to end_at
+        with a single delete_many on the _timestamp index, returning how
+        many were deleted"""
+        result = self._collection(data_set_id).delete_many(
+            time_range_to_mongo_query(start_at, end_at))
+        return result.deleted_count
+
     def execute_query(self, data_set_id, query):
         return map(convert_datetimes_to_utc,
                    self._execute_query(data_set_id, query))
 
+    def iter_query(self, data_set_id, query, stream_after=None):
+        """Iterate over the records matched by a raw query, reading them
+        from the cursor as they are needed. Streaming doesn't hold on to
+        anything beyond the cursor, so stream_after makes no difference."""
+        for record in self._basic_query(data_set_id, query):
+            yield convert_datetimes_to_utc(record)
+
     def _execute_query(self, data_set_id, query):
         if query.is_grouped:
             return self._group_query(data_set_id, query)
@@ -171,6 +325,9 @@ class MongoStorageEngine(object):
             return self._basic_query(data_set_id, query)
 
     def _group_query(self, data_set_id, query):
+        if self._use_aggregation:
+            return self._aggregate_query(data_set_id, query)
+
         # flatten the list of key combos to form a flat list of keys
         keys = list(itertools.chain.from_iterable(query.group_keys))
         spec = get_mongo_spec(query)
@@ -182,6 +339,18 @@ class MongoStorageEngine(object):
             initial=build_group_initial_state(collect_fields),
             reduce=Code(build_group_reducer(collect_fields)))
 
+    def _aggregate_query(self, data_set_id, query):
+        keys = list(itertools.chain.from_iterable(query.group_keys))
+        collect_methods = get_collect_methods(query.collect)
+        pipeline = build_aggregate_pipeline(
+            keys, get_mongo_spec(query), collect_methods)
+
+        results = self._collection(data_set_id).aggregate(
+            pipeline, allowDiskUse=True)
+
+        return [translate_aggregate_result(keys, collect_methods, result)
+                for result in results]
+
     def _basic_query(self, data_set_id, query):
         spec = get_mongo_spec(query)
         sort = get_mongo_sort(query)
@@ -190,6 +359,19 @@ class MongoStorageEngine(object):
         return self._collection(data_set_id).find(spec, sort=sort, limit=limit)
 
 
+def _last_record_for_each_id(records):
+    """Drop all but the last of any records sharing an _id
+
+    >>> _last_record_for_each_id([{'_id': 'a', 'v': 1}, {'v': 2},
+    ...                           {'_id': 'a', 'v': 3}])
+    [{'v': 2}, {'_id': 'a', 'v': 3}]
+    """
+    last_index = dict((record['_id'], i)
+                      for i, record in enumerate(records) if '_id' in record)
+    return [record for i, record in enumerate(records)
+            if '_id' not in record or last_index[record['_id']] == i]
+
+
 def get_mongo_spec(query):
     """Convert a Query into a mongo find spec
 
@@ -209,6 +391,12 @@ def get_mongo_spec(query):
     '^\\\\(bar\\\\).*'
     >>> get_mongo_spec(Query.create(start_at=dt(2012, 12, 12)))
     {'_timestamp': {'$gte': datetime.datetime(2012, 12, 12, 0, 0)}}
+    >>> get_mongo_spec(Query.create(ids=['a', 'b']))
+    {'_id': {'$in': ['a', 'b']}}
+    >>> get_mongo_spec(Query.create(after=(dt(2012, 12, 12), 'abc')))['$or']
+    [{'_timestamp': {'$gt': datetime.datetime(2012, 12, 12, 0, 0)}}, {'_timestamp': datetime.datetime(2012, 12, 12, 0, 0), '_id': {'$gt': 'abc'}}, {'_timestamp': datetime.datetime(2012, 12, 12, 0, 0), '_id': {'$type': 7}}]
+    >>> get_mongo_spec(Query.create(after=(dt(2012, 12, 12), ObjectId('5284f27b2c54f3c2ee0d8d3a'))))['$or']
+    [{'_timestamp': {'$gt': datetime.datetime(2012, 12, 12, 0, 0)}}, {'_timestamp': datetime.datetime(2012, 12, 12, 0, 0), '_id': {'$gt': ObjectId('5284f27b2c54f3c2ee0d8d3a')}}]
     """
     time_range = time_range_to_mongo_query(
         query.start_at, query.end_at, query.inclusive)
@@ -219,7 +407,21 @@ def get_mongo_spec(query):
         filter_term = [
             [key, _construct_prefix_regex(value)] for key, value in query.filter_by_prefix]
 
-    return dict(filter_term + time_range.items())
+    spec = dict(filter_term + time_range.items())
+    if query.ids:
+        spec['_id'] = {'$in': list(query.ids)}
+    if query.after:
+        timestamp, record_id = query.after
+        spec['$or'] = [
+            {'_timestamp': {'$gt': timestamp}},
+            {'_timestamp': timestamp, '_id': {'$gt': record_id}},
+        ]
+        # $gt only matches _ids of the same type, and records saved without
+        # an _id have ObjectIds, which sort after every string
+        if not isinstance(record_id, ObjectId):
+            spec['$or'].append(
+                {'_timestamp': timestamp, '_id': {'$type': BSON_OBJECT_ID}})
+    return spec
 
 
 def time_range_to_mongo_query(start_at, end_at, inclusive=False):
@@ -255,7 +457,12 @@ def get_mongo_sort(query):
     >>> get_mongo_sort(Query.create())
     >>> get_mongo_sort(Query.create(sort_by=['foo', 'ascending']))
     [('foo', 1)]
+    >>> get_mongo_sort(Query.create(limit=10))
+    >>> get_mongo_sort(Query.create(limit=10, after=()))
+    [('_timestamp', 1), ('_id', 1)]
     """
+    if query.is_paginated:
+        return [('_timestamp', pymongo.ASCENDING), ('_id', pymongo.ASCENDING)]
     if query.sort_by:
         direction = get_mongo_sort_direction(query.sort_by[1])
         return [(query.sort_by[0], direction)]
@@ -334,5 +541,78 @@ def clean_collect_field(collect_field):
     return collect_field.replace('\\', '\\\\').replace("'", "\\'")
 
 
+NUMERIC_TYPES = ['double', 'int', 'long', 'decimal', 'bool']
+
+
+def build_aggregate_pipeline(keys, spec, collect_methods):
+    """Build an aggregation pipeline equivalent to a group query
+
+    Group keys and collect fields are aliased (k0, c0 ...) as user provided
+    names are not always valid field names in a $group stage. Only the
+    summaries needed by the requested collect methods are computed.
+
+    >>> build_aggregate_pipeline(['foo'], {}, []) == [
+    ...     {'$match': {'foo': {'$ne': None}}},
+    ...     {'$group': {'_id': {'k0': '$foo'}, '_count': {'$sum': 1}}}]
+    True
+    >>> build_aggregate_pipeline(['foo'], {}, [('bar', set(['set']))])[1] == {
+    ...     '$group': {'_id': {'k0': '$foo'}, '_count': {'$sum': 1},
+    ...                'c0_distinct': {'$addToSet': '$bar'}}}
+    True
+    """
+    group = {
+        '_id': dict(('k{}'.format(i), '$' + key) for i, key in enumerate(keys)),
+        '_count': {'$sum': 1},
+    }
+    for i, (field, methods) in enumerate(collect_methods):
+        group.update(
+            _build_accumulators('c{}'.format(i), '$' + field, methods))
+
+    return [
+        {'$match': build_group_condition(keys, spec)},
+        {'$group': group},
+    ]
+
+
+def _build_accumulators(alias, path, methods):
+    field_type = {'$type': path}
+    is_present = {'$cond': [{'$eq': [field_type, 'missing']}, 0, 1]}
+
+    accumulators = {}
+    if methods & set(['sum', 'mean']):
+        # $sum skips booleans, python's sum counts them as 0 or 1
+        accumulators[alias + '_sum'] = {'$sum': {'$cond': [
+            {'$eq': [field_type, 'bool']}, {'$cond': [path, 1, 0]}, path]}}
+        accumulators[alias + '_non_numeric'] = {'$sum': {'$cond': [
+            {'$in': [field_type, ['missing'] + NUMERIC_TYPES]}, 0, 1]}}
+    if methods & set(['count', 'mean']):
+        accumulators[alias + '_count'] = {'$sum': is_present}
+    if 'set' in methods:
+        accumulators[alias + '_distinct'] = {'$addToSet': path}
+    return accumulators
+
+
+def translate_aggregate_result(keys, collect_methods, result):
+    """Translate an aliased $group result back into a group query result
+
+    >>> result = {'_id': {'k0': 'a'}, '_count': 2, 'c0_sum': 5,
+    ...           'c0_non_numeric': 0}
+    >>> row = translate_aggregate_result(['foo'], [('bar', set(['sum']))], result)
+    >>> row['foo'], row['_count'], row['bar'].reduce('sum')
+    ('a', 2, 5)
+    """
+    row = dict((key, result['_id'].get('k{}'.format(i)))
+               for i, key in enumerate(keys))
+    row['_count'] = result['_count']
+    for i, (field, _) in enumerate(collect_methods):
+        alias = 'c{}'.format(i)
+        row[field] = CollectedValues(
+            sum=result.get(alias + '_sum'),
+            count=result.get(alias + '_count'),
+            distinct=result.get(alias + '_distinct'),
+            non_numeric=result.get(alias + '_non_numeric', 0))
+    return row
+
+
 def _construct_prefix_regex(value):
     return re.compile('^%s.*' % re.escape(value))
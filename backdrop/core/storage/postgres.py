@@ -1,11 +1,18 @@
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime
 
 import dateutil.parser
 import dateutil.tz
 import psycopg2
+import psycopg2.errorcodes
+import psycopg2.extensions
 import psycopg2.extras
+import psycopg2.pool
 import pytz
 import logging
+import threading
+import time
 
 from uuid import uuid4
 
@@ -16,20 +23,193 @@ from sql_query_factory import (
     create_get_last_updated_query,
     create_find_record_query,
     create_update_record_query,
+    create_batch_update_records_query,
     create_delete_record_query,
+    create_patch_records_query,
+    create_delete_records_query,
+    create_delete_records_between_query,
     create_batch_last_updated_query,
+    create_partition_query,
+    create_partition_exists_query,
+    create_truncate_partition_query,
+    create_drop_partition_query,
+    create_field_index_queries,
+    create_invalid_indexes_query,
+    create_table_index_queries,
+    field_index_names,
+    create_drop_index_query,
+    partition_name,
     CREATE_TABLE_SQL,
+    CREATE_PARTITIONED_TABLE_SQL,
     DROP_TABLE_SQL,
+    TABLE_INDEXES,
+    TABLE_NAME,
 )
 from .. import timeutils
+from ... import statsd
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_POOL_MIN = 1
+DEFAULT_POOL_MAX = 10
+DEFAULT_ITERSIZE = 1000
+DEFAULT_POOL_TIMEOUT = 30
+# Connections which have sat in the pool for longer than this are pinged
+# before use, as the server may have dropped them in the meantime
+PING_AFTER_IDLE = 30
+
+
+class _Slots(object):
+    """
+    A counting semaphore which gives up waiting with a PoolError after
+    timeout seconds, as threading.Semaphore can't time out in Python 2.
+    """
+
+    def __init__(self, count, timeout):
+        self._available = count
+        self._timeout = timeout
+        self._released = threading.Condition()
+
+    def acquire(self):
+        deadline = time.time() + self._timeout
+        with self._released:
+            while self._available == 0:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise psycopg2.pool.PoolError(
+                        'no connection returned to the pool within '
+                        '{} seconds'.format(self._timeout))
+                self._released.wait(remaining)
+            self._available -= 1
+
+    def release(self):
+        with self._released:
+            self._available += 1
+            self._released.notify()
+
+    @contextmanager
+    def held(self):
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+
+class BlockingConnectionPool(psycopg2.pool.ThreadedConnectionPool):
+    """
+    A ThreadedConnectionPool which waits for a connection to be returned
+    when all of them are checked out, rather than raising a PoolError
+    straight away. It gives up with a PoolError if none is returned within
+    timeout seconds.
+    """
+
+    def __init__(self, minconn, maxconn, *args, **kwargs):
+        self._slots = _Slots(
+            maxconn, kwargs.pop('timeout', DEFAULT_POOL_TIMEOUT))
+        super(BlockingConnectionPool, self).__init__(
+            minconn, maxconn, *args, **kwargs)
+
+    def getconn(self, key=None):
+        self._slots.acquire()
+        try:
+            return super(BlockingConnectionPool, self).getconn(key)
+        except:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn=None, key=None, close=False):
+        try:
+            super(BlockingConnectionPool, self).putconn(conn, key, close)
+        finally:
+            self._slots.release()
+
+    @property
+    def in_use(self):
+        return len(self._used)
+
 
 class PostgresStorageEngine(object):
 
-    def __init__(self, datatbase_url):
-        self.connection = psycopg2.connect(datatbase_url)
+    def __init__(self, datatbase_url,
+                 pool_min=DEFAULT_POOL_MIN, pool_max=DEFAULT_POOL_MAX,
+                 itersize=DEFAULT_ITERSIZE, partitioned=False,
+                 pool_timeout=DEFAULT_POOL_TIMEOUT, stream_max=None):
+        self._pool = BlockingConnectionPool(
+            pool_min, pool_max, datatbase_url, timeout=pool_timeout)
+        # A streamed response holds its connection for as long as the
+        # client takes to read it, so only some of the pool may be used
+        # for streaming, leaving the rest for other queries, including
+        # raw reads which aren't streamed
+        self._streams = _Slots(
+            stream_max or max(1, pool_max // 2), pool_timeout)
+        self._itersize = itersize
+        # When each pooled connection was last returned, by id
+        self._returned_at = {}
+        # With a partitioned table each data set has its own partition, so
+        # that emptying or deleting it is a TRUNCATE or DROP. The table
+        # rows are written to for each data set written to by this process
+        self._partitioned = partitioned
+        self._partitions = {}
+        # Data sets seen to have records, so that writes to them don't
+        # probe the table every time
+        self._known_data_sets = set()
+        # (data set, field) pairs whose indexes this process has created
+        self._indexed_fields = set()
+        self._table_indexed = False
+
+    def _checkout(self):
+        with statsd.timer('postgres.pool.wait'):
+            connection = self._pool.getconn()
+
+        # Connections that were dropped while sitting in the pool are
+        # thrown away; the pool opens a fresh one in their place.
+        while not _is_alive(connection, self._idle_for(connection)):
+            logger.warning('Discarding dead postgres connection')
+            self._returned_at.pop(id(connection), None)
+            self._pool.putconn(connection, close=True)
+            connection = self._pool.getconn()
+
+        statsd.gauge('postgres.pool.in_use', self._pool.in_use)
+        statsd.gauge('postgres.pool.utilisation',
+                     100 * self._pool.in_use / self._pool.maxconn)
+        return connection
+
+    @contextmanager
+    def _cursor(self, name=None, autocommit=False):
+        """
+        Check a connection out of the pool for the duration of the block,
+        committing if the block succeeds. A connection which fails with an
+        OperationalError or InterfaceError is closed rather than returned,
+        so the next checkout reconnects.
+
+        Giving a name opens a server-side cursor, which sends rows to the
+        client itersize at a time rather than all at once. With autocommit
+        each statement runs outside a transaction, which some DDL needs.
+        """
+        connection = self._checkout()
+        connection.autocommit = autocommit
+        broken = False
+        try:
+            with connection.cursor(name=name) as cursor:
+                if name is not None:
+                    cursor.itersize = self._itersize
+                yield cursor
+            connection.commit()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            if broken:
+                self._returned_at.pop(id(connection), None)
+            else:
+                self._returned_at[id(connection)] = time.time()
+            self._pool.putconn(connection, close=broken)
+
+    def _idle_for(self, connection):
+        """Seconds since the connection was returned to the pool"""
+        returned_at = self._returned_at.get(id(connection))
+        return 0 if returned_at is None else time.time() - returned_at
 
     def create_table_and_indices(self):
         """
@@ -39,46 +219,174 @@ class PostgresStorageEngine(object):
         Database migrations are for losers (it is in fact us, the people who
         support this project, who are the losers).
         """
-        with self.connection.cursor() as cursor:
-            query = CREATE_TABLE_SQL
+        with self._cursor() as cursor:
+            if self._partitioned:
+                query = CREATE_PARTITIONED_TABLE_SQL
+            else:
+                query = CREATE_TABLE_SQL
             logger.debug(
                 'create_table_and_indices - executing sql query: ' + query)
             cursor.execute(query)
-        self.connection.commit()
 
     def drop_table_and_indices(self):
         """
         As with the create above, this is likely only used during tests.
         """
-        with self.connection.cursor() as cursor:
+        with self._cursor() as cursor:
             query = DROP_TABLE_SQL
             logger.debug(
                 'drop_table_and_indices - executing sql query: ' + query)
             cursor.execute(query)
-        self.connection.commit()
 
     def data_set_exists(self, data_set_id):
         # This is slightly different to the mongo implementation
         # in that it will return False if `create_data_set` has
         # been called, but no records have been saved.
-        with self.connection.cursor() as cursor:
+        if data_set_id in self._known_data_sets:
+            return True
+
+        with self._cursor() as cursor:
             query = create_data_set_exists_query(cursor.mogrify, data_set_id)
             logger.debug('data_set_exists - executing sql query: ' + query)
             cursor.execute(query)
-            return cursor.rowcount > 0
+            exists = cursor.rowcount > 0
+
+        if exists:
+            self._known_data_sets.add(data_set_id)
+        return exists
 
     def create_data_set(self, data_set_id, size):
-        pass
+        if self._partitioned:
+            self._partition(data_set_id)
+
+    def _partition(self, data_set_id):
+        """
+        The table to write the data set's rows to. Its partition is created
+        the first time this process writes to it, and written to directly,
+        so that if another process drops it the rows can't land in the
+        default partition. Creating it fails if rows for the data set were
+        written to the default partition before, or the table hasn't been
+        partitioned yet, and then rows are written to the whole table and
+        stay where they are until they are moved by
+        tools/partition-postgres.py.
+        """
+        if not self._partitioned:
+            return TABLE_NAME
+        if data_set_id in self._partitions:
+            return self._partitions[data_set_id]
+
+        table = partition_name(data_set_id)
+        try:
+            with self._cursor() as cursor:
+                query = create_partition_query(cursor.mogrify, data_set_id)
+                logger.debug(
+                    'create_partition - executing sql query: ' + query)
+                cursor.execute(query)
+        except (psycopg2.IntegrityError, psycopg2.ProgrammingError) as e:
+            logger.warning('Could not create a partition for {}: {}'.format(
+                data_set_id, e))
+            table = TABLE_NAME
+        self._partitions[data_set_id] = table
+        return table
+
+    def _write_rows(self, data_set_id, write):
+        """
+        Call write with the table to write the data set's rows to, and
+        again with its partition created again if another process has
+        dropped it since this one created it.
+        """
+        table = self._partition(data_set_id)
+        try:
+            write(table)
+        except psycopg2.ProgrammingError as e:
+            if table == TABLE_NAME or \
+                    e.pgcode != psycopg2.errorcodes.UNDEFINED_TABLE:
+                raise
+            del self._partitions[data_set_id]
+            write(self._partition(data_set_id))
+
+    def ensure_table_indexes(self):
+        """
+        Build the indexes added to the table after it was first deployed,
+        which create_table_and_indices only builds for new tables. A
+        partitioned table is given them when it is created.
+        """
+        if not self._partitioned:
+            self._build_indexes(TABLE_INDEXES.keys(),
+                                lambda mogrify: create_table_index_queries())
+        self._table_indexed = True
+
+    def ensure_indexes(self, data_set_id, fields):
+        """
+        Index fields of a data set's records which are filtered on often.
+        The indexes are built without locking out writes to the table, but
+        take as long as the whole table takes to scan and wait for every
+        open transaction, so this is left to a background worker. Each
+        field is indexed once per process, and a build which fails is tried
+        again the next time, after dropping the invalid index it left.
+        """
+        if not self._table_indexed:
+            try:
+                self.ensure_table_indexes()
+            except psycopg2.Error as e:
+                logger.warning('Could not index the table: {}'.format(e))
+
+        fields = [field for field in fields
+                  if (data_set_id, field) not in self._indexed_fields]
+        if not fields:
+            return
+
+        if self._partitions.get(data_set_id) == TABLE_NAME:
+            # Its rows may have been moved into a partition since
+            del self._partitions[data_set_id]
+        if self._partition(data_set_id) == TABLE_NAME and self._partitioned:
+            # The data set's rows are still in the default partition
+            return
+
+        for field in fields:
+            try:
+                self._build_indexes(
+                    field_index_names(data_set_id, field),
+                    lambda mogrify: create_field_index_queries(
+                        mogrify, data_set_id, field, self._partitioned))
+            except psycopg2.Error as e:
+                logger.warning('Could not index {} of {}: {}'.format(
+                    field, data_set_id, e))
+            else:
+                self._indexed_fields.add((data_set_id, field))
+
+    def _build_indexes(self, names, create_queries):
+        """Build indexes concurrently, outside a transaction, dropping any
+        invalid ones left by failed builds first"""
+        with self._cursor(autocommit=True) as cursor:
+            cursor.execute(create_invalid_indexes_query(cursor.mogrify, names))
+            queries = [create_drop_index_query(name)
+                       for (name,) in cursor.fetchall()]
+            queries.extend(create_queries(cursor.mogrify))
+            for query in queries:
+                logger.debug('build_indexes - executing sql query: ' + query)
+                cursor.execute(query)
 
     def delete_data_set(self, data_set_id):
-        with self.connection.cursor() as cursor:
-            query = create_delete_data_set_query(cursor.mogrify, data_set_id)
-            logger.debug('delete_data_set - executing sql query: ' + query)
-            cursor.execute(query)
-            self.connection.commit()
+        with self._cursor() as cursor:
+            # Once the partition is dropped any rows left for the data set
+            # are in the default partition
+            queries = [
+                create_delete_data_set_query(cursor.mogrify, data_set_id)]
+            if self._partitioned:
+                queries.insert(0, create_drop_partition_query(data_set_id))
+            for query in queries:
+                logger.debug(
+                    'delete_data_set - executing sql query: ' + query)
+                cursor.execute(query)
+        self._partitions.pop(data_set_id, None)
+        self._known_data_sets.discard(data_set_id)
+        self._indexed_fields = set(
+            (indexed, field) for indexed, field in self._indexed_fields
+            if indexed != data_set_id)
 
     def get_last_updated(self, data_set_id):
-        with self.connection.cursor() as cursor:
+        with self._cursor() as cursor:
             query = create_get_last_updated_query(cursor.mogrify, data_set_id)
             logger.debug('get_last_updated - executing sql query: ' + query)
             cursor.execute(query)
@@ -91,7 +399,7 @@ class PostgresStorageEngine(object):
 
     def batch_last_updated(self, data_sets):
         collections = [collection.name for collection in data_sets]
-        with self.connection.cursor() as cursor:
+        with self._cursor() as cursor:
             query = create_batch_last_updated_query(
                 cursor.mogrify, collections)
             logger.debug('batch_last_updated - executing sql query: ' + query)
@@ -107,7 +415,21 @@ class PostgresStorageEngine(object):
                     data_set._last_updated = None
 
     def empty_data_set(self, data_set_id):
-        self.delete_data_set(data_set_id)
+        if not self._partitioned:
+            return self.delete_data_set(data_set_id)
+
+        with self._cursor() as cursor:
+            cursor.execute(
+                create_partition_exists_query(cursor.mogrify, data_set_id))
+            (partition_exists,) = cursor.fetchone()
+            if partition_exists:
+                query = create_truncate_partition_query(data_set_id)
+            else:
+                query = create_delete_data_set_query(
+                    cursor.mogrify, data_set_id)
+            logger.debug('empty_data_set - executing sql query: ' + query)
+            cursor.execute(query)
+        self._known_data_sets.discard(data_set_id)
 
     def save_record(self, data_set_id, record):
 
@@ -118,13 +440,45 @@ class PostgresStorageEngine(object):
 
         self.update_record(data_set_id, record['_id'], record)
 
+    def save_records(self, data_set_id, records):
+        """
+        Upserts a batch of records with one multi-row INSERT in a single
+        transaction. Postgres refuses to touch the same row twice in one
+        statement, so only the last record for each _id is written.
+        """
+        if not records:
+            return
+
+        updated_at = timeutils.now()
+        records_by_id = OrderedDict()
+        for record in records:
+            if '_id' not in record:
+                record['_id'] = str(uuid4())
+            record['_updated_at'] = updated_at
+            records_by_id.pop(record['_id'], None)
+            records_by_id[record['_id']] = record
+
+        def write(table):
+            with self._cursor() as cursor:
+                query = create_batch_update_records_query(
+                    cursor.mogrify, data_set_id, records_by_id.values(),
+                    updated_at, self._partitioned, table)
+                logger.debug('save_records - executing sql query: ' + query)
+                cursor.execute(query)
+
+        self._write_rows(data_set_id, write)
+        self._known_data_sets.add(data_set_id)
+
     def find_record(self, data_set_id, record_id):
-        with self.connection.cursor() as cursor:
+        with self._cursor() as cursor:
             query = create_find_record_query(
                 cursor.mogrify, data_set_id, record_id)
             logger.debug('find_record - executing sql query: ' + query)
             cursor.execute(query)
-            (record,) = cursor.fetchone()
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            (record,) = row
             return _parse_datetime_fields(record)
 
     def update_record(self, data_set_id, record_id, record):
@@ -132,23 +486,81 @@ class PostgresStorageEngine(object):
         record['_updated_at'] = updated_at
         ts = record['_timestamp'] if '_timestamp' in record else updated_at
 
-        with self.connection.cursor() as cursor:
-            query = create_update_record_query(
-                cursor.mogrify, data_set_id, record, record_id, ts, updated_at)
-            logger.debug('update_record - executing sql query: ' + query)
-            cursor.execute(query)
-            self.connection.commit()
+        def write(table):
+            with self._cursor() as cursor:
+                query = create_update_record_query(
+                    cursor.mogrify, data_set_id, record, record_id, ts,
+                    updated_at, self._partitioned, table)
+                logger.debug('update_record - executing sql query: ' + query)
+                cursor.execute(query)
+
+        self._write_rows(data_set_id, write)
+        self._known_data_sets.add(data_set_id)
 
     def delete_record(self, data_set_id, record_id):
-        with self.connection.cursor() as cursor:
+        with self._cursor() as cursor:
             query = create_delete_record_query(
                 cursor.mogrify, data_set_id, record_id)
             logger.debug('delete_record - executing sql query: ' + query)
             cursor.execute(query)
-            self.connection.commit()
+
+    def patch_records(self, data_set_id, patches):
+        """
+        Merges fields into existing records with a single UPDATE, returning
+        the previous _timestamp of each record found by its id. Patches for
+        records which don't exist are ignored.
+        """
+        updated_at = timeutils.now()
+        fields_by_id = OrderedDict()
+        for record_id, fields in patches.items():
+            fields = dict(fields, _updated_at=updated_at)
+            if fields.get('_timestamp') is not None:
+                fields['_timestamp'] = timeutils.parse_time_as_utc(
+                    fields['_timestamp'])
+            fields_by_id[record_id] = fields
+        if not fields_by_id:
+            return {}
+
+        with self._cursor() as cursor:
+            query = create_patch_records_query(
+                cursor.mogrify, data_set_id, fields_by_id.items(), updated_at)
+            logger.debug('patch_records - executing sql query: ' + query)
+            cursor.execute(query)
+            return _previous_timestamps(data_set_id, cursor.fetchall())
+
+    def delete_records(self, data_set_id, record_ids):
+        """
+        Deletes records with a single DELETE, returning the _timestamp of
+        each record which existed by its id.
+        """
+        if not record_ids:
+            return {}
+
+        with self._cursor() as cursor:
+            query = create_delete_records_query(
+                cursor.mogrify, data_set_id, record_ids)
+            logger.debug('delete_records - executing sql query: ' + query)
+            cursor.execute(query)
+            return _previous_timestamps(data_set_id, cursor.fetchall())
+
+    def delete_records_between(self, data_set_id, start_at, end_at):
+        """
+        Deletes the records with a _timestamp from start_at up to end_at
+        with a single DELETE, returning how many were deleted.
+        """
+        with self._cursor() as cursor:
+            query = create_delete_records_between_query(
+                cursor.mogrify, data_set_id, start_at, end_at)
+            logger.debug(
+                'delete_records_between - executing sql query: ' + query)
+            cursor.execute(query)
+            return cursor.rowcount
 
     def execute_query(self, data_set_id, query):
-        with self.connection.cursor() as cursor:
+        if not query.is_grouped:
+            return list(self.iter_query(data_set_id, query))
+
+        with self._cursor() as cursor:
             query, convert_query_result_to_dictionaries = create_sql_query(
                 cursor.mogrify, data_set_id, query)
             logger.debug('execute_query - executing sql query: ' + query)
@@ -156,6 +568,70 @@ class PostgresStorageEngine(object):
             records = convert_query_result_to_dictionaries(cursor.fetchall())
             return [_parse_datetime_fields(record) for record in records]
 
+    def iter_query(self, data_set_id, query, stream_after=None):
+        """
+        Iterate over the records matched by a raw query through a server-side
+        cursor, fetching and decoding itersize rows at a time. The connection
+        is held until the iteration finishes or is abandoned. Records beyond
+        the first stream_after are taken to be streamed to a client, which
+        may read them slowly, so the iteration waits for one of stream_max
+        slots before reading them, or gives up with a PoolError after
+        pool_timeout.
+        """
+        streaming = False
+        try:
+            with self._cursor(name='iter_query') as cursor:
+                query, convert_query_result_to_dictionaries = \
+                    create_sql_query(cursor.mogrify, data_set_id, query)
+                logger.debug('iter_query - executing sql query: ' + query)
+                cursor.execute(query)
+                count = 0
+                while True:
+                    rows = cursor.fetchmany(cursor.itersize)
+                    if not rows:
+                        break
+                    for record in convert_query_result_to_dictionaries(rows):
+                        if count == stream_after:
+                            self._streams.acquire()
+                            streaming = True
+                        count += 1
+                        yield _parse_datetime_fields(record)
+        finally:
+            if streaming:
+                self._streams.release()
+
+
+def _previous_timestamps(data_set_id, rows):
+    """
+    Map the ids returned by a patch or delete back to record ids.
+
+    >>> _previous_timestamps('foo', [('foo:a:b', '2012-12-12T00:00:00')])
+    {'a:b': '2012-12-12T00:00:00'}
+    """
+    return dict((row_id[len(data_set_id) + 1:], timestamp)
+                for row_id, timestamp in rows)
+
+
+def _is_alive(connection, idle_for=0):
+    """
+    A cheap, local liveness check. libpq reports an unknown transaction
+    status once it has noticed the server has gone away, but only after an
+    operation has failed, so connections which have been idle for a while
+    are also pinged.
+    """
+    if connection.closed or connection.get_transaction_status() == \
+            psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+        return False
+    if idle_for < PING_AFTER_IDLE:
+        return True
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        connection.rollback()
+        return True
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        return False
+
 
 def _parse_datetime_fields(obj):
     """
@@ -1,7 +1,10 @@
 from collections import OrderedDict
 from datetime import date, datetime
+from decimal import Decimal
+import hashlib
 import json
 
+from backdrop.core.nested_merge import CollectedValues, get_collect_methods
 from backdrop.core.query import Query
 from backdrop.core.timeseries import DAY, WEEK
 
@@ -19,6 +22,30 @@ CREATE_TABLE_SQL = """
     CREATE INDEX IF NOT EXISTS mongo_updated_at ON mongo (updated_at);
     CREATE INDEX IF NOT EXISTS mongo_collection_timestamp ON mongo (collection, timestamp);
     CREATE INDEX IF NOT EXISTS mongo_collection_updated_at ON mongo (collection, updated_at);
+    CREATE INDEX IF NOT EXISTS mongo_collection_timestamp_id ON mongo (collection, timestamp, id);
+    CREATE INDEX IF NOT EXISTS mongo_record ON mongo USING gin (record jsonb_path_ops);
+"""
+
+# The same table list-partitioned by collection, with a partition for each
+# data set and a default partition for any collection without one yet. This
+# needs Postgres 11 or later. The primary key has to include the partition
+# key, so upserts conflict on (collection, id) rather than id.
+CREATE_PARTITIONED_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS mongo (
+        id         VARCHAR   NOT NULL,
+        collection VARCHAR   NOT NULL,
+        timestamp  TIMESTAMP NOT NULL,
+        updated_at TIMESTAMP NOT NULL,
+        record     JSONB     NOT NULL,
+        PRIMARY KEY (collection, id)
+    ) PARTITION BY LIST (collection);
+    CREATE TABLE IF NOT EXISTS mongo_default PARTITION OF mongo DEFAULT;
+    CREATE INDEX IF NOT EXISTS mongo_timestamp ON mongo (timestamp);
+    CREATE INDEX IF NOT EXISTS mongo_updated_at ON mongo (updated_at);
+    CREATE INDEX IF NOT EXISTS mongo_collection_timestamp ON mongo (collection, timestamp);
+    CREATE INDEX IF NOT EXISTS mongo_collection_updated_at ON mongo (collection, updated_at);
+    CREATE INDEX IF NOT EXISTS mongo_collection_timestamp_id ON mongo (collection, timestamp, id);
+    CREATE INDEX IF NOT EXISTS mongo_record ON mongo USING gin (record jsonb_path_ops);
 """
 
 DROP_TABLE_SQL = """
@@ -37,6 +64,170 @@ def create_data_set_exists_query(mogrify, data_set_id):
     )
 
 
+def partition_name(data_set_id):
+    """
+    Data set names aren't all valid identifiers, and may be too long for
+    one, so partitions are named after a hash of the name.
+
+    >>> partition_name('some-collection')
+    'mongo_e05d99e118676b25cb758c133e79e5db'
+    """
+    return 'mongo_' + hashlib.md5(data_set_id).hexdigest()
+
+
+def create_partition_query(mogrify, data_set_id):
+    """
+    >>> from tests.support.test_helpers import mock_mogrify
+    >>> create_partition_query(mock_mogrify, 'some-collection')
+    "CREATE TABLE IF NOT EXISTS mongo_e05d99e118676b25cb758c133e79e5db PARTITION OF mongo FOR VALUES IN ('some-collection')"
+    """
+    return mogrify(
+        """
+        CREATE TABLE IF NOT EXISTS {} PARTITION OF mongo
+        FOR VALUES IN (%(collection)s)
+        """.format(partition_name(data_set_id)),
+        {'collection': data_set_id}
+    )
+
+
+def create_partition_exists_query(mogrify, data_set_id):
+    return mogrify(
+        "SELECT to_regclass(%(partition)s) IS NOT NULL",
+        {'partition': partition_name(data_set_id)}
+    )
+
+
+def create_truncate_partition_query(data_set_id):
+    """
+    >>> create_truncate_partition_query('some-collection')
+    'TRUNCATE mongo_e05d99e118676b25cb758c133e79e5db'
+    """
+    return 'TRUNCATE {}'.format(partition_name(data_set_id))
+
+
+def create_drop_partition_query(data_set_id):
+    """
+    >>> create_drop_partition_query('some-collection')
+    'DROP TABLE IF EXISTS mongo_e05d99e118676b25cb758c133e79e5db'
+    """
+    return 'DROP TABLE IF EXISTS {}'.format(partition_name(data_set_id))
+
+
+# Indexes added to the table after it was first deployed, which are built
+# concurrently on existing tables
+TABLE_INDEXES = OrderedDict([
+    ('mongo_collection_timestamp_id', '(collection, timestamp, id)'),
+    ('mongo_record', 'USING gin (record jsonb_path_ops)'),
+])
+
+# The expression indexed by each kind of index on a field
+FIELD_INDEX_KINDS = OrderedDict([
+    ('value', '(record->%(field)s)'),
+    ('prefix', '(record->>%(field)s) text_pattern_ops'),
+])
+
+
+def field_index_name(data_set_id, field, kind):
+    """
+    Index names are limited in length, like partition names.
+
+    >>> field_index_name('some-collection', 'foo', 'prefix')
+    'mongo_b01b24e84399b41e1bd83489c15ff8c0_prefix'
+    """
+    return 'mongo_{}_{}'.format(
+        hashlib.md5(_create_id(data_set_id, field)).hexdigest(), kind)
+
+
+def field_index_names(data_set_id, field):
+    return [field_index_name(data_set_id, field, kind)
+            for kind in FIELD_INDEX_KINDS]
+
+
+def create_field_index_queries(mogrify, data_set_id, field,
+                               partitioned=False):
+    """
+    Index a field of a data set's records for filter_by, which tests the
+    value with =, and for filter_by_prefix, which needs text_pattern_ops for
+    LIKE to use the index whatever the database's collation. On the shared
+    table the indexes only cover the data set's rows; with a partitioned
+    table they are built on its partition.
+
+    >>> from tests.support.test_helpers import mock_mogrify
+    >>> for query in create_field_index_queries(
+    ...         mock_mogrify, 'some-collection', 'foo'):
+    ...     print(query)
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS mongo_b01b24e84399b41e1bd83489c15ff8c0_value ON mongo ((record->'foo')) WHERE collection='some-collection'
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS mongo_b01b24e84399b41e1bd83489c15ff8c0_prefix ON mongo ((record->>'foo') text_pattern_ops) WHERE collection='some-collection'
+    >>> create_field_index_queries(
+    ...     mock_mogrify, 'some-collection', 'foo', partitioned=True)[0]
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS mongo_b01b24e84399b41e1bd83489c15ff8c0_value ON mongo_e05d99e118676b25cb758c133e79e5db ((record->'foo'))"
+    """
+    if partitioned:
+        table, where = partition_name(data_set_id), ''
+    else:
+        table, where = TABLE_NAME, mogrify(
+            'WHERE collection=%(collection)s', {'collection': data_set_id})
+
+    return [
+        mogrify(
+            """
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS {} ON {}
+            ({}) {}
+            """.format(field_index_name(data_set_id, field, kind), table,
+                       expression, where),
+            {'field': field}
+        ).strip()
+        for kind, expression in FIELD_INDEX_KINDS.items()
+    ]
+
+
+def create_table_index_queries():
+    """
+    Build the indexes added to the table after it was first deployed,
+    without locking out writes.
+
+    >>> for query in create_table_index_queries():
+    ...     print(query)
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS mongo_collection_timestamp_id ON mongo (collection, timestamp, id)
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS mongo_record ON mongo USING gin (record jsonb_path_ops)
+    """
+    return [
+        'CREATE INDEX CONCURRENTLY IF NOT EXISTS {} ON {} {}'.format(
+            name, TABLE_NAME, columns)
+        for name, columns in TABLE_INDEXES.items()
+    ]
+
+
+def create_invalid_indexes_query(mogrify, names):
+    """
+    A concurrent index build which fails leaves an invalid index behind,
+    which CREATE INDEX IF NOT EXISTS would keep rather than build again.
+
+    >>> from tests.support.test_helpers import mock_mogrify
+    >>> create_invalid_indexes_query(
+    ...     mock_mogrify, ['mongo_record', 'mongo_collection_timestamp_id'])
+    "SELECT pg_class.relname FROM pg_index JOIN pg_class ON pg_class.oid = pg_index.indexrelid WHERE pg_class.relname IN ('mongo_record', 'mongo_collection_timestamp_id') AND NOT pg_index.indisvalid"
+    """
+    return mogrify(
+        """
+        SELECT pg_class.relname FROM pg_index
+        JOIN pg_class ON pg_class.oid = pg_index.indexrelid
+        WHERE pg_class.relname IN ({})
+        AND NOT pg_index.indisvalid
+        """.format(', '.join('%(name{})s'.format(i)
+                             for i in range(len(names)))),
+        {'name{}'.format(i): name for i, name in enumerate(names)}
+    )
+
+
+def create_drop_index_query(name):
+    """
+    >>> create_drop_index_query('mongo_b01b24e84399b41e1bd83489c15ff8c0_value')
+    'DROP INDEX CONCURRENTLY IF EXISTS mongo_b01b24e84399b41e1bd83489c15ff8c0_value'
+    """
+    return 'DROP INDEX CONCURRENTLY IF EXISTS {}'.format(name)
+
+
 def create_delete_data_set_query(mogrify, data_set_id):
     return mogrify(
         "DELETE FROM mongo WHERE collection=%(collection)s",
@@ -60,22 +251,24 @@ def create_find_record_query(mogrify, data_set_id, record_id):
     """
     >>> from tests.support.test_helpers import mock_mogrify
     >>> create_find_record_query(mock_mogrify, 'some-collection', 'some-record')
-    "SELECT record FROM mongo WHERE id='some-collection:some-record'"
+    "SELECT record FROM mongo WHERE collection='some-collection' AND id='some-collection:some-record'"
     """
 
     return mogrify(
         """
         SELECT record FROM mongo
-        WHERE id=%(id)s
+        WHERE collection=%(collection)s AND id=%(id)s
         """,
-        {'id': _create_id(data_set_id, record_id)}
+        {'collection': data_set_id, 'id': _create_id(data_set_id, record_id)}
     )
 
 
-def create_update_record_query(mogrify, data_set_id, record, record_id, ts, updated_at):
+def create_update_record_query(mogrify, data_set_id, record, record_id, ts,
+                               updated_at, partitioned=False,
+                               table=TABLE_NAME):
     return mogrify(
         """
-        INSERT INTO mongo (id, collection, timestamp, updated_at, record)
+        INSERT INTO {} (id, collection, timestamp, updated_at, record)
         VALUES
         (
             %(id)s,
@@ -84,11 +277,11 @@ def create_update_record_query(mogrify, data_set_id, record, record_id, ts, upda
             %(updated_at)s,
             %(record)s
         )
-        ON CONFLICT (id) DO UPDATE SET
+        ON CONFLICT {} DO UPDATE SET
             timestamp=%(timestamp)s,
             updated_at=%(updated_at)s,
             record=%(record)s
-        """,
+        """.format(table, _conflict_target(partitioned)),
         {
             'id': _create_id(data_set_id, record_id),
             'collection': data_set_id,
@@ -99,10 +292,137 @@ def create_update_record_query(mogrify, data_set_id, record, record_id, ts, upda
     )
 
 
+def create_batch_update_records_query(mogrify, data_set_id, records,
+                                      updated_at, partitioned=False,
+                                      table=TABLE_NAME):
+    """
+    Creates a single multi-row upsert for a batch of records. Each record
+    must already have an _id, and no two records may share one. The rows
+    can be inserted straight into the data set's partition, if it has one.
+
+    >>> from tests.support.test_helpers import mock_mogrify, d_tz
+    >>> create_batch_update_records_query(
+    ...     mock_mogrify, 'some-collection',
+    ...     [{'_id': 'a'}, {'_id': 'b', '_timestamp': d_tz(2012, 12, 12)}],
+    ...     d_tz(2013, 1, 1))
+    'INSERT INTO mongo (id, collection, timestamp, updated_at, record) VALUES (\\'some-collection:a\\', \\'some-collection\\', \\'2013-01-01 00:00:00+00:00\\', \\'2013-01-01 00:00:00+00:00\\', \\'{"_id": "a"}\\'), (\\'some-collection:b\\', \\'some-collection\\', \\'2012-12-12 00:00:00+00:00\\', \\'2013-01-01 00:00:00+00:00\\', \\'{"_id": "b", "_timestamp": "2012-12-12T00:00:00+00:00"}\\') ON CONFLICT (id) DO UPDATE SET timestamp=EXCLUDED.timestamp, updated_at=EXCLUDED.updated_at, record=EXCLUDED.record'
+    """
+    values = [
+        mogrify(
+            "(%(id)s, %(collection)s, %(timestamp)s, %(updated_at)s, %(record)s)",
+            {
+                'id': _create_id(data_set_id, record['_id']),
+                'collection': data_set_id,
+                'timestamp': record.get('_timestamp', updated_at),
+                'updated_at': updated_at,
+                'record': json.dumps(record, default=_json_serialize_datetimes)
+            }
+        )
+        for record in records
+    ]
+    query_tokens = [
+        'INSERT INTO',
+        table,
+        '(id, collection, timestamp, updated_at, record)',
+        'VALUES',
+        ', '.join(values),
+        'ON CONFLICT', _conflict_target(partitioned), 'DO UPDATE SET',
+        'timestamp=EXCLUDED.timestamp,',
+        'updated_at=EXCLUDED.updated_at,',
+        'record=EXCLUDED.record',
+    ]
+    return ' '.join(query_tokens)
+
+
 def create_delete_record_query(mogrify, data_set_id, record_id):
     return mogrify(
-        "DELETE FROM mongo WHERE id=%(id)s",
-        {'id': _create_id(data_set_id, record_id)}
+        "DELETE FROM mongo WHERE collection=%(collection)s AND id=%(id)s",
+        {'collection': data_set_id, 'id': _create_id(data_set_id, record_id)}
+    )
+
+
+def create_patch_records_query(mogrify, data_set_id, patches, updated_at):
+    """
+    Creates a single UPDATE which merges fields into each of the records
+    which exist, returning the id and previous _timestamp of each. Records
+    keep their timestamp unless the patch gives one. No two patches may be
+    for the same record.
+
+    >>> from tests.support.test_helpers import mock_mogrify, d_tz
+    >>> create_patch_records_query(
+    ...     mock_mogrify, 'some-collection', [('a', {'foo': 'bar'})],
+    ...     d_tz(2013, 1, 1))
+    'UPDATE mongo SET timestamp=COALESCE(patch.timestamp, mongo.timestamp), updated_at=\\'2013-01-01 00:00:00+00:00\\', record=mongo.record || patch.record FROM (VALUES (\\'some-collection:a\\', \\'None\\'::timestamp, \\'{"foo": "bar"}\\'::jsonb)) AS patch (id, timestamp, record), mongo AS previous WHERE mongo.collection=\\'some-collection\\' AND previous.collection=\\'some-collection\\' AND mongo.id=patch.id AND previous.id=mongo.id RETURNING mongo.id, previous.record->>\\'_timestamp\\''
+    """
+    values = [
+        mogrify(
+            "(%(id)s, %(timestamp)s::timestamp, %(record)s::jsonb)",
+            {
+                'id': _create_id(data_set_id, record_id),
+                'timestamp': fields.get('_timestamp'),
+                'record': json.dumps(fields, default=_json_serialize_datetimes)
+            }
+        )
+        for record_id, fields in patches
+    ]
+    query_tokens = [
+        'UPDATE', TABLE_NAME, 'SET',
+        'timestamp=COALESCE(patch.timestamp, mongo.timestamp),',
+        mogrify('updated_at=%(updated_at)s,', {'updated_at': updated_at}),
+        'record=mongo.record || patch.record',
+        'FROM',
+        '(VALUES {}) AS patch (id, timestamp, record),'.format(
+            ', '.join(values)),
+        'mongo AS previous',
+        mogrify('WHERE mongo.collection=%(collection)s AND '
+                'previous.collection=%(collection)s',
+                {'collection': data_set_id}),
+        'AND mongo.id=patch.id AND previous.id=mongo.id',
+        "RETURNING mongo.id, previous.record->>'_timestamp'",
+    ]
+    return ' '.join(query_tokens)
+
+
+def create_delete_records_query(mogrify, data_set_id, record_ids):
+    """
+    Creates a single DELETE for the records with the given ids, returning
+    the id and _timestamp of each record which existed.
+
+    >>> from tests.support.test_helpers import mock_mogrify
+    >>> create_delete_records_query(mock_mogrify, 'some-collection', ['a'])
+    "DELETE FROM mongo WHERE collection='some-collection' AND id = ANY('['some-collection:a']') RETURNING id, record->>'_timestamp'"
+    """
+    return mogrify(
+        """
+        DELETE FROM mongo
+        WHERE collection=%(collection)s AND id = ANY(%(ids)s)
+        RETURNING id, record->>'_timestamp'
+        """,
+        {'collection': data_set_id,
+         'ids': [_create_id(data_set_id, record_id)
+                 for record_id in record_ids]}
+    )
+
+
+def create_delete_records_between_query(mogrify, data_set_id, start_at,
+                                        end_at):
+    """
+    Creates a single DELETE for the records with a timestamp from start_at
+    up to end_at, which can use the (collection, timestamp) index.
+
+    >>> from tests.support.test_helpers import mock_mogrify, d_tz
+    >>> create_delete_records_between_query(
+    ...     mock_mogrify, 'some-collection', d_tz(2012, 12, 12),
+    ...     d_tz(2012, 12, 13))
+    "DELETE FROM mongo WHERE collection='some-collection' AND timestamp >= '2012-12-12 00:00:00+00:00' AND timestamp < '2012-12-13 00:00:00+00:00'"
+    """
+    return mogrify(
+        """
+        DELETE FROM mongo
+        WHERE collection=%(collection)s
+        AND timestamp >= %(start_at)s AND timestamp < %(end_at)s
+        """,
+        {'collection': data_set_id, 'start_at': start_at, 'end_at': end_at}
     )
 
 
@@ -176,11 +496,19 @@ def _create_grouped_sql_query(mogrify, data_set_id, user_query):
     >>> fn([[123, '2012-01-01 00:00:00+00:00', 'some-foo-value'], [456, '2012-01-02 00:00:00+00:00', 'another-foo-value']])
     [{'_count': 123, 'foo': 'some-foo-value', '_week_start_at': '2012-01-01 00:00:00+00:00'}, {'_count': 456, 'foo': 'another-foo-value', '_week_start_at': '2012-01-02 00:00:00+00:00'}]
 
-    >>> query, fn = create_sql_query(mock_mogrify, 'some-collection', Query.create(group_by=['foo'], collect=[('bar', 'any-collector')]))
+    >>> query, fn = create_sql_query(mock_mogrify, 'some-collection', Query.create(group_by=['foo'], collect=[('bar', 'set')]))
+    >>> query
+    "SELECT count(*), record->'foo', array_remove(array_agg(DISTINCT record->'bar'), NULL) FROM mongo WHERE collection='some-collection' AND record->'foo' IS NOT NULL GROUP BY record->'foo'"
+    >>> [row] = fn([[123, 'some-foo-value', ['some-bar-value', 'another-bar-value']]])
+    >>> row['_count'], row['foo'], row['bar'].reduce('set')
+    (123, 'some-foo-value', ['another-bar-value', 'some-bar-value'])
+
+    >>> query, fn = create_sql_query(mock_mogrify, 'some-collection', Query.create(group_by=['foo'], collect=[('bar', 'mean')]))
     >>> query
-    "SELECT count(*), record->'foo', array_agg(record->'bar') FROM mongo WHERE collection='some-collection' AND record->'foo' IS NOT NULL GROUP BY record->'foo'"
-    >>> fn([[123, 'some-foo-value', ['some-bar-value', 'another-bar-value']]])
-    [{'_count': 123, 'foo': 'some-foo-value', 'bar': ['some-bar-value', 'another-bar-value']}]
+    "SELECT count(*), record->'foo', coalesce(sum(CASE jsonb_typeof(record->'bar') WHEN 'number' THEN (record->>'bar')::numeric WHEN 'boolean' THEN (record->>'bar')::boolean::int END), 0), count(*) FILTER (WHERE jsonb_typeof(record->'bar') NOT IN ('number', 'boolean')), count(record->'bar') FROM mongo WHERE collection='some-collection' AND record->'foo' IS NOT NULL GROUP BY record->'foo'"
+    >>> [row] = fn([[123, 'some-foo-value', Decimal('10'), 0, 4]])
+    >>> row['bar'].reduce('mean')
+    2.5
     """
 
     period_group_by_column_name = _get_period_columns(mogrify, user_query)
@@ -198,6 +526,7 @@ def _create_grouped_sql_query(mogrify, data_set_id, user_query):
     where_clauses = (
         [mogrify('collection=%(collection)s', {'collection': data_set_id})] +
         _get_where_conditions(mogrify, user_query) +
+        _get_id_conditions(mogrify, data_set_id, user_query) +
         _get_time_limit_conditions(mogrify, user_query) +
         _get_field_group_not_null_conditions(
             field_group_by_column_name.values())
@@ -218,7 +547,11 @@ def _create_grouped_sql_query(mogrify, data_set_id, user_query):
         key_by_index = ['_count'] + period_group_by_column_name.keys() + \
             field_group_by_column_name.keys() + \
             collect_column_by_column_name.keys()
-        return [_translate_row(row, key_by_index) for row in rows]
+        return [
+            _collect_summaries(
+                _translate_row(row, key_by_index), user_query.collect)
+            for row in rows
+        ]
 
     return sql_query, translate_results
 
@@ -255,11 +588,65 @@ def _get_period_columns(mogrify, user_query):
 
 
 def _get_collect_columns(mogrify, user_query):
-    return OrderedDict(
-        (collect, mogrify(
-            "array_agg(record->%(collect)s)", {'collect': collect}))
-        for collect, _ in (user_query.collect or [])
-    )
+    """
+    Collected values are summarised in SQL rather than returned as arrays.
+    Columns are keyed on (field, summary) and only the summaries needed by
+    the requested collect methods are selected. Values which are neither
+    numbers nor booleans are counted so that summing them can still fail.
+    A group without any values for the field sums to 0, as with Mongo's
+    $sum, rather than NULL.
+    """
+    columns = OrderedDict()
+    for field, methods in get_collect_methods(user_query.collect or []):
+        value = mogrify('record->%(field)s', {'field': field})
+        text = mogrify('record->>%(field)s', {'field': field})
+        json_type = 'jsonb_typeof({})'.format(value)
+
+        if methods & set(['sum', 'mean']):
+            columns[(field, 'sum')] = (
+                "coalesce(sum(CASE {type} "
+                "WHEN 'number' THEN ({text})::numeric "
+                "WHEN 'boolean' THEN ({text})::boolean::int END), 0)"
+            ).format(type=json_type, text=text)
+            columns[(field, 'non_numeric')] = (
+                "count(*) FILTER (WHERE {} NOT IN ('number', 'boolean'))"
+            ).format(json_type)
+        if methods & set(['count', 'mean']):
+            columns[(field, 'count')] = 'count({})'.format(value)
+        if 'set' in methods:
+            columns[(field, 'distinct')] = \
+                'array_remove(array_agg(DISTINCT {}), NULL)'.format(value)
+    return columns
+
+
+def _collect_summaries(row, collect):
+    """
+    Replace the (field, summary) columns of a translated row with a single
+    CollectedValues for each collect field.
+    """
+    for field, _ in get_collect_methods(collect or []):
+        row[field] = CollectedValues(
+            sum=_from_numeric(row.pop((field, 'sum'), None)),
+            count=row.pop((field, 'count'), None),
+            distinct=row.pop((field, 'distinct'), None),
+            non_numeric=row.pop((field, 'non_numeric'), 0))
+    return row
+
+
+def _from_numeric(value):
+    """
+    Postgres sums numerics into Decimals, which don't serialise to JSON.
+
+    >>> _from_numeric(Decimal('3'))
+    3
+    >>> _from_numeric(Decimal('2.5'))
+    2.5
+    >>> _from_numeric(None)
+    """
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() \
+            else float(value)
+    return value
 
 
 def _create_basic_sql_query(mogrify, data_set_id, user_query):
@@ -270,7 +657,7 @@ def _create_basic_sql_query(mogrify, data_set_id, user_query):
     >>> user_query = Query.create(filter_by=[('foo', 'bar')])
     >>> query, fn = create_sql_query(mock_mogrify, 'some-collection', user_query)
     >>> query
-    'SELECT record FROM mongo WHERE collection=\\'some-collection\\' AND record @> \\'{"foo": "bar"}\\''
+    'SELECT record FROM mongo WHERE collection=\\'some-collection\\' AND record @> \\'{"foo": "bar"}\\' AND record->\\'foo\\' = \\'"bar"\\''
 
     >>> user_query = Query.create(filter_by_prefix=[('foo', 'bar')])
     >>> query, fn = create_sql_query(mock_mogrify, 'some-collection', user_query)
@@ -291,12 +678,24 @@ def _create_basic_sql_query(mogrify, data_set_id, user_query):
     >>> query, fn = create_sql_query(mock_mogrify, 'some-collection', user_query)
     >>> query
     "SELECT record FROM mongo WHERE collection='some-collection' LIMIT '1'"
+
+    >>> user_query = Query.create(limit=1, after=())
+    >>> query, fn = create_sql_query(mock_mogrify, 'some-collection', user_query)
+    >>> query
+    "SELECT record FROM mongo WHERE collection='some-collection' ORDER BY timestamp, id LIMIT '1'"
+
+    >>> user_query = Query.create(limit=1, after=(d_tz(2012, 12, 12), 'abc'))
+    >>> query, fn = create_sql_query(mock_mogrify, 'some-collection', user_query)
+    >>> query
+    "SELECT record FROM mongo WHERE collection='some-collection' AND (timestamp, id) > ('2012-12-12 00:00:00+00:00', 'some-collection:abc') ORDER BY timestamp, id LIMIT '1'"
     """
 
     where_clauses = (
         [mogrify('collection=%(collection)s', {'collection': data_set_id})] +
         _get_where_conditions(mogrify, user_query) +
-        _get_time_limit_conditions(mogrify, user_query)
+        _get_id_conditions(mogrify, data_set_id, user_query) +
+        _get_time_limit_conditions(mogrify, user_query) +
+        _get_after_conditions(mogrify, data_set_id, user_query)
     )
     query_tokens = [
         'SELECT record FROM',
@@ -312,8 +711,16 @@ def _create_basic_sql_query(mogrify, data_set_id, user_query):
 
 
 def _get_where_conditions(mogrify, user_query):
+    """
+    filter_by values are strings or booleans, so containment is the same
+    test as equality of the field. Both are given so that the query can use
+    the GIN index on record, or the index on the field if the data set has
+    one.
+    """
     filter_by_sql_tokens = [
-        mogrify("record @> %(json)s", {'json': json.dumps({key: value})})
+        mogrify("record @> %(json)s AND record->%(key)s = %(value)s",
+                {'json': json.dumps({key: value}), 'key': key,
+                 'value': json.dumps(value)})
         for key, value in (user_query.filter_by or [])
     ]
     filter_by_prefix_sql_tokens = [
@@ -324,6 +731,21 @@ def _get_where_conditions(mogrify, user_query):
     return filter_by_sql_tokens + filter_by_prefix_sql_tokens
 
 
+def _get_id_conditions(mogrify, data_set_id, user_query):
+    """
+    Restrict the query to a set of record ids, which is a lookup on the
+    primary key.
+    """
+    if not user_query.ids:
+        return []
+
+    return [mogrify(
+        'id = ANY(%(ids)s)',
+        {'ids': [_create_id(data_set_id, record_id)
+                 for record_id in user_query.ids]}
+    )]
+
+
 def _get_time_limit_conditions(mogrify, user_query):
     """
     Converts a query into a list of conditions to be concatenated into a where query
@@ -347,7 +769,26 @@ def _get_time_limit_conditions(mogrify, user_query):
     return clauses
 
 
+def _get_after_conditions(mogrify, data_set_id, user_query):
+    """
+    Keyset pagination: continue from the (timestamp, id) of the last record
+    on the previous page, which the mongo_collection_timestamp_id index
+    can seek to directly.
+    """
+    if not user_query.after:
+        return []
+
+    timestamp, record_id = user_query.after
+    return [mogrify(
+        '(timestamp, id) > (%(timestamp)s, %(id)s)',
+        {'timestamp': timestamp, 'id': _create_id(data_set_id, record_id)}
+    )]
+
+
 def _get_sort_by(mogrify, user_query):
+    if user_query.is_paginated:
+        return 'ORDER BY timestamp, id'
+
     if not user_query.sort_by:
         return None
 
@@ -367,6 +808,10 @@ def _get_limit(mogrify, user_query):
     return mogrify('LIMIT %(limit)s', {'limit': user_query.limit}) if user_query.limit else None
 
 
+def _conflict_target(partitioned):
+    return '(collection, id)' if partitioned else '(id)'
+
+
 def _create_id(data_set_id, record_id):
     """
     The record_ids are not necessarily globally unique, because they're user provided and
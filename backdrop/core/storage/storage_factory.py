@@ -1,5 +1,6 @@
 from .mongo import MongoStorageEngine
-from .postgres import PostgresStorageEngine
+from .postgres import PostgresStorageEngine, DEFAULT_POOL_MIN, \
+    DEFAULT_POOL_MAX, DEFAULT_ITERSIZE, DEFAULT_POOL_TIMEOUT
 
 
 def create_storage_engine(config):
@@ -8,10 +9,19 @@ def create_storage_engine(config):
     if database_engine == 'mongodb':
         storage = MongoStorageEngine.create(
             database_url,
-            config.get('CA_CERTIFICATE')
+            config.get('CA_CERTIFICATE'),
+            config.get('MONGO_USE_AGGREGATION', True)
         )
     elif database_engine == 'postgres':
-        storage = PostgresStorageEngine(database_url)
+        storage = PostgresStorageEngine(
+            database_url,
+            config.get('DATABASE_POOL_MIN', DEFAULT_POOL_MIN),
+            config.get('DATABASE_POOL_MAX', DEFAULT_POOL_MAX),
+            config.get('DATABASE_ITERSIZE', DEFAULT_ITERSIZE),
+            config.get('DATABASE_PARTITIONED', False),
+            config.get('DATABASE_POOL_TIMEOUT', DEFAULT_POOL_TIMEOUT),
+            config.get('DATABASE_STREAM_MAX')
+        )
     else:
         raise NotImplementedError(
             'Database engine not implemented "%s"' % database_engine)
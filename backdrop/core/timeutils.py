@@ -1,8 +1,15 @@
 import datetime
+import re
 import time
 from dateutil import parser
 import pytz
 
+# The strict format records and queries use, yyyy-MM-ddTHH:MM:SS with
+# optional fractional seconds and a Z or +hh:mm offset
+_ISO8601 = re.compile(
+    r'(\d{4})-(\d{2})-(\d{2})T(\d{2}):(\d{2}):(\d{2})(?:\.(\d{1,6}))?'
+    r'(?:(Z)|([+-])(\d{2}):?(\d{2}))?$')
+
 
 def now():
     return datetime.datetime.now(pytz.UTC)
@@ -12,11 +19,48 @@ def as_seconds(dt):
     return time.mktime(dt.timetuple())
 
 
+def parse_iso8601(time_string):
+    """Parse a time string the way dateutil would, but quickly for strict
+    ISO-8601 strings. Anything else, including out of range values, is left
+    to dateutil so that errors are the same.
+
+    >>> parse_iso8601('2012-12-12T12:12:12Z')
+    datetime.datetime(2012, 12, 12, 12, 12, 12, tzinfo=<UTC>)
+    >>> parse_iso8601('2012-12-12T12:12:12.5-05:30')
+    datetime.datetime(2012, 12, 12, 12, 12, 12, 500000, \
+tzinfo=pytz.FixedOffset(-330))
+    >>> parse_iso8601('2012-12-12T12:12:12')
+    datetime.datetime(2012, 12, 12, 12, 12, 12)
+    >>> parse_iso8601('12 December 2012')
+    datetime.datetime(2012, 12, 12, 0, 0)
+    """
+    match = _ISO8601.match(time_string) \
+        if isinstance(time_string, basestring) else None
+    if match is None:
+        return parser.parse(time_string)
+
+    (year, month, day, hour, minute, second, fraction,
+     zulu, sign, offset_hours, offset_minutes) = match.groups()
+    if zulu or sign is None:
+        tzinfo = pytz.UTC if zulu else None
+    else:
+        offset = int(offset_hours) * 60 + int(offset_minutes)
+        tzinfo = pytz.FixedOffset(-offset if sign == '-' else offset) \
+            if offset else pytz.UTC
+    try:
+        return datetime.datetime(
+            int(year), int(month), int(day),
+            int(hour), int(minute), int(second),
+            int(fraction.ljust(6, '0')) if fraction else 0, tzinfo)
+    except ValueError:
+        return parser.parse(time_string)
+
+
 def parse_time_as_utc(time_string):
     if isinstance(time_string, datetime.datetime):
         time = time_string
     else:
-        time = parser.parse(time_string)
+        time = parse_iso8601(time_string)
 
     return as_utc(time)
 
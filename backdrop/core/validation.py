@@ -5,14 +5,15 @@ App specific validation functions combine validators and return a
 ValidationResult object.
 """
 from collections import namedtuple
-import jsonschema
 import json
 import datetime
 import re
 import bson
-from dateutil import parser
 import pytz
 
+from .schema_validators import get_validator
+from .timeutils import parse_iso8601
+
 
 RESERVED_KEYWORDS = (
     '_timestamp',
@@ -25,7 +26,7 @@ VALID_KEY = re.compile('^[a-z_][a-z0-9_]+$')
 
 def _is_real_date(value):
     try:
-        parser.parse(value).astimezone(pytz.UTC)
+        parse_iso8601(value).astimezone(pytz.UTC)
         return True
     except (TypeError, ValueError):
         return False
@@ -124,8 +125,11 @@ def validate_record_data(data):
 
 
 def validate_record_schema(record, schema):
-    error_iterator = jsonschema.Draft4Validator(
-        schema,
-        format_checker=jsonschema.FormatChecker()).iter_errors(record)
-    error_messages = [error.message for error in error_iterator]
-    return error_messages
+    return get_validator(schema)(record)
+
+
+def validate_records_schema(records, schema):
+    """Validate a batch of records against a schema, returning the error
+    messages for all of them"""
+    validate = get_validator(schema)
+    return [message for record in records for message in validate(record)]
@@ -1,23 +1,29 @@
 
+import collections
 import datetime
 import json
 from os import getenv
 
 from bson import ObjectId
-from flask import Flask, jsonify, request, make_response
+from flask import Flask, Response, jsonify, request
 from flask_featureflags import FeatureFlag
 from performanceplatform import client
+from psycopg2.pool import PoolError
 
 from backdrop import statsd
-from .query import parse_query_from_request
+from .query import next_page_token, parse_query_from_request
+from .query_cache import create_query_result_cache
+from .streaming import json_stream_response
 from .validation import validate_request_args
 from ..core import log_handler, cache_control, http_validation, parser
+from ..core.config_cache import create_caching_admin_api
 from ..core.data_set import DataSet
 from ..core.errors import InvalidOperationError
 from ..core.flaskutils import generate_request_id
 from ..core.response import crossdomain
 from ..core.storage.storage_factory import create_storage_engine
 from ..core.timeutils import as_utc
+from ..write.validation import extract_bearer_token
 
 ENVIRONMENT = getenv("ENVIRONMENT", "development")
 
@@ -30,12 +36,13 @@ app.config.from_object(
     "backdrop.read.config.{}".format(ENVIRONMENT))
 
 storage = create_storage_engine(app.config)
-admin_api = client.AdminAPI(
+admin_api = create_caching_admin_api(client.AdminAPI(
     app.config['STAGECRAFT_URL'],
     app.config['SIGNON_API_USER_TOKEN'],
     dry_run=False,
     request_id_fn=generate_request_id,
-)
+), app.config)
+query_results = create_query_result_cache(app.config)
 
 DEFAULT_DATA_SET_QUERYABLE = True
 DEFAULT_DATA_SET_RAW_QUERIES = False
@@ -73,6 +80,15 @@ def uncaught_error_handler(e):
     return (jsonify(status='error', message=error_message), 500)
 
 
+@app.errorhandler(PoolError)
+@crossdomain(origin='*')
+def pool_exhausted_handler(e):
+    """Every database connection stayed checked out for too long"""
+    app.logger.warning(e)
+    return (jsonify(status='error',
+                    message='Service Unavailable: database is busy'), 503)
+
+
 @app.errorhandler(404)
 @app.errorhandler(405)
 @crossdomain(origin='*')
@@ -125,6 +141,26 @@ def data_set_health():
                        message='All data_sets are in date')
 
 
+@app.route('/_cache/data-sets', methods=['DELETE'])
+@app.route('/_cache/data-sets/<data_set_name>', methods=['DELETE'])
+@cache_control.nocache
+@statsd.timer('read.route.invalidate_data_set_config')
+def invalidate_data_set_config(data_set_name=None):
+    """
+    Called by Stagecraft when data set configs change, so that changes
+    such as unpublishing a data set take effect straight away.
+    """
+    token = extract_bearer_token(request.headers.get('Authorization'))
+    if token is None or \
+            token != app.config['STAGECRAFT_COLLECTION_ENDPOINT_TOKEN']:
+        return log_error_and_respond(
+            data_set_name, 'Unauthorized: invalid or no token given.', 401)
+
+    admin_api.invalidate(data_set_name)
+
+    return jsonify(status='ok')
+
+
 def _data_set_object(data_set):
     return {
         "name": data_set.name,
@@ -196,28 +232,39 @@ def fetch(data_set_config):
                 data_set_config['name'], result.message,
                 400)
 
-        data_set = DataSet(storage, data_set_config)
+        data_set = DataSet(
+            storage, data_set_config,
+            period_rollups=app.config.get('PERIOD_ROLLUPS', False))
 
         try:
             query = parse_query_from_request(request)
-            data = data_set.execute_query(query)
+            data = _execute_query(data_set, query)
 
         except InvalidOperationError:
             return log_error_and_respond(
                 data_set.name, 'invalid collect function',
                 400)
 
+        next_page = None
+        if query.is_paginated and query.limit:
+            try:
+                data, next_page = _track_next_page(data, query.limit)
+            except InvalidOperationError as e:
+                return log_error_and_respond(data_set.name, e.message, 400)
+
         data_set_is_published = data_set_config.get('published',
                                                     DEFAULT_DATA_SET_PUBLISHED)
         if data_set_is_published is False:
             warning = ("Warning: This data-set is unpublished. "
                        "Data may be subject to change or be inaccurate.")
-            response = jsonify(data=data, warning=warning)
+            response = to_json(data, next_page, warning=warning)
             # Do not cache unpublished data-sets
             response.headers['Cache-Control'] = "no-cache"
         else:
-            fmt = to_csv if request.args.get("format") == "csv" else to_json
-            response = fmt(data=data)
+            if request.args.get("format") == "csv":
+                response = to_csv(data)
+            else:
+                response = to_json(data, next_page)
 
             # Set cache control based on data set type
             if data_set_config.get('realtime', DEFAULT_DATA_SET_REALTIME):
@@ -232,9 +279,56 @@ def fetch(data_set_config):
     return response
 
 
+def _execute_query(data_set, query):
+    """
+    Raw queries matching more than RAW_QUERY_STREAM_THRESHOLD records are
+    returned as an iterator over the records so that they can be streamed.
+    Smaller results are cached like any other.
+    """
+    threshold = app.config.get('RAW_QUERY_STREAM_THRESHOLD')
+    if threshold is None or query.is_grouped:
+        return query_results.execute_query(data_set, query)
+    return query_results.execute_or_stream(data_set, query, threshold)
+
+
+def _track_next_page(data, limit):
+    """
+    Returns the data along with a function giving the fields which link
+    to the next page: `next` is its `after` token, or None if this is the
+    last page. Streamed data is watched as it is written out, so the token
+    is only known at the end, when it is too late to refuse a page which
+    cannot be continued from and `error` says why instead.
+    """
+    if not isinstance(data, collections.Iterator):
+        token = next_page_token(data[-1]) if len(data) == limit else None
+        return data, lambda: {'next': token}
+
+    seen = {'count': 0, 'last': None}
+
+    def track(records):
+        for record in records:
+            seen['count'] += 1
+            seen['last'] = record
+            yield record
+
+    def fields():
+        if seen['count'] < limit:
+            return {'next': None}
+        try:
+            return {'next': next_page_token(seen['last'])}
+        except InvalidOperationError as e:
+            return {'next': None, 'error': e.message}
+
+    return track(data), fields
+
+
 def to_csv(data, filename="export.csv"):
-    csv = parser.json_to_csv(data=data)
-    response = make_response(csv)
+    """Only streamed data is written out as it is read, so that other
+    responses keep their ETag"""
+    if isinstance(data, collections.Iterator):
+        response = Response(parser.iter_csv(data))
+    else:
+        response = Response(parser.json_to_csv(data))
     content_disposition = "attachment; filename={}".format(filename)
     content_type = "text/csv"
     response.headers["Content-Disposition"] = content_disposition
@@ -242,9 +336,14 @@ def to_csv(data, filename="export.csv"):
     return response
 
 
-def to_json(data):
-    response = jsonify(data=data)
-    return response
+def to_json(data, next_page=None, **fields):
+    """Paginated responses carry the token for the next page as `next`"""
+    if isinstance(data, collections.Iterator):
+        return json_stream_response(
+            data, JsonEncoder(), trailer=next_page, **fields)
+    if next_page:
+        fields.update(next_page())
+    return jsonify(data=data, **fields)
 
 
 def start(port):
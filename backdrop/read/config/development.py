@@ -6,6 +6,8 @@ STAGECRAFT_URL = 'http://localhost:3103'
 
 SIGNON_API_USER_TOKEN = 'development-oauth-access-token'
 
+STAGECRAFT_COLLECTION_ENDPOINT_TOKEN = 'dev-create-endpoint-token'
+
 try:
     from .development_environment import *
 except ImportError:
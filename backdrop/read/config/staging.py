@@ -5,7 +5,30 @@ PAAS = load_paas_settings()
 DATABASE_URL = PAAS.get('DATABASE_URL')
 DATABASE_ENGINE = PAAS.get('DATABASE_ENGINE')
 CA_CERTIFICATE = PAAS.get('CA_CERTIFICATE')
+DATABASE_POOL_MIN = int(os.getenv('DATABASE_POOL_MIN', 1))
+DATABASE_POOL_MAX = int(os.getenv('DATABASE_POOL_MAX', 10))
+DATABASE_POOL_TIMEOUT = int(os.getenv('DATABASE_POOL_TIMEOUT', 30))
+DATABASE_STREAM_MAX = int(os.getenv('DATABASE_STREAM_MAX', 5))
+DATABASE_ITERSIZE = int(os.getenv('DATABASE_ITERSIZE', 1000))
+MONGO_USE_AGGREGATION = os.getenv('MONGO_USE_AGGREGATION', 'true') == 'true'
+QUERY_CACHE_BACKEND = os.getenv('QUERY_CACHE_BACKEND')
+QUERY_CACHE_SIZE = int(os.getenv('QUERY_CACHE_SIZE', 1000))
+QUERY_CACHE_TTL = int(os.getenv('QUERY_CACHE_TTL', 300))
+# The write API can only drop results cached in Redis when records are
+# deleted, so the per-process lru backend caches them for less time
+QUERY_CACHE_LRU_TTL = int(os.getenv('QUERY_CACHE_LRU_TTL', 60))
+QUERY_CACHE_REDIS_URL = os.getenv('QUERY_CACHE_REDIS_URL')
+CONFIG_CACHE_BACKEND = os.getenv('CONFIG_CACHE_BACKEND')
+CONFIG_CACHE_SIZE = int(os.getenv('CONFIG_CACHE_SIZE', 1000))
+CONFIG_CACHE_TTL = int(os.getenv('CONFIG_CACHE_TTL', 60))
+CONFIG_CACHE_STALE_TTL = int(os.getenv('CONFIG_CACHE_STALE_TTL', 3600))
+CONFIG_CACHE_REDIS_URL = os.getenv('CONFIG_CACHE_REDIS_URL')
+RAW_QUERY_STREAM_THRESHOLD = int(
+    os.getenv('RAW_QUERY_STREAM_THRESHOLD', 10000))
+PERIOD_ROLLUPS = os.getenv('PERIOD_ROLLUPS', 'false') == 'true'
 STAGECRAFT_URL = os.getenv('STAGECRAFT_URL')
 SIGNON_API_USER_TOKEN = os.getenv('SIGNON_API_USER_TOKEN')
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
 SESSION_COOKIE_SECURE = True
+STAGECRAFT_COLLECTION_ENDPOINT_TOKEN = os.getenv(
+    'STAGECRAFT_COLLECTION_ENDPOINT_TOKEN')
@@ -1,7 +1,9 @@
 DATABASE_URL = 'postgres://postgres@localhost:5432'
 DATABASE_ENGINE = 'postgres'
+DATABASE_POOL_MIN = 0
 LOG_LEVEL = "ERROR"
 
 DATA_SET_RATE_LIMIT = '10000/second'
 
-from development import STAGECRAFT_URL, SIGNON_API_USER_TOKEN
+from development import (STAGECRAFT_COLLECTION_ENDPOINT_TOKEN, STAGECRAFT_URL,
+                         SIGNON_API_USER_TOKEN)
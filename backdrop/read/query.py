@@ -1,9 +1,14 @@
+from bson import ObjectId
+
+from backdrop.core.errors import InvalidOperationError
 from backdrop.core.timeseries import parse_period
-from backdrop.core.timeutils import parse_time_as_utc
+from backdrop.core.timeutils import as_utc, parse_time_as_utc
 from backdrop.core.query import Query
 import re
 
-__all__ = ['parse_query_from_request']
+__all__ = ['parse_query_from_request', 'next_page_token']
+
+OBJECT_ID_TOKEN = re.compile(r'^ObjectId\(([0-9a-f]{24})\)$')
 
 
 def parse_query_from_request(request):
@@ -11,6 +16,53 @@ def parse_query_from_request(request):
     return Query.create(**parse_request_args(request.args))
 
 
+def parse_after(value):
+    """Parse an `after` token into the _timestamp and _id of the last
+    record on the previous page. An empty token asks for the first page.
+
+    >>> parse_after('2014-01-01T00:00:00+00:00,some,id')
+    (datetime.datetime(2014, 1, 1, 0, 0, tzinfo=<UTC>), 'some,id')
+    >>> parse_after('2014-01-01T00:00:00+00:00,ObjectId(5284f27b2c54f3c2ee0d8d3a)')
+    (datetime.datetime(2014, 1, 1, 0, 0, tzinfo=<UTC>), ObjectId('5284f27b2c54f3c2ee0d8d3a'))
+    >>> parse_after('')
+    ()
+    """
+    if not value:
+        return ()
+    timestamp, record_id = value.split(',', 1)
+    match = OBJECT_ID_TOKEN.match(record_id)
+    if match:
+        record_id = ObjectId(match.group(1))
+    return parse_time_as_utc(timestamp), record_id
+
+
+def next_page_token(record):
+    """The `after` token for the page following one which ended with the
+    given record. Records stored in mongo without an _id of their own have
+    an ObjectId, which is marked as such so that the next page continues
+    from it.
+
+    >>> from datetime import datetime
+    >>> next_page_token({'_timestamp': datetime(2014, 1, 1), '_id': 'abc'})
+    u'2014-01-01T00:00:00+00:00,abc'
+    >>> next_page_token({'_timestamp': datetime(2014, 1, 1),
+    ...                  '_id': ObjectId('5284f27b2c54f3c2ee0d8d3a')})
+    u'2014-01-01T00:00:00+00:00,ObjectId(5284f27b2c54f3c2ee0d8d3a)'
+    >>> next_page_token({'_id': 'abc'})
+    Traceback (most recent call last):
+        ...
+    InvalidOperationError: Records without a _timestamp and an _id cannot be paged through
+    """
+    if record.get('_timestamp') is None or record.get('_id') is None:
+        raise InvalidOperationError(
+            "Records without a _timestamp and an _id cannot be paged through")
+    record_id = record['_id']
+    if isinstance(record_id, ObjectId):
+        record_id = u'ObjectId({})'.format(record_id)
+    return u'{},{}'.format(
+        as_utc(record['_timestamp']).isoformat(), record_id)
+
+
 def if_present(func, value):
     """Apply the given function to the value and return if it exists"""
     if value is not None:
@@ -68,5 +120,7 @@ def parse_request_args(request_args):
 
     args['flatten'] = if_present(boolify, request_args.get('flatten'))
     args['inclusive'] = if_present(boolify, request_args.get('inclusive'))
+    args['after'] = if_present(parse_after, request_args.get('after'))
+    args['ids'] = request_args.getlist('id')
 
     return args
@@ -0,0 +1,154 @@
+"""
+Caches the results of read queries until the data set they were run against
+is next written to.
+"""
+import datetime
+import hashlib
+import json
+
+from bson import ObjectId
+
+from backdrop import statsd
+from backdrop.core.cache import create_cache
+from backdrop.core.response import SimpleData
+from backdrop.core.timeseries import Period
+from .streaming import peek
+
+__all__ = ['QueryResultCache', 'create_query_result_cache',
+           'query_cache_key']
+
+# The lru backend is per process, so the write API can't drop its results
+# when records are deleted and they are only cached for this long
+DEFAULT_LRU_TTL = 60
+
+
+def create_query_result_cache(config):
+    """Create a QueryResultCache from the QUERY_CACHE_* settings in a flask
+    app config. Results cached by the lru backend expire after
+    QUERY_CACHE_LRU_TTL seconds at most, as deletes can only invalidate the
+    redis backend.
+
+    >>> create_query_result_cache({
+    ...     'QUERY_CACHE_BACKEND': 'lru', 'QUERY_CACHE_TTL': 300})._backend.ttl
+    60
+    """
+    backend = config.get('QUERY_CACHE_BACKEND')
+    ttl = config.get('QUERY_CACHE_TTL', 300)
+    if backend == 'lru':
+        ttl = min(ttl, config.get('QUERY_CACHE_LRU_TTL', DEFAULT_LRU_TTL))
+    return QueryResultCache(create_cache(
+        backend,
+        max_size=config.get('QUERY_CACHE_SIZE', 1000),
+        ttl=ttl,
+        redis_url=config.get('QUERY_CACHE_REDIS_URL'),
+        prefix='backdrop:query:',
+    ))
+
+
+class QueryResultCache(object):
+
+    """Wraps DataSet.execute_query with a cache backend from
+    backdrop.core.cache. With no backend every query is executed."""
+
+    def __init__(self, backend):
+        self._backend = backend
+
+    def execute_query(self, data_set, query):
+        if self._backend is None:
+            return data_set.execute_query(query)
+
+        key, data = self._get(data_set, query)
+        if data is None:
+            data = data_set.execute_query(query)
+            self._backend.set(key, data)
+        return data
+
+    def execute_or_stream(self, data_set, query, threshold):
+        """Like execute_query for a raw query, except that a result of more
+        than threshold records is returned as an iterator so that it can be
+        streamed, and isn't cached. Cached results are served without
+        touching storage."""
+        key, data = self._get(data_set, query)
+        if data is not None:
+            return data
+
+        head, records = peek(
+            data_set.iter_query(query, stream_after=threshold), threshold + 1)
+        if len(head) > threshold:
+            statsd.incr('read.query.streamed', data_set=data_set.name)
+            return records
+
+        data = SimpleData(head).data()
+        if key is not None:
+            self._backend.set(key, data)
+        return data
+
+    def _get(self, data_set, query):
+        if self._backend is None:
+            return None, None
+
+        key = query_cache_key(data_set, query)
+        data = self._backend.get(key)
+        if data is not None:
+            statsd.incr('read.query_cache.hit', data_set=data_set.name)
+        else:
+            statsd.incr('read.query_cache.miss', data_set=data_set.name)
+        return key, data
+
+    def invalidate(self, data_set_name):
+        """Drop the cached results for a data set. Writes move queries on to
+        new keys anyway, but deleting records doesn't always. Only drops
+        them from this process with the lru backend."""
+        if self._backend is not None:
+            self._backend.clear(data_set_name + ':')
+
+
+def query_cache_key(data_set, query):
+    """Build a cache key from the data set name, the query and the time the
+    data set was last updated, so that any write moves queries on to a new
+    key. Queries which may be answered from period rollups also move on
+    when the rollups are updated, as that can be after the write. Filters,
+    collects and ids are sorted as their order does not change the result.
+    Keys start with the data set name so that they can be invalidated
+    together.
+
+    >>> from mock import Mock
+    >>> from backdrop.core.query import Query
+    >>> data_set = Mock()
+    >>> data_set.name = 'foo'
+    >>> data_set.get_last_updated.return_value = None
+    >>> data_set.get_rollups_last_updated.return_value = None
+    >>> a = query_cache_key(data_set, Query.create(
+    ...     filter_by=[['a', '1'], ['b', '2']]))
+    >>> b = query_cache_key(data_set, Query.create(
+    ...     filter_by=[['b', '2'], ['a', '1']]))
+    >>> a == b
+    True
+    >>> data_set.get_last_updated.return_value = datetime.datetime(2014, 1, 1)
+    >>> a == query_cache_key(data_set, Query.create(
+    ...     filter_by=[['a', '1'], ['b', '2']]))
+    False
+    >>> a.startswith('foo:')
+    True
+    """
+    normalised = query._asdict()
+    for field in ['filter_by', 'filter_by_prefix', 'collect']:
+        normalised[field] = sorted(list(item) for item in normalised[field])
+    normalised['ids'] = sorted(set(normalised['ids']))
+
+    key = json.dumps(
+        [data_set.name, normalised, data_set.get_last_updated(),
+         data_set.get_rollups_last_updated(query)],
+        sort_keys=True,
+        default=_json_default)
+    return '{}:{}'.format(data_set.name, hashlib.sha1(key).hexdigest())
+
+
+def _json_default(obj):
+    if isinstance(obj, datetime.datetime):
+        return obj.isoformat()
+    if isinstance(obj, Period):
+        return obj.name
+    if isinstance(obj, ObjectId):
+        return 'ObjectId({})'.format(obj)
+    raise TypeError("Type %s not serializable" % type(obj))
@@ -0,0 +1,64 @@
+"""
+Streams JSON responses for large raw queries rather than building the
+whole document in memory.
+"""
+import itertools
+
+from flask import Response
+
+DEFAULT_RECORDS_PER_CHUNK = 100
+
+
+def peek(iterable, count):
+    """Read up to count items from an iterable, returning them along with an
+    iterator over every item
+
+    >>> head, items = peek(iter([1, 2, 3]), 2)
+    >>> head
+    [1, 2]
+    >>> list(items)
+    [1, 2, 3]
+    """
+    iterator = iter(iterable)
+    head = list(itertools.islice(iterator, count))
+    return head, itertools.chain(head, iterator)
+
+
+def json_chunks(records, encoder, records_per_chunk=DEFAULT_RECORDS_PER_CHUNK,
+                trailer=None, **fields):
+    """Yield a JSON document of the form {"data": [...]} piece by piece,
+    with any extra fields ahead of the data. Fields which can only be known
+    once the records have been read can be given by a trailer function.
+
+    >>> import json
+    >>> ''.join(json_chunks(iter([{'a': 1}, {'a': 2}]), json.JSONEncoder(),
+    ...                     records_per_chunk=1, warning='careful'))
+    '{"warning": "careful", "data": [{"a": 1}, {"a": 2}]}'
+    >>> ''.join(json_chunks(iter([]), json.JSONEncoder(),
+    ...                     trailer=lambda: {'next': None}))
+    '{"data": [], "next": null}'
+    """
+    head = _encode_fields(encoder, fields)
+    yield '{' + (head + ', ' if head else '') + '"data": ['
+
+    separator = ''
+    while True:
+        batch = list(itertools.islice(records, records_per_chunk))
+        if not batch:
+            break
+        yield separator + ', '.join(encoder.encode(record) for record in batch)
+        separator = ', '
+
+    tail = _encode_fields(encoder, trailer()) if trailer else ''
+    yield ']' + (', ' + tail if tail else '') + '}'
+
+
+def _encode_fields(encoder, fields):
+    return ', '.join(
+        '{}: {}'.format(encoder.encode(key), encoder.encode(value))
+        for key, value in sorted(fields.items()))
+
+
+def json_stream_response(records, encoder, trailer=None, **fields):
+    return Response(json_chunks(records, encoder, trailer=trailer, **fields),
+                    mimetype='application/json')
@@ -2,13 +2,15 @@ import re
 from datetime import time
 
 import pytz
-from dateutil import parser
 
 from backdrop.core.timeseries import PERIODS
+from backdrop.core.timeutils import parse_iso8601
 from ..core.validation import (
     value_is_valid_datetime_string, valid, invalid, key_is_valid
 )
 
+MAX_QUERY_IDS = 1000
+
 
 class Validator(object):
 
@@ -57,6 +59,8 @@ class ParameterValidator(Validator):
             'collect',
             'flatten',
             'inclusive',
+            'after',
+            'id',
             'format'
         }
         super(ParameterValidator, self).__init__(request_args)
@@ -232,6 +236,30 @@ class CollectValidator(Validator):
                            "used for group_by")
 
 
+class AfterValidator(Validator):
+
+    def validate(self, request_args, context):
+        if request_args.get('after'):
+            timestamp, _, record_id = request_args['after'].partition(',')
+            if not record_id or not value_is_valid_datetime_string(timestamp):
+                self.add_error("'after' must be a _timestamp and an _id "
+                               "separated by a comma")
+        if 'after' in request_args and any(
+                param in request_args
+                for param in ['sort_by', 'group_by', 'period']):
+            self.add_error("'after' can only be used to page through "
+                           "raw queries without sort_by")
+
+
+class IdValidator(Validator):
+
+    def validate(self, request_args, context):
+        if 'id' in request_args and \
+                len(request_args.getlist('id')) > context['max_ids']:
+            self.add_error("A query can ask for at most {} ids".format(
+                context['max_ids']))
+
+
 class RawQueryValidator(Validator):
 
     def _is_a_raw_query(self, request_args):
@@ -254,8 +282,8 @@ class TimeSpanValidator(Validator):
 
     def validate(self, request_args, context):
         if self._is_valid_date_query(request_args):
-            start_at = parser.parse(request_args['start_at'])
-            end_at = parser.parse(request_args['end_at'])
+            start_at = parse_iso8601(request_args['start_at'])
+            end_at = parse_iso8601(request_args['end_at'])
             delta = end_at - start_at
             if delta.days < context['length']:
                 self.add_error('The minimum time span for a query is 7 days')
@@ -271,7 +299,7 @@ class MidnightValidator(Validator):
     def validate(self, request_args, context):
         timestamp = request_args.get(context['param_name'])
         if _is_valid_date(timestamp) and request_args.get('period') != 'hour':
-            dt = parser.parse(timestamp).astimezone(pytz.UTC)
+            dt = parse_iso8601(timestamp).astimezone(pytz.UTC)
             if dt.time() != time(0):
                 self.add_error('%s must be midnight' % context['param_name'])
 
@@ -282,7 +310,7 @@ class MondayValidator(Validator):
         if request_args.get('period') == 'week':
             timestamp = request_args.get(context['param_name'])
             if _is_valid_date(timestamp):
-                if (parser.parse(timestamp)).weekday() != 0:
+                if parse_iso8601(timestamp).weekday() != 0:
                     self.add_error('%s must be a monday'
                                    % context['param_name'])
 
@@ -294,7 +322,7 @@ class FirstOfMonthValidator(Validator):
         if request_args.get('period') == 'month':
             timestamp = request_args.get(context['param_name'])
             if _is_valid_date(timestamp):
-                if (parser.parse(timestamp)).day != 1:
+                if parse_iso8601(timestamp).day != 1:
                     self.add_error('\'%s\' must be the first of the month for '
                                    'period=month queries'
                                    % context['param_name'])
@@ -359,6 +387,8 @@ def validate_request_args(request_args, raw_queries_allowed=False):
         BooleanValidator(request_args, param_name='inclusive'),
         ParamDependencyValidator(request_args, param_name='inclusive',
                                  depends_on=['start_at', 'end_at']),
+        AfterValidator(request_args),
+        IdValidator(request_args, max_ids=MAX_QUERY_IDS),
     ]
 
     if not raw_queries_allowed:
@@ -4,6 +4,15 @@ from ...core.config.common import load_paas_settings
 PAAS = load_paas_settings()
 BROKER_URL = PAAS.get('REDIS_URL') or os.getenv('REDIS_URL')
 BROKER_FAILOVER_STRATEGY = "round-robin"
+TRANSFORM_REDIS_URL = os.getenv('TRANSFORM_REDIS_URL') or BROKER_URL
+TRANSFORM_DEBOUNCE = int(os.getenv('TRANSFORM_DEBOUNCE', 0))
+# 'http' to use the read and write APIs, or 'local' to use the database
+DATA_SET_BACKEND = os.getenv('DATA_SET_BACKEND', 'http')
+DATABASE_URL = PAAS.get('DATABASE_URL')
+DATABASE_ENGINE = PAAS.get('DATABASE_ENGINE')
+DATABASE_PARTITIONED = os.getenv('DATABASE_PARTITIONED', 'false') == 'true'
+CA_CERTIFICATE = PAAS.get('CA_CERTIFICATE')
+PERIOD_ROLLUPS = os.getenv('PERIOD_ROLLUPS', 'false') == 'true'
 STAGECRAFT_URL = 'https://performance-platform-stagecraft-staging.cloudapps.digital'
 STAGECRAFT_OAUTH_TOKEN = os.getenv('STAGECRAFT_OAUTH_TOKEN')
 BACKDROP_READ_URL = 'https://performance-platform-backdrop-read-staging.cloudapps.digital/data'
@@ -10,7 +10,11 @@ from statsd import StatsClient
 from backdrop.core.timeseries import parse_period
 from backdrop.core.timeutils import parse_time_as_utc
 from backdrop.core.log_handler import get_log_file_handler
+from backdrop.core.pending_transforms import create_pending_transforms, \
+    dispatch_transforms
 from backdrop.core.errors import incr_on_error
+from backdrop.transformers.local_data_set import create_local_data_set, \
+    use_local_data_sets
 from backdrop.transformers.tasks.util import encode_id
 
 from worker import app, config
@@ -26,6 +30,10 @@ logger.addHandler(
 stats_client = StatsClient(prefix=getenv("GOVUK_STATSD_PREFIX",
                                          "pp.apps.backdrop.transformers.worker"))
 
+# Built as the write API builds it, so that windows opened by in-process
+# writes expire in the same way
+pending_transforms = create_pending_transforms(vars(config))
+
 
 @app.task(ignore_result=True)
 def entrypoint(dataset_id, earliest, latest):
@@ -50,6 +58,27 @@ def entrypoint(dataset_id, earliest, latest):
         stats_client.incr('dispatch')
 
 
+@app.task(ignore_result=True)
+def dispatch_pending(dataset_id):
+    """
+    Dispatch transforms once for all of the writes to a data set which
+    have been coalesced since this task was scheduled, over the union of
+    their time ranges.
+    """
+    if pending_transforms is None:
+        logger.error('Transforms for {} were coalesced but '
+                     'TRANSFORM_DEBOUNCE is not set here'.format(dataset_id))
+        return
+
+    window = pending_transforms.take(dataset_id)
+    if window is None:
+        return
+
+    earliest, latest = window
+    entrypoint(dataset_id, earliest, latest)
+    stats_client.incr('dispatch_pending')
+
+
 def _now():
     now = datetime.utcnow()
     now = now.replace(tzinfo=pytz.utc)
@@ -123,6 +152,10 @@ def get_or_get_and_create_output_dataset(transform, input_dataset):
 
         output_data_set_config = admin_api.create_data_set(data_set_config)
 
+    if use_local_data_sets(config):
+        return create_local_data_set(config, output_data_set_config,
+                                     on_stored=trigger_transforms)
+
     return DataSet.from_group_and_type(
         config.BACKDROP_WRITE_URL,
         output_group,
@@ -131,6 +164,16 @@ def get_or_get_and_create_output_dataset(transform, input_dataset):
     )
 
 
+def trigger_transforms(dataset_id, earliest, latest):
+    """
+    Trigger the transforms of a data set written to in-process, as the
+    write API would for a write over HTTP.
+    """
+    dispatch_transforms(app, dataset_id, earliest, latest,
+                        pending_transforms,
+                        getattr(config, 'TRANSFORM_DEBOUNCE', 0))
+
+
 def merge_additional_fields(datum, fields):
     fieldsId = '_'.join(['{}:{}'.format(*i) for i in fields.items()])
     merged_datum = dict(fields.items() + datum.items())
@@ -142,11 +185,14 @@ def merge_additional_fields(datum, fields):
 @stats_client.timer('run_transform')
 @incr_on_error(stats_client, 'run_transform.error')
 def run_transform(data_set_config, transform, earliest, latest):
-    data_set = DataSet.from_group_and_type(
-        config.BACKDROP_READ_URL,
-        data_set_config['data_group'],
-        data_set_config['data_type'],
-    )
+    if use_local_data_sets(config):
+        data_set = create_local_data_set(config, data_set_config)
+    else:
+        data_set = DataSet.from_group_and_type(
+            config.BACKDROP_READ_URL,
+            data_set_config['data_group'],
+            data_set_config['data_type'],
+        )
 
     earliest = parse_time_as_utc(earliest)
     latest = parse_time_as_utc(latest)
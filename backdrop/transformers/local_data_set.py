@@ -0,0 +1,139 @@
+"""
+Direct access to data sets for transformers running alongside the storage.
+
+Transformers normally read their input from the read API and post their
+output to the write API with the performanceplatform client. With
+DATA_SET_BACKEND set to 'local' in the transformer config, LocalDataSet is
+used instead. It has the same get and post methods but queries and stores
+records with the storage engine in-process, skipping HTTP and JSON
+entirely.
+
+Results are returned as the read API would return them, with datetimes as
+ISO 8601 strings, so that transform functions see the same data in either
+mode.
+"""
+import datetime
+
+from bson import ObjectId
+from werkzeug.datastructures import MultiDict
+
+from backdrop.core.data_set import DataSet, DEFAULT_STORE_CHUNK_SIZE
+from backdrop.core.errors import ValidationError
+from backdrop.core.query import Query
+from backdrop.core.storage.storage_factory import create_storage_engine
+from backdrop.core.timeutils import as_utc
+from backdrop.read.query import parse_request_args
+
+HTTP = 'http'
+LOCAL = 'local'
+
+_storage = None
+
+
+def use_local_data_sets(config):
+    """
+    >>> class Config(object):
+    ...     DATA_SET_BACKEND = 'local'
+    >>> use_local_data_sets(Config)
+    True
+    >>> use_local_data_sets(object())
+    False
+    """
+    return getattr(config, 'DATA_SET_BACKEND', HTTP) == LOCAL
+
+
+def get_storage(config):
+    """Return the storage engine for the database in the transformer
+    config, creating it on first use"""
+    global _storage
+    if _storage is None:
+        _storage = create_storage_engine({
+            'DATABASE_URL': config.DATABASE_URL,
+            'DATABASE_ENGINE': config.DATABASE_ENGINE,
+            'DATABASE_PARTITIONED': getattr(config, 'DATABASE_PARTITIONED',
+                                            False),
+            'CA_CERTIFICATE': getattr(config, 'CA_CERTIFICATE', None),
+        })
+    return _storage
+
+
+def create_local_data_set(config, data_set_config, on_stored=None):
+    """Create a LocalDataSet using the settings in the transformer config"""
+    return LocalDataSet(
+        get_storage(config), data_set_config,
+        period_rollups=getattr(config, 'PERIOD_ROLLUPS', False),
+        chunk_size=getattr(config, 'STORE_CHUNK_SIZE',
+                           DEFAULT_STORE_CHUNK_SIZE),
+        on_stored=on_stored)
+
+
+class LocalDataSet(object):
+
+    """A data set read and written with the storage engine, with the
+    interface of performanceplatform.client.DataSet.
+
+    on_stored is called with the data set name and the earliest and latest
+    _timestamp of each post, so that the transforms of the output data set
+    can be triggered just as the write API would.
+    """
+
+    def __init__(self, storage, data_set_config, period_rollups=False,
+                 chunk_size=DEFAULT_STORE_CHUNK_SIZE, on_stored=None):
+        self._data_set = DataSet(storage, data_set_config,
+                                 period_rollups=period_rollups)
+        self._chunk_size = chunk_size
+        self._on_stored = on_stored
+
+    def get(self, query_parameters={}):
+        query = Query.create(
+            **parse_request_args(_to_request_args(query_parameters)))
+        return {'data': _as_json_types(self._data_set.execute_query(query))}
+
+    def post(self, records, chunk_size=0):
+        if self._data_set.create_if_not_exists():
+            self._data_set.ensure_indexes()
+        errors = self._data_set.store(records,
+                                      chunk_size or self._chunk_size)
+        if errors:
+            raise ValidationError(
+                'Could not store records in {}: {}'.format(
+                    self._data_set.name, '; '.join(errors)))
+
+        timestamps = [record['_timestamp'] for record in records
+                      if record.get('_timestamp') is not None]
+        if timestamps and self._on_stored is not None:
+            self._on_stored(self._data_set.name,
+                            min(timestamps), max(timestamps))
+
+
+def _to_request_args(query_parameters):
+    """Turn query parameters as given to the HTTP client into request args
+
+    >>> args = _to_request_args({'group_by': ['a', 'b'], 'limit': 1})
+    >>> args.getlist('group_by'), args.get('limit')
+    (['a', 'b'], '1')
+    """
+    args = MultiDict()
+    for key, value in query_parameters.items():
+        for item in (value if isinstance(value, list) else [value]):
+            args.add(key, item if isinstance(item, basestring)
+                     else str(item))
+    return args
+
+
+def _as_json_types(value):
+    """Convert values the read API would encode as strings
+
+    >>> _as_json_types([{'_timestamp': datetime.datetime(2014, 1, 1)}])
+    [{'_timestamp': '2014-01-01T00:00:00+00:00'}]
+    """
+    if isinstance(value, dict):
+        return dict((key, _as_json_types(item))
+                    for key, item in value.items())
+    elif isinstance(value, (list, tuple)):
+        return [_as_json_types(item) for item in value]
+    elif isinstance(value, datetime.datetime):
+        return as_utc(value).isoformat()
+    elif isinstance(value, ObjectId):
+        return str(value)
+    return value
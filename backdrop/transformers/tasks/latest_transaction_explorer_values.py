@@ -2,7 +2,7 @@ from ..worker import config
 
 from performanceplatform.client import AdminAPI
 
-from .util import encode_id, group_by, is_latest_data
+from .util import encode_id, group_by, filter_latest_data
 
 REQUIRED_DATA_POINTS = [
     {'name': "cost_per_transaction", 'ignore': 'quarterly'},
@@ -128,6 +128,7 @@ def _get_data_points_for_each_tx_metric(data, transform, data_set_config):
     dashboard_configs_with_data = _get_dashboard_configs_with_data(
         ids_with_data)
 
+    candidates = []
     for data_point_name in REQUIRED_DATA_POINTS:
         for dashboard_config, dashboard_data in dashboard_configs_with_data:
             latest_data = _get_latest_data_point(
@@ -139,22 +140,22 @@ def _get_data_points_for_each_tx_metric(data, transform, data_set_config):
                 dashboard_config, latest_data, data_point_name,
                 latest_quarter,
                 latest_seasonally_adjusted)
-            # we need to look at whether this is later than the latest
-            # data currently present on the output data set as
-            # for things like digital-takeup the  transactions explorer
-            # dataset is not the only source.
-            if datum and is_latest_data(
-                    {'data_group': transform['output']['data-group'],
-                     'data_type': transform['output']['data-type']},
-                    transform,
-                    datum,
-                    # filter by record id as this is a hash of dashboard_slug
-                    # and data_point_name and is therefore the important
-                    # identifier of newer data
-                    additional_read_params={
-                        'filter_by': '_id:{}'.format(
-                            datum['_id'])}):
-                yield datum
+            if datum:
+                candidates.append(datum)
+
+    # we need to look at whether this is later than the latest
+    # data currently present on the output data set as
+    # for things like digital-takeup the  transactions explorer
+    # dataset is not the only source. Records are matched by id as this
+    # is a hash of dashboard_slug and data_point_name and is therefore the
+    # important identifier of newer data, and every candidate is checked
+    # with a single read.
+    for datum in filter_latest_data(
+            {'data_group': transform['output']['data-group'],
+             'data_type': transform['output']['data-type']},
+            transform,
+            candidates):
+        yield datum
 
 
 def compute(data, transform, data_set_config=None):
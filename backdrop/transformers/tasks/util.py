@@ -3,12 +3,16 @@ import pytz
 
 from performanceplatform.client import DataSet
 
+from ..local_data_set import create_local_data_set, use_local_data_sets
 from ..worker import config
 
 import base64
 
 from collections import OrderedDict
 
+# Ids asked for in each query, keeping URLs well within length limits
+ID_QUERY_CHUNK_SIZE = 100
+
 
 def group_by(keys, arr):
     groupped = OrderedDict()
@@ -45,6 +49,17 @@ def _get_read_params(transform_params, latest_timestamp):
     return read_params
 
 
+def _read_data_set(data_set_config):
+    if use_local_data_sets(config):
+        return create_local_data_set(config, data_set_config)
+    else:
+        return DataSet.from_group_and_type(
+            config.BACKDROP_READ_URL,
+            data_set_config['data_group'],
+            data_set_config['data_type']
+        )
+
+
 def is_latest_data(data_set_config,
                    transform,
                    latest_datum,
@@ -53,11 +68,7 @@ def is_latest_data(data_set_config,
     Read from backdrop to determine if new data is the latest.
     """
 
-    data_set = DataSet.from_group_and_type(
-        config.BACKDROP_READ_URL,
-        data_set_config['data_group'],
-        data_set_config['data_type']
-    )
+    data_set = _read_data_set(data_set_config)
 
     transform_params = transform.get('query_parameters', {})
     generated_read_params = _get_read_params(
@@ -71,3 +82,53 @@ def is_latest_data(data_set_config,
             return False
 
     return True
+
+
+def latest_timestamps_by_id(data_set_config, ids, start_at):
+    """
+    Read the latest _timestamp of the records with each of the given ids
+    from backdrop, in as few queries as possible. Only records from start_at
+    up to now are considered. Ids with no records are left out.
+    """
+    data_set = _read_data_set(data_set_config)
+    end_at = datetime.datetime.now(pytz.UTC).replace(microsecond=0)
+
+    latest = {}
+    ids = sorted(set(ids))
+    for offset in range(0, len(ids), ID_QUERY_CHUNK_SIZE):
+        existing_data = data_set.get(query_parameters={
+            'id': ids[offset:offset + ID_QUERY_CHUNK_SIZE],
+            'start_at': start_at,
+            'end_at': end_at.isoformat(),
+        })
+        for datum in existing_data['data']:
+            record_id, timestamp = datum['_id'], datum['_timestamp']
+            if record_id not in latest or timestamp > latest[record_id]:
+                latest[record_id] = timestamp
+    return latest
+
+
+def filter_latest_data(data_set_config, transform, data):
+    """
+    Return the data which is at least as recent as any record with the same
+    _id already in backdrop, as is_latest_data would decide for each datum
+    filtered by its _id, but reading them all at once.
+    """
+    data = list(data)
+    if not data:
+        return []
+
+    if 'period' in transform.get('query_parameters', {}):
+        return [datum for datum in data if is_latest_data(
+            data_set_config, transform, datum,
+            additional_read_params={'filter_by': '_id:{}'.format(
+                datum['_id'])})]
+
+    latest = latest_timestamps_by_id(
+        data_set_config,
+        [datum['_id'] for datum in data],
+        min(datum['_timestamp'] for datum in data))
+
+    return [datum for datum in data
+            if datum['_id'] not in latest or
+            latest[datum['_id']] <= datum['_timestamp']]
@@ -6,17 +6,30 @@ from celery import Celery
 from dateutil.parser import parse as datetime_parse
 from flask import abort, Flask, g, jsonify, request
 from flask_featureflags import FeatureFlag
+from kombu.exceptions import OperationalError
 from performanceplatform import client
+from psycopg2.pool import PoolError
+from redis import RedisError
 
 from backdrop import statsd
-from backdrop.core.data_set import DataSet
+from backdrop.core.data_set import DataSet, DEFAULT_STORE_CHUNK_SIZE
 from backdrop.core.flaskutils import DataSetConverter
+from backdrop.read.query_cache import QueryResultCache
+from backdrop.write.batches import create_batch_queue, FAILED, \
+    INGEST_QUEUE
 from backdrop.write.decompressing_request import DecompressingRequest
 from .validation import auth_header_is_valid, extract_bearer_token
 from ..core import log_handler, cache_control
+from ..core.cache import create_cache
+from ..core.config_cache import create_caching_admin_api
 from ..core.errors import ParseError, ValidationError
 from ..core.flaskutils import generate_request_id
+from ..core.json_stream import iter_json_items
+from ..core.pending_transforms import create_pending_transforms, \
+    dispatch_transforms
+from ..core.rollups import PeriodRollups, rollup_data_set_name
 from ..core.storage.storage_factory import create_storage_engine
+from ..core.timeutils import as_utc
 
 ENVIRONMENT = getenv("ENVIRONMENT", "development")
 
@@ -33,12 +46,12 @@ app.config.from_object(
 
 storage = create_storage_engine(app.config)
 
-admin_api = client.AdminAPI(
+admin_api = create_caching_admin_api(client.AdminAPI(
     app.config['STAGECRAFT_URL'],
     app.config['SIGNON_API_USER_TOKEN'],
     dry_run=False,
     request_id_fn=generate_request_id,
-)
+), app.config, serve_stale=False)
 
 log_handler.set_up_logging(app, ENVIRONMENT)
 log_handler.set_up_audit_logging(app, ENVIRONMENT)
@@ -49,6 +62,18 @@ celery_app = Celery(broker=app.config['BROKER_URL'])
 app.config['BROKER_FAILOVER_STRATEGY'] = "round-robin"
 celery_app.conf.update(app.config)
 
+batch_queue = create_batch_queue(app.config)
+pending_transforms = create_pending_transforms(app.config)
+
+# The read API's query results, when it shares them through Redis, so that
+# results for deleted records can be dropped
+query_results = QueryResultCache(create_cache(
+    'redis' if app.config.get('QUERY_CACHE_REDIS_URL') else None,
+    ttl=app.config.get('QUERY_CACHE_TTL', 300),
+    redis_url=app.config.get('QUERY_CACHE_REDIS_URL'),
+    prefix='backdrop:query:',
+))
+
 
 def _record_write_error(e):
     app.logger.exception(e)
@@ -76,6 +101,14 @@ def uncaught_error_handler(e):
     return (jsonify(status='error', message=error_message), 500)
 
 
+@app.errorhandler(PoolError)
+def pool_exhausted_handler(e):
+    """Every database connection stayed checked out for too long"""
+    _record_write_error(e)
+    return (jsonify(status='error',
+                    message='Service Unavailable: database is busy'), 503)
+
+
 @app.errorhandler(400)
 @app.errorhandler(401)
 @app.errorhandler(403)
@@ -117,6 +150,26 @@ def write_by_group(data_group, data_type):
     _validate_config(data_set_config)
     _validate_auth(data_set_config)
 
+    if app.config.get('ASYNC_WRITES', False):
+        try:
+            data = listify_json(get_json_from_request(request))
+        except ValidationError as e:
+            return (jsonify(messages=[repr(e)]), 400)
+        return _enqueue_for_data_set(data_set_config, data)
+
+    if app.config.get('STREAMING_WRITES', False):
+        try:
+            stored = _append_stream_to_data_set(data_set_config)
+        except ValidationError as e:
+            return (jsonify(messages=[repr(e)]), 400)
+
+        if stored.errors:
+            return (jsonify(messages=stored.errors), 400)
+        else:
+            trigger_transforms(data_set_config,
+                               earliest=stored.earliest, latest=stored.latest)
+            return jsonify(status='ok')
+
     try:
         data = listify_json(get_json_from_request(request))
     except ValidationError as e:
@@ -130,6 +183,54 @@ def write_by_group(data_group, data_type):
         return jsonify(status='ok')
 
 
+@app.route('/data/<data_group>/<data_type>/batches/<batch_id>',
+           methods=['GET'])
+@cache_control.nocache
+@statsd.timer('write.route.data.batch_status')
+def batch_status(data_group, data_type, batch_id):
+    """
+    Report the state of a batch queued by an asynchronous write
+    e.g. GET https://BACKDROP/data/gcloud/sales/batches/0f1e2d3c
+    """
+    data_set_config = admin_api.get_data_set(data_group, data_type)
+
+    _validate_config(data_set_config)
+    _validate_auth(data_set_config)
+
+    status = batch_queue.status(batch_id)
+    if status is None or status['data_set'] != data_set_config['name']:
+        abort(404, 'No batch exists with id "{}"'.format(batch_id))
+
+    return jsonify(batch_id=batch_id, **status)
+
+
+@app.route('/data/<data_group>/<data_type>/batches/<batch_id>',
+           methods=['POST'])
+@cache_control.nocache
+@statsd.timer('write.route.data.requeue_batch')
+def requeue_batch(data_group, data_type, batch_id):
+    """
+    Queue a batch which failed to be stored to be tried again, as long as
+    it hasn't expired
+    e.g. POST https://BACKDROP/data/gcloud/sales/batches/0f1e2d3c
+    """
+    data_set_config = admin_api.get_data_set(data_group, data_type)
+
+    _validate_config(data_set_config)
+    _validate_auth(data_set_config)
+
+    status = batch_queue.status(batch_id)
+    if status is None or status['data_set'] != data_set_config['name']:
+        abort(404, 'No batch exists with id "{}"'.format(batch_id))
+    if status['state'] != FAILED:
+        abort(409, 'Only failed batches can be queued again')
+    if not batch_queue.requeue(batch_id):
+        abort(404, 'The records of batch "{}" have expired'.format(batch_id))
+
+    _send_batch(batch_id)
+    return (jsonify(status='accepted', batch_id=batch_id), 202)
+
+
 @app.route('/data/<data_group>/<data_type>/<data_set_id>', methods=['DELETE'])
 @cache_control.nocache
 @statsd.timer('write.route.data.delete.data_set')
@@ -207,6 +308,51 @@ def put_by_group_and_type(data_group, data_type):
         abort(400, repr(e))
 
 
+@app.route('/data/<data_group>/<data_type>', methods=['DELETE'])
+@cache_control.nocache
+@statsd.timer('write.route.data.bulk_delete.data_set')
+def bulk_delete_by_group_and_type(data_group, data_type):
+    """
+    Delete many records by group/type, given either a list of ids or a
+    _timestamp range
+    e.g. DELETE https://BACKDROP/data/gcloud/sales
+         {"_id": ["MjAxNi0wOC0xNSAwMDowMD", ...]}
+    or   {"_start_at": "2016-08-15T00:00:00Z", "_end_at": "..."}
+    """
+    data_set_config = admin_api.get_data_set(data_group, data_type)
+
+    _validate_config(data_set_config)
+    _validate_auth(data_set_config)
+
+    try:
+        data = get_json_from_request(request)
+        if not isinstance(data, dict):
+            abort(400, 'Expected a JSON object with "_id" or "_start_at" '
+                       'and "_end_at"')
+
+        if '_id' in data:
+            record_ids = data['_id']
+            if not isinstance(record_ids, list) or not record_ids or \
+                    not all(isinstance(record_id, basestring)
+                            for record_id in record_ids):
+                abort(400, '"_id" must be a non-empty list of ids')
+            deleted = _delete_records(data_set_config, record_ids)
+        elif '_start_at' in data and '_end_at' in data:
+            start_at, end_at = map(as_utc, parse_bounding_dates(data))
+            if start_at >= end_at:
+                abort(400, '"_start_at" must be before "_end_at"')
+            deleted = _delete_records_between(
+                data_set_config, start_at, end_at)
+        else:
+            abort(400, 'You must specify "_id" or both "_start_at" and '
+                       '"_end_at"')
+
+        return jsonify(status='ok', deleted=deleted)
+
+    except (ParseError, ValidationError, ValueError) as e:
+        abort(400, repr(e))
+
+
 @app.route('/<data_set:data_set_name>', methods=['POST'])
 @cache_control.nocache
 def post_to_data_set(data_set_name):
@@ -218,12 +364,15 @@ def post_to_data_set(data_set_name):
     _validate_auth(data_set_config)
 
     try:
-        data = listify_json(get_json_from_request(request))
+        if app.config.get('STREAMING_WRITES', False):
+            errors = _append_stream_to_data_set(data_set_config).errors
+        else:
+            data = listify_json(get_json_from_request(request))
+            errors = _append_to_data_set(
+                data_set_config,
+                data)
     except ValidationError as e:
         return (jsonify(messages=[repr(e)]), 400)
-    errors = _append_to_data_set(
-        data_set_config,
-        data)
 
     if errors:
         return (jsonify(messages=errors), 400)
@@ -250,10 +399,65 @@ def delete_collection_by_data_set_name(data_set_name):
 
     audit_delete(data_set_name)
     storage.delete_data_set(data_set_name)
+    storage.delete_data_set(rollup_data_set_name(data_set_name))
+    admin_api.invalidate(data_set_name)
 
     return jsonify(status='ok', message='Deleted {}'.format(data_set_name))
 
 
+@app.route('/data-sets/<data_set_name>/rollups', methods=['POST'])
+@cache_control.nocache
+@statsd.timer('write.route.rebuild_rollups')
+def rebuild_rollups(data_set_name):
+    """
+    Rebuild the period rollups for a data set from its raw records. This
+    needs to be run once for each data set after turning on PERIOD_ROLLUPS,
+    before period queries will be answered from rollups.
+    """
+    if not _allow_modify_collection(request.headers.get('Authorization')):
+        abort(
+            401, 'Unauthorized: invalid or no token given for "{}".'.format(
+                data_set_name
+            )
+        )
+
+    if not app.config.get('PERIOD_ROLLUPS', False):
+        abort(400, 'Period rollups are not enabled')
+
+    data_set_config = admin_api.get_data_set_by_name(data_set_name)
+    _validate_config(data_set_config)
+
+    if not _data_set(data_set_config).rebuild_rollups():
+        abort(409, 'Records were written to {} while its rollups were '
+                   'rebuilt, try again'.format(data_set_name))
+
+    return jsonify(status='ok',
+                   message='Rebuilt rollups for {}'.format(data_set_name))
+
+
+@app.route('/_cache/data-sets', methods=['DELETE'])
+@app.route('/_cache/data-sets/<data_set_name>', methods=['DELETE'])
+@cache_control.nocache
+@statsd.timer('write.route.invalidate_data_set_config')
+def invalidate_data_set_config(data_set_name=None):
+    """
+    Called by Stagecraft when data set configs change, so that new tokens
+    and settings take effect before the cached configs expire.
+    """
+    if not _allow_modify_collection(request.headers.get('Authorization')):
+        abort(401, 'Unauthorized: invalid or no token given.')
+
+    admin_api.invalidate(data_set_name)
+
+    # The data set's indexed_fields may have changed
+    if data_set_name is not None and storage.data_set_exists(data_set_name):
+        data_set_config = admin_api.get_data_set_by_name(data_set_name)
+        if data_set_config is not None:
+            _queue_index_build(data_set_config)
+
+    return jsonify(status='ok')
+
+
 @app.route('/data/<data_group>/<data_type>/transform', methods=['POST'])
 @cache_control.nocache
 def transform_data_set(data_group, data_type):
@@ -319,29 +523,178 @@ def _validate_auth(data_set_config):
                   token, data_set_config['name']))
 
 
+def _data_set(data_set_config):
+    return DataSet(storage, data_set_config,
+                   period_rollups=app.config.get('PERIOD_ROLLUPS', False),
+                   queue_rollup_update=_queue_rollup_update)
+
+
+def _queue_rollup_update(data_set_name, days):
+    """
+    Leave rescanning the days written to, for their rollups, to the
+    ingestion worker, as each rescan reads every record of the day and
+    writes to busy days would otherwise take longer and longer. If the
+    broker can't be reached they are rescanned here instead.
+    """
+    try:
+        celery_app.send_task(
+            'backdrop.write.worker.update_rollups',
+            args=(data_set_name, [day.isoformat() for day in days]),
+            queue=INGEST_QUEUE)
+    except OperationalError as e:
+        app.logger.exception(e)
+        statsd.incr("write.rollups_queue.error", data_set=data_set_name)
+        PeriodRollups(storage, data_set_name).update(days)
+
+
+def _create_if_not_exists(data_set):
+    if data_set.create_if_not_exists():
+        _queue_index_build(data_set.config)
+
+
+def _queue_index_build(data_set_config):
+    """
+    Leave building a data set's indexes to the ingestion worker, as a build
+    takes as long as the table takes to scan. Writes don't need the indexes,
+    so if the broker can't be reached they are left for the next time.
+    """
+    try:
+        celery_app.send_task(
+            'backdrop.write.worker.ensure_indexes',
+            args=(data_set_config['name'],
+                  data_set_config.get('indexed_fields') or []),
+            queue=INGEST_QUEUE)
+    except OperationalError as e:
+        app.logger.exception(e)
+        statsd.incr("write.index_queue.error",
+                    data_set=data_set_config['name'])
+
+
 def _append_to_data_set(data_set_config, data):
     audit_append(data_set_config['name'], data)
-    data_set = DataSet(storage, data_set_config)
-    data_set.create_if_not_exists()
-    return data_set.store(data)
+    data_set = _data_set(data_set_config)
+    _create_if_not_exists(data_set)
+    return data_set.store(
+        data,
+        app.config.get('STORE_CHUNK_SIZE', DEFAULT_STORE_CHUNK_SIZE))
+
+
+def _append_stream_to_data_set(data_set_config):
+    """
+    Store the records in the request entity as they are parsed, rather than
+    parsing them all first, so that large payloads aren't held in memory.
+    """
+    records = get_json_stream_from_request(request)
+    data_set = _data_set(data_set_config)
+    _create_if_not_exists(data_set)
+    try:
+        stored = data_set.store_stream(
+            records,
+            app.config.get('STORE_CHUNK_SIZE', DEFAULT_STORE_CHUNK_SIZE))
+    except ParseError as e:
+        app.logger.exception(e)
+        abort(400, 'Error parsing JSON: "{}"'.format(str(e)))
+    audit_append_count(data_set_config['name'], stored.count)
+    return stored
+
+
+def _enqueue_for_data_set(data_set_config, data):
+    """
+    Validate and prepare the records, then queue them to be stored by the
+    ingestion worker. If the queue or the broker can't be reached they are
+    stored here instead, as they would be without ASYNC_WRITES.
+    """
+    audit_append(data_set_config['name'], data)
+    data_set = _data_set(data_set_config)
+    errors = data_set.prepare(data)
+    if errors:
+        return (jsonify(messages=errors), 400)
+
+    try:
+        batch_id = batch_queue.create(data_set_config, data)
+    except RedisError as e:
+        app.logger.exception(e)
+        statsd.incr("write.batch_queue.error",
+                    data_set=data_set_config['name'])
+        _store_prepared(data_set, data)
+        trigger_transforms(data_set_config, data)
+        return jsonify(status='ok')
+
+    try:
+        _send_batch(batch_id)
+    except OperationalError as e:
+        app.logger.exception(e)
+        statsd.incr("write.ingest_queue.error",
+                    data_set=data_set_config['name'])
+        _store_prepared(data_set, data)
+        batch_queue.stored(batch_id)
+        try:
+            trigger_transforms(data_set_config, data)
+        except OperationalError as e:
+            # The records are stored, so answering with an error would
+            # only have them sent again
+            app.logger.exception(e)
+        return jsonify(status='ok')
+
+    return (jsonify(status='accepted', batch_id=batch_id), 202)
+
+
+def _store_prepared(data_set, data):
+    _create_if_not_exists(data_set)
+    data_set.save_prepared(
+        data,
+        app.config.get('STORE_CHUNK_SIZE', DEFAULT_STORE_CHUNK_SIZE))
+
+
+def _send_batch(batch_id):
+    celery_app.send_task('backdrop.write.worker.store_batch',
+                         args=(batch_id,), queue=INGEST_QUEUE)
 
 
 def _patch_data_set(data_set_config, data_set_id, data):
     audit_patch(data_set_config['name'], data)
-    data_set = DataSet(storage, data_set_config)
+    data_set = _data_set(data_set_config)
     return data_set.patch(data_set_id, data)
 
 
 def _delete_data_set(data_set_config, data_set_id):
-    data_set = DataSet(storage, data_set_config)
-    return data_set.delete(data_set_id)
+    data_set = _data_set(data_set_config)
+    errors = data_set.delete(data_set_id)
+    _invalidate_query_results(data_set_config['name'])
+    return errors
+
+
+def _delete_records(data_set_config, record_ids):
+    audit_delete(data_set_config['name'])
+    data_set = _data_set(data_set_config)
+    missing = data_set.delete_records(record_ids)
+    _invalidate_query_results(data_set_config['name'])
+    return len(set(record_ids)) - len(set(missing))
+
+
+def _delete_records_between(data_set_config, start_at, end_at):
+    audit_delete(data_set_config['name'])
+    data_set = _data_set(data_set_config)
+    deleted = data_set.delete_between(start_at, end_at)
+    _invalidate_query_results(data_set_config['name'])
+    return deleted
+
+
+def _invalidate_query_results(data_set_name):
+    try:
+        query_results.invalidate(data_set_name)
+    except RedisError as e:
+        app.logger.warning(
+            'Could not invalidate query results for {}: {}'.format(
+                data_set_name, e))
 
 
 def _empty_data_set(data_set_config):
     audit_delete(data_set_config['name'])
-    data_set = DataSet(storage, data_set_config)
-    data_set.create_if_not_exists()
+    data_set = _data_set(data_set_config)
+    _create_if_not_exists(data_set)
     data_set.empty()
+    _invalidate_query_results(data_set_config['name'])
     return jsonify(
         status='ok',
         message='{} now contains 0 records'.format(data_set_config['name']))
@@ -359,6 +712,17 @@ def get_json_from_request(request):
     return request.get_json()
 
 
+def get_json_stream_from_request(request):
+    if request.content_length == 0:
+        abort(400, 'Expected JSON request body but received zero bytes.')
+
+    if request.mimetype != 'application/json':
+        raise ValidationError(
+            "Expected header: Content-type: application/json")
+
+    return iter_json_items(request.decompressed_stream)
+
+
 def listify_json(data):
     if data is None:
         raise ValidationError(
@@ -393,8 +757,9 @@ def trigger_transforms(data_set_config, data=[], earliest=None, latest=None):
         earliest, latest = bounding_dates(data)
 
     if earliest is not None and latest is not None:
-        celery_app.send_task('backdrop.transformers.dispatch.entrypoint',
-                             args=(data_set_config['name'], earliest, latest))
+        dispatch_transforms(celery_app, data_set_config['name'],
+                            earliest, latest, pending_transforms,
+                            app.config.get('TRANSFORM_DEBOUNCE', 0))
 
 
 def audit_append(data_set_name, data):
@@ -410,6 +775,18 @@ def audit_append(data_set_name, data):
         app.audit_logger.info("Data append action", extra=extra)
 
 
+def audit_append_count(data_set_name, datapoints):
+    if datapoints:
+        extra = {
+            'token': request.headers.get('Authorization'),
+            'data_set': data_set_name,
+            'start_at': None,
+            'end_at': None,
+            'datapoints': datapoints,
+        }
+        app.audit_logger.info("Data append action", extra=extra)
+
+
 def audit_patch(data_set_name, data):
     if data:
         start_at, end_at = parse_bounding_dates(data)
@@ -0,0 +1,122 @@
+"""
+Batches of prepared records waiting to be stored by the ingestion worker.
+
+With ASYNC_WRITES on, a write is validated and prepared in the request as
+usual, but rather than being saved there the records are put in Redis as a
+batch and the request is answered with 202 and the batch id. Only the id
+goes through Celery, to the ingestion queue, so messages stay small
+whatever the size of the write. The worker in backdrop.write.worker loads
+the batch, saves it with bulk writes and records the outcome, which can be
+looked up by id until the batch expires.
+"""
+import cPickle as pickle
+import json
+import uuid
+
+import redis
+
+from backdrop.core import timeutils
+
+DEFAULT_BATCH_TTL = 7 * 24 * 60 * 60
+INGEST_QUEUE = 'ingestion'
+
+QUEUED = 'queued'
+STORED = 'stored'
+FAILED = 'failed'
+
+
+def create_batch_queue(config):
+    """Create a BatchQueue from the settings in a flask app config. Redis
+    isn't connected to until the queue is first used."""
+    url = config.get('BATCH_REDIS_URL') or config['BROKER_URL']
+    return BatchQueue(redis.StrictRedis.from_url(url),
+                      config.get('BATCH_TTL', DEFAULT_BATCH_TTL))
+
+
+class BatchQueue(object):
+
+    """Keeps the records and status of each batch in Redis. Both expire ttl
+    seconds after the batch was last updated, and the records are removed
+    as soon as they are stored."""
+
+    def __init__(self, redis_client, ttl=DEFAULT_BATCH_TTL,
+                 prefix='backdrop:batch:'):
+        self._redis = redis_client
+        self.ttl = ttl
+        self._prefix = prefix
+
+    def create(self, data_set_config, records):
+        """Put prepared records in a new batch and return its id.
+
+        Records without an _id are given one first, so that if saving the
+        batch is retried after a failure they aren't stored twice.
+        """
+        for record in records:
+            if '_id' not in record:
+                record['_id'] = str(uuid.uuid4())
+
+        batch_id = uuid.uuid4().hex
+        self._redis.set(self._records_key(batch_id),
+                        pickle.dumps((data_set_config, records),
+                                     pickle.HIGHEST_PROTOCOL),
+                        ex=self.ttl)
+        self._set_status(batch_id, {
+            'state': QUEUED,
+            'data_set': data_set_config['name'],
+            'count': len(records),
+            'queued_at': timeutils.now().isoformat(),
+        })
+        return batch_id
+
+    def load(self, batch_id):
+        """Return the data set config and records of a batch, or None if it
+        has been stored or has expired"""
+        value = self._redis.get(self._records_key(batch_id))
+        if value is None:
+            return None
+        return pickle.loads(value)
+
+    def status(self, batch_id):
+        """Return a dict describing the state of a batch, or None if there
+        is no such batch"""
+        value = self._redis.get(self._status_key(batch_id))
+        if value is None:
+            return None
+        return json.loads(value)
+
+    def stored(self, batch_id):
+        self._update_status(batch_id, state=STORED, error=None,
+                            stored_at=timeutils.now().isoformat())
+        self._redis.delete(self._records_key(batch_id))
+
+    def failed(self, batch_id, error):
+        """Mark a batch as failed. Its records are kept until it expires so
+        that it can be queued again with requeue."""
+        self._update_status(batch_id, state=FAILED, error=error)
+
+    def requeue(self, batch_id):
+        """Mark a failed batch as queued again and give its records a new
+        ttl. Returns False if its records have expired."""
+        if not self._redis.expire(self._records_key(batch_id), self.ttl):
+            return False
+        self._update_status(batch_id, state=QUEUED,
+                            queued_at=timeutils.now().isoformat())
+        return True
+
+    def retrying(self, batch_id, error):
+        self._update_status(batch_id, error=error)
+
+    def _update_status(self, batch_id, **changes):
+        status = self.status(batch_id) or {}
+        status.update(changes)
+        self._set_status(batch_id, status)
+
+    def _set_status(self, batch_id, status):
+        self._redis.set(self._status_key(batch_id), json.dumps(status),
+                        ex=self.ttl)
+
+    def _records_key(self, batch_id):
+        return '{}{}:records'.format(self._prefix, batch_id)
+
+    def _status_key(self, batch_id):
+        return '{}{}:status'.format(self._prefix, batch_id)
@@ -5,11 +5,33 @@ PAAS = load_paas_settings()
 DATABASE_URL = PAAS.get('DATABASE_URL')
 DATABASE_ENGINE = PAAS.get('DATABASE_ENGINE')
 CA_CERTIFICATE = PAAS.get('CA_CERTIFICATE')
+DATABASE_POOL_MIN = int(os.getenv('DATABASE_POOL_MIN', 1))
+DATABASE_POOL_MAX = int(os.getenv('DATABASE_POOL_MAX', 10))
+DATABASE_POOL_TIMEOUT = int(os.getenv('DATABASE_POOL_TIMEOUT', 30))
+DATABASE_PARTITIONED = os.getenv('DATABASE_PARTITIONED', 'false') == 'true'
+MONGO_USE_AGGREGATION = os.getenv('MONGO_USE_AGGREGATION', 'true') == 'true'
+CONFIG_CACHE_BACKEND = os.getenv('CONFIG_CACHE_BACKEND')
+CONFIG_CACHE_SIZE = int(os.getenv('CONFIG_CACHE_SIZE', 1000))
+CONFIG_CACHE_TTL = int(os.getenv('CONFIG_CACHE_TTL', 60))
+CONFIG_CACHE_STALE_TTL = int(os.getenv('CONFIG_CACHE_STALE_TTL', 3600))
+CONFIG_CACHE_REDIS_URL = os.getenv('CONFIG_CACHE_REDIS_URL')
+PERIOD_ROLLUPS = os.getenv('PERIOD_ROLLUPS', 'false') == 'true'
 STAGECRAFT_URL = os.getenv('STAGECRAFT_URL')
 BROKER_URL = PAAS.get('REDIS_URL') or os.getenv('REDIS_URL')
 BROKER_FAILOVER_STRATEGY = "round-robin"
 SIGNON_API_USER_TOKEN = os.getenv('SIGNON_API_USER_TOKEN')
 LOG_LEVEL = os.getenv("LOG_LEVEL", "ERROR")
+STORE_CHUNK_SIZE = int(os.getenv('STORE_CHUNK_SIZE', 1000))
+STREAMING_WRITES = os.getenv('STREAMING_WRITES', 'false') == 'true'
+ASYNC_WRITES = os.getenv('ASYNC_WRITES', 'false') == 'true'
+BATCH_REDIS_URL = os.getenv('BATCH_REDIS_URL')
+BATCH_TTL = int(os.getenv('BATCH_TTL', 7 * 24 * 60 * 60))
+TRANSFORM_DEBOUNCE = int(os.getenv('TRANSFORM_DEBOUNCE', 0))
+TRANSFORM_REDIS_URL = os.getenv('TRANSFORM_REDIS_URL')
+QUERY_CACHE_TTL = int(os.getenv('QUERY_CACHE_TTL', 300))
+QUERY_CACHE_REDIS_URL = os.getenv('QUERY_CACHE_REDIS_URL')
+MAX_DECOMPRESSED_SIZE = int(
+    os.getenv('MAX_DECOMPRESSED_SIZE', 10 * 1024 * 1024))
 DATA_SET_UPLOAD_FORMAT = {
     "ithc_excel": "excel",
 }
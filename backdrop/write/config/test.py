@@ -1,5 +1,6 @@
 DATABASE_URL = 'postgres://postgres@localhost:5432'
 DATABASE_ENGINE = 'postgres'
+DATABASE_POOL_MIN = 0
 LOG_LEVEL = "INFO"
 CLIENT_ID = "it's not important here"
 CLIENT_SECRET = "it's not important here"
@@ -1,8 +1,9 @@
-import gzip
+import zlib
 
 from flask import current_app, g, abort
 from flask.wrappers import Request
-from io import BytesIO
+
+DEFAULT_MAX_DECOMPRESSED_SIZE = 10 * 1024 * 1024
 
 
 class DecompressingRequest(Request):
@@ -14,66 +15,209 @@ class DecompressingRequest(Request):
     See http://tools.ietf.org/html/rfc2616#section-14.11
     """
 
+    _has_decompressed_entity = False
+
+    @property
+    def max_decompressed_size(self):
+        """
+        The largest body a compressed request may decompress to. This is
+        MAX_DECOMPRESSED_SIZE unless DATA_SET_MAX_DECOMPRESSED_SIZE has a
+        limit for the data set being written to.
+        """
+        config = current_app.config
+        by_data_set = config.get('DATA_SET_MAX_DECOMPRESSED_SIZE', {})
+        data_set_name = g.get('data_set_name')
+        if data_set_name in by_data_set:
+            return by_data_set[data_set_name]
+        return config.get('MAX_DECOMPRESSED_SIZE',
+                          DEFAULT_MAX_DECOMPRESSED_SIZE)
+
+    @property
+    def decompressed_stream(self):
+        """
+        A file-like object reading the request entity, decompressing it on
+        the fly if it was compressed. Nothing is buffered beyond what the
+        caller asks for, so large entities can be parsed as they arrive.
+        """
+        content_encoding = self.headers.get('content-encoding', '')
+        decompressor = create_decompressor(content_encoding)
+        if decompressor is None:
+            return self.stream
+
+        current_app.logger.debug(
+            "Decompressing {} stream".format(content_encoding))
+        return DecompressingStream(
+            self.stream, decompressor, self.max_decompressed_size)
+
     def get_data(self, *args, **kwargs):
         """
         Override the get_data method to check whether the request entity
         was compressed. If it was, transparently decompress it and carry on.
-
-        This is somewhat inefficient in that the entire entity is loaded
-        into memory, rather than decorating the existing stream.
         """
-        content_encoding = self.headers.get('content-encoding', '').lower()
-
-        if (not g.get('_has_decompressed_entity', False)
-                and 'gzip' in content_encoding):
+        if (not self._has_decompressed_entity and
+                self.headers.get('content-encoding')):
+            data = self.decompressed_stream.read()
 
-            # Decompress the stream
-            bytes = super(DecompressingRequest, self).get_data(*args, **kwargs)
-
-            current_app.logger.debug("Got gzipped stream of length <%d>" %
-                                     len(bytes))
+            current_app.logger.debug("Got JSON of length <%s>" % (len(data)))
 
-            gzipped_content = BytesIO(bytes)
+            # Store it on the _cached_data attribute for future reads
+            self._cached_data = data
+            self._has_decompressed_entity = True
 
-            decompressed_content = SafeGzipDecompressor(gzipped_content)
+        return super(DecompressingRequest, self).get_data(*args, **kwargs)
 
-            data = decompressed_content.read().decode('utf-8')
 
-            current_app.logger.debug("Got JSON of length <%s>" % (len(data)))
+def create_decompressor(content_encoding):
+    """
+    Return an object with decompress(data) and flush() methods for a
+    Content-Encoding, or None if the entity isn't compressed. An empty
+    header and identity codings in a list are passed through. Unsupported
+    encodings, and entities compressed more than once, are rejected with a
+    415.
+    """
+    encodings = [encoding.strip().lower()
+                 for encoding in content_encoding.split(',')]
+    encodings = [encoding for encoding in encodings
+                 if encoding not in ('', 'identity')]
 
-            # Store it on the _cached_data attribute for future reads
-            self._cached_data = data
+    if not encodings:
+        return None
+    elif len(encodings) > 1:
+        abort(415, 'Unsupported Content-Encoding: {}'.format(
+            ', '.join(encodings)))
 
-            g._has_decompressed_entity = True
+    encoding = encodings[0]
+    if encoding in ('gzip', 'x-gzip'):
+        return GzipDecompressor()
+    elif encoding == 'deflate':
+        return DeflateDecompressor()
+    else:
+        abort(415, 'Unsupported Content-Encoding: {}'.format(encoding))
 
-        return super(DecompressingRequest, self).get_data(*args, **kwargs)
 
+class DecompressingStream(object):
 
-class SafeGzipDecompressor(object):
+    """File-like object that decompresses another as it is read, and
+    supports a maximum size to avoid zipbombs.
 
-    """Class that decompresses gzip streams, and supports a maximum
-    size to avoid zipbombs.
+    The size is checked as each block is decompressed, and no block expands
+    past the limit, so at most maxsize bytes are ever held.
 
     See http://en.wikipedia.org/wiki/Zip_bomb
     """
     blocksize = 8 * 1024
 
-    def __init__(self, fileobj, maxsize=10 * 1024 * 1024):
+    def __init__(self, fileobj, decompressor, maxsize):
+        self.fileobj = fileobj
+        self.decompressor = decompressor
         self.maxsize = maxsize
-        self.gzipobj = gzip.GzipFile(mode='rb', fileobj=fileobj)
+        self.size = 0
+        self._buffer = b''
+        self._pending = b''
+        self._finished = False
+
+    def read(self, size=-1):
+        while not self._finished and (size < 0 or len(self._buffer) < size):
+            self._buffer += self._decompress_block()
+
+        if size < 0:
+            data, self._buffer = self._buffer, b''
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def _decompress_block(self):
+        # Decompressed data left over from a block which expanded past
+        # blocksize is returned before any more input is read
+        if not self._pending:
+            compressed = self.fileobj.read(self.blocksize)
+            if not compressed:
+                self._finished = True
+                return self._check_size(self._flush())
+            self._pending = compressed
+
+        try:
+            # Allow one byte past the limit so that going over it is noticed
+            data = self.decompressor.decompress(
+                self._pending, self.maxsize - self.size + 1)
+        except (zlib.error, IOError) as e:
+            abort(400, 'Error decompressing request: {}'.format(e))
+        self._pending = getattr(self.decompressor, 'unconsumed_tail', b'')
+        return self._check_size(data)
+
+    def _flush(self):
+        try:
+            return self.decompressor.flush()
+        except (zlib.error, IOError) as e:
+            abort(400, 'Error decompressing request: {}'.format(e))
+
+    def _check_size(self, data):
+        self.size += len(data)
+        if self.size > self.maxsize:
+            # Compressed file is too large
+            abort(413)
+        return data
+
+
+class DeflateDecompressor(object):
+
+    """Decompresses deflate encoded entities. RFC 2616 says these are zlib
+    streams but some clients send raw deflate data, so that is accepted too.
+    """
+
+    def __init__(self):
+        self._decompressor = None
+        self.unconsumed_tail = b''
+
+    def decompress(self, data, max_length=0):
+        if self._decompressor is None:
+            # zlib streams start with a header byte for the deflate method,
+            # which is 8 in the low four bits
+            is_zlib = (ord(data[0]) & 0x0f) == 8 and \
+                (ord(data[0]) * 256 + ord(data[1:2] or '\0')) % 31 == 0
+            self._decompressor = zlib.decompressobj(
+                zlib.MAX_WBITS if is_zlib else -zlib.MAX_WBITS)
+        data = self._decompressor.decompress(data, max_length)
+        self.unconsumed_tail = self._decompressor.unconsumed_tail
+        return data
+
+    def flush(self):
+        if self._decompressor is None:
+            return b''
+        return self._decompressor.flush()
+
+
+class GzipDecompressor(object):
+
+    """Decompresses gzip encoded entities, which may be several gzip members
+    one after another, as gzip itself writes when files are concatenated.
+    """
+
+    def __init__(self):
+        self._decompressor = self._member_decompressor()
+        self.unconsumed_tail = b''
+
+    @staticmethod
+    def _member_decompressor():
+        # 16 + MAX_WBITS expects a gzip header and trailer
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
 
-    def read(self):
-        b = [""]
-        buf_size = 0
+    def decompress(self, data, max_length=0):
+        decompressed = b''
         while True:
-            data = self.gzipobj.read(self.blocksize)
+            remaining = max_length - len(decompressed) if max_length else 0
+            decompressed += self._decompressor.decompress(data, remaining)
+            # Input left over once a member has ended starts the next one,
+            # unless it is only the zero padding some writers add
+            data = self._decompressor.unused_data.lstrip(b'\0')
             if not data:
-                break
-            b.append(data)
-            buf_size += len(data)
+                self.unconsumed_tail = self._decompressor.unconsumed_tail
+                return decompressed
 
-            if buf_size > self.maxsize:
-                # Compressed file is too large
-                abort(413)
+            self._decompressor = self._member_decompressor()
+            if max_length and len(decompressed) >= max_length:
+                self.unconsumed_tail = data
+                return decompressed
 
-        return "".join(b)
+    def flush(self):
+        return self._decompressor.flush()
@@ -0,0 +1,100 @@
+"""
+Celery worker storing the batches queued by asynchronous writes, updating
+the period rollups of data sets written to with PERIOD_ROLLUPS, and building
+the indexes of data sets which are new or whose config has changed.
+
+Run it on the ingestion queue, so that it doesn't take transform tasks:
+
+    celery -A backdrop.write.worker worker -Q ingestion
+
+Tasks are only acknowledged once they have finished, so a batch is picked
+up again if the worker dies part way through saving it.
+"""
+import logging
+import os
+from os import getenv
+
+from celery import Celery
+from flask import Config
+
+from backdrop.core.data_set import DataSet, DEFAULT_STORE_CHUNK_SIZE
+from backdrop.core.pending_transforms import create_pending_transforms, \
+    dispatch_transforms
+from backdrop.core.rollups import PeriodRollups
+from backdrop.core.storage.storage_factory import create_storage_engine
+from backdrop.write.batches import create_batch_queue
+
+ENVIRONMENT = getenv("ENVIRONMENT", "development")
+
+logger = logging.getLogger(__name__)
+
+config = Config(os.getcwd())
+config.from_object("backdrop.write.config.{}".format(ENVIRONMENT))
+config['BROKER_FAILOVER_STRATEGY'] = "round-robin"
+
+app = Celery('ingestion', broker=config['BROKER_URL'])
+app.conf.update(config)
+
+storage = create_storage_engine(config)
+batch_queue = create_batch_queue(config)
+pending_transforms = create_pending_transforms(config)
+
+MAX_RETRIES = 3
+RETRY_DELAY = 30
+
+
+@app.task(bind=True, ignore_result=True, acks_late=True,
+          max_retries=MAX_RETRIES, default_retry_delay=RETRY_DELAY)
+def store_batch(self, batch_id):
+    batch = batch_queue.load(batch_id)
+    if batch is None:
+        logger.warning('Batch {} has already been stored or has expired'
+                       .format(batch_id))
+        return
+
+    data_set_config, records = batch
+    data_set = DataSet(storage, data_set_config,
+                       period_rollups=config.get('PERIOD_ROLLUPS', False))
+    try:
+        if data_set.create_if_not_exists():
+            data_set.ensure_indexes()
+        data_set.save_prepared(
+            records, config.get('STORE_CHUNK_SIZE', DEFAULT_STORE_CHUNK_SIZE))
+    except Exception as e:
+        logger.exception(e)
+        if self.request.retries < self.max_retries:
+            batch_queue.retrying(batch_id, repr(e))
+            raise self.retry(exc=e)
+        batch_queue.failed(batch_id, repr(e))
+        raise
+
+    batch_queue.stored(batch_id)
+    trigger_transforms(data_set_config['name'], records)
+
+
+@app.task(ignore_result=True, acks_late=True)
+def update_rollups(data_set_name, days):
+    """Rescan the raw records of the given days for their rollups, which
+    is safe to repeat"""
+    PeriodRollups(storage, data_set_name).update(days)
+
+
+@app.task(ignore_result=True, acks_late=True)
+def ensure_indexes(data_set_name, fields):
+    """Build the indexes of a data set which is new or whose config has
+    changed, which is safe to repeat"""
+    storage.ensure_indexes(data_set_name, fields)
+
+
+def trigger_transforms(data_set_name, records):
+    timestamps = [record['_timestamp'] for record in records
+                  if record.get('_timestamp') is not None]
+    if timestamps:
+        dispatch_transforms(app, data_set_name,
+                            min(timestamps), max(timestamps),
+                            pending_transforms,
+                            config.get('TRANSFORM_DEBOUNCE', 0))
+
+
+if __name__ == '__main__':
+    app.start()
@@ -32,6 +32,5 @@ class TestPostgresDataSetIntegration(BaseDataSetIntegrationTest, unittest.TestCa
     def _save(self, obj):
         updated_at = obj['_updated_at']
         ts = obj['_timestamp'] if '_timestamp' in obj else updated_at
-        with self.storage.connection.cursor() as cursor:
+        with self.storage._cursor() as cursor:
             cursor.execute(create_update_record_query(cursor.mogrify, DATA_SET, obj, obj['_id'], ts, updated_at))
-            self.storage.connection.commit()
@@ -8,14 +8,17 @@ module itself.
 
 from hamcrest import assert_that, is_, has_key
 from nose.tools import assert_raises
-from mock import Mock
+from mock import MagicMock, Mock, patch
 
 import datetime
 
-from pymongo.errors import AutoReconnect
+import pymongo
+from pymongo.errors import AutoReconnect, CollectionInvalid
 
-from backdrop.core.storage.mongo import MongoStorageEngine, reconnecting_save, time_as_utc
+from backdrop.core.storage.mongo import MongoStorageEngine, reconnecting_save, time_as_utc, \
+    KNOWN_COLLECTIONS_TTL
 from backdrop.core.data_set import DataSet
+from backdrop.core.errors import DataSetCreationError
 
 from .test_storage import BaseStorageTest
 
@@ -40,6 +43,12 @@ class TestMongoStorageEngine(BaseStorageTest):
         mongo_client.drop_database(database_name)
 
 
+class TestMongoStorageEngineWithGroupFallback(TestMongoStorageEngine):
+    def setup(self):
+        self.engine = MongoStorageEngine.create(
+            DATABASE_URL, use_aggregation=False)
+
+
 class TestReconnectingSave(object):
     def test_reconnecting_save_retries(self):
         collection = Mock()
@@ -54,3 +63,93 @@ class TestReconnectingSave(object):
         collection.save.side_effect = [AutoReconnect, AutoReconnect, AutoReconnect, None]
 
         assert_raises(AutoReconnect, reconnecting_save, collection, 'record')
+
+
+class TestKnownCollections(object):
+    def setup(self):
+        self.mongo_client = MagicMock()
+        self.db = self.mongo_client.get_database.return_value
+        self.db.collection_names.return_value = ['foo']
+        self.engine = MongoStorageEngine(self.mongo_client)
+
+    def test_collections_are_listed_once(self):
+        assert_that(self.engine.data_set_exists('foo'), is_(True))
+        assert_that(self.engine.data_set_exists('bar'), is_(False))
+
+        assert_that(self.db.collection_names.call_count, is_(1))
+
+    def test_created_collections_are_known(self):
+        self.engine.data_set_exists('bar')
+        self.engine.create_data_set('bar', 0)
+
+        assert_that(self.engine.data_set_exists('bar'), is_(True))
+
+    def test_collections_created_elsewhere_are_known_once_seen(self):
+        self.engine.data_set_exists('bar')
+        self.db.create_collection.side_effect = CollectionInvalid(
+            'collection bar already exists')
+
+        assert_raises(DataSetCreationError,
+                      self.engine.create_data_set, 'bar', 0)
+        assert_that(self.engine.data_set_exists('bar'), is_(True))
+
+    def test_fields_are_only_indexed_once(self):
+        self.engine.ensure_indexes('foo', ['name'])
+        self.engine.ensure_indexes('foo', ['name'])
+
+        assert_that(self.db['foo'].create_index.call_count, is_(3))
+        self.db['foo'].create_index.assert_called_with(
+            [('name', pymongo.ASCENDING)], background=True)
+
+    def test_existing_collections_get_an_updated_at_index(self):
+        self.engine.ensure_indexes('foo', [])
+
+        self.db['foo'].create_index.assert_any_call(
+            [('_updated_at', pymongo.DESCENDING)], background=True)
+
+    def test_collections_are_listed_again_once_the_list_is_old(self):
+        with patch('backdrop.core.storage.mongo.time') as time:
+            time.time.return_value = 1000
+            self.engine.data_set_exists('foo')
+            self.db.collection_names.return_value = []
+            time.time.return_value = 1000 + KNOWN_COLLECTIONS_TTL
+
+            assert_that(self.engine.data_set_exists('foo'), is_(False))
+
+    def test_indexes_are_ensured_again_once_the_list_is_old(self):
+        with patch('backdrop.core.storage.mongo.time') as time:
+            time.time.return_value = 1000
+            self.engine.data_set_exists('foo')
+            self.engine.ensure_indexes('foo', ['name'])
+            time.time.return_value = 1000 + KNOWN_COLLECTIONS_TTL
+            self.engine.data_set_exists('foo')
+
+            self.engine.ensure_indexes('foo', ['name'])
+
+        assert_that(self.db['foo'].create_index.call_count, is_(6))
+
+    def test_deleted_collections_are_forgotten(self):
+        self.engine.data_set_exists('foo')
+        self.engine.delete_data_set('foo')
+
+        assert_that(self.engine.data_set_exists('foo'), is_(False))
+
+
+class TestDeleteRecords(object):
+    def setup(self):
+        self.mongo_client = MagicMock()
+        self.collection = self.mongo_client.get_database.return_value['foo']
+        self.engine = MongoStorageEngine(self.mongo_client)
+
+    def test_each_record_is_deleted_with_its_timestamp_read_atomically(self):
+        timestamp = datetime.datetime(2014, 1, 1)
+        self.collection.find_one_and_delete.side_effect = \
+            lambda spec, **kwargs: \
+            {'_id': 'a', '_timestamp': timestamp} \
+            if spec['_id'] == 'a' else None
+
+        previous = self.engine.delete_records('foo', ['a', 'b', 'a'])
+
+        assert_that(previous, is_({'a': timestamp}))
+        assert_that(self.collection.find_one_and_delete.call_count, is_(2))
+        assert_that(self.collection.delete_many.called, is_(False))
@@ -6,7 +6,9 @@ from hamcrest import assert_that, is_, less_than, contains, has_entries, \
 from nose.tools import assert_raises
 
 from backdrop.core.data_set import DataSet
-from backdrop.core.errors import DataSetCreationError
+from backdrop.core.errors import DataSetCreationError, \
+    InvalidOperationError
+from backdrop.core.nested_merge import flat_merge
 from backdrop.core.query import Query
 from backdrop.core.records import add_period_keys
 from backdrop.core.timeseries import DAY
@@ -95,6 +97,37 @@ class BaseStorageTest(object):
         assert_that(len(results), is_(1))
         assert_that(results, contains(has_entries({'foo': 'foo'})))
 
+    def test_save_records_saves_a_batch(self):
+        self.engine.create_data_set('foo_bar', 0)
+        self.engine.save_records('foo_bar', [
+            {'_id': 'first', 'foo': 'bar'},
+            {'foo': 'baz'},
+        ])
+
+        assert_that(self.engine.execute_query('foo_bar', Query.create()),
+                    contains_inanyorder(
+                        has_entries({'_id': 'first', 'foo': 'bar'}),
+                        has_entries({'foo': 'baz'})))
+
+    def test_save_records_keeps_the_last_record_for_a_repeated_id(self):
+        self._save_all('foo_bar', {'_id': 'first', 'foo': 'original'})
+        self.engine.save_records('foo_bar', [
+            {'_id': 'first', 'foo': 'bar'},
+            {'_id': 'first', 'foo': 'foo'},
+        ])
+
+        results = self.engine.execute_query('foo_bar', Query.create())
+
+        assert_that(len(results), is_(1))
+        assert_that(results, contains(has_entries({'foo': 'foo'})))
+
+    def test_save_records_with_no_records_does_nothing(self):
+        self.engine.create_data_set('foo_bar', 0)
+        self.engine.save_records('foo_bar', [])
+
+        assert_that(self.engine.execute_query('foo_bar', Query.create()),
+                    is_([]))
+
     def test_capped_data_set_is_capped(self):
         self.engine.create_data_set('foo_bar', 1)
 
@@ -136,6 +169,50 @@ class BaseStorageTest(object):
         self.engine.delete_record('foo_bar', '222')
         assert_that(self.engine.execute_query('foo_bar', Query.create()), is_([]))
 
+    def test_patch_records(self):
+        self._save_all('foo_bar',
+                       {'_id': '111', '_timestamp': d_tz(2012, 12, 12),
+                        'foo': 'bar', 'bar': 'foo'})
+
+        previous = self.engine.patch_records('foo_bar', {
+            '111': {'foo': 'baz'}, '333': {'foo': 'baz'}})
+
+        assert_that(previous.keys(), is_(['111']))
+        assert_that(
+            self.engine.execute_query('foo_bar', Query.create()),
+            contains(has_entries({'_id': '111', 'foo': 'baz', 'bar': 'foo'})))
+
+    def test_delete_records(self):
+        self._save_all('foo_bar', {'_id': '111'}, {'_id': '222'},
+                       {'_id': '333'})
+
+        previous = self.engine.delete_records('foo_bar', ['111', '222', '444'])
+
+        assert_that(sorted(previous.keys()), is_(['111', '222']))
+        assert_that(
+            self.engine.execute_query('foo_bar', Query.create()),
+            contains(has_entries({'_id': '333'})))
+
+    def test_delete_records_between(self):
+        self._save_all('foo_bar',
+                       {'_id': '111', '_timestamp': d_tz(2012, 12, 11)},
+                       {'_id': '222', '_timestamp': d_tz(2012, 12, 12)},
+                       {'_id': '333', '_timestamp': d_tz(2012, 12, 13)})
+
+        deleted = self.engine.delete_records_between(
+            'foo_bar', d_tz(2012, 12, 12), d_tz(2012, 12, 13))
+
+        assert_that(deleted, is_(1))
+        assert_that(
+            self.engine.execute_query('foo_bar', Query.create()),
+            contains_inanyorder(has_entries({'_id': '111'}),
+                                has_entries({'_id': '333'})))
+
+    def test_find_record_that_does_not_exist(self):
+        self._save_all('foo_bar', {'_id': '111'})
+
+        assert_that(self.engine.find_record('foo_bar', '222'), none())
+
     def test_datetimes_are_returned_as_utc(self):
         self._save_all('foo_bar',
                        {'_timestamp': datetime.datetime(2012, 8, 8)})
@@ -156,6 +233,16 @@ class BaseStorageTest(object):
                     contains(
                         has_entry('foo', 'bar')))
 
+    def test_query_with_ids(self):
+        self._save_all('foo_bar', {'_id': 'a', 'foo': 'a'},
+                       {'_id': 'b', 'foo': 'b'}, {'_id': 'c', 'foo': 'c'})
+
+        results = self.engine.execute_query('foo_bar', Query.create(
+            ids=['a', 'c', 'd']))
+
+        assert_that(sorted(result['foo'] for result in results),
+                    is_(['a', 'c']))
+
     def test_query_with_filter_prefix(self):
         self._save_all('foo_bar', {'foo': 'bar'}, {'foo': 'foo'})
 
@@ -230,6 +317,36 @@ class BaseStorageTest(object):
 
         assert_that(len(list(results)), is_(1))
 
+    def test_iter_query_yields_every_matching_record(self):
+        self._save_all('foo_bar',
+                       {'foo': 'mug', '_timestamp': d_tz(2012, 12, 12)},
+                       {'foo': 'book', '_timestamp': d_tz(2012, 12, 13)},
+                       {'foo': 'pen'})
+
+        results = self.engine.iter_query('foo_bar', Query.create(
+            filter_by=[('foo', 'book')]))
+
+        assert_that(list(results),
+                    contains(
+                        has_entries({'foo': 'book',
+                                     '_timestamp': d_tz(2012, 12, 13)})))
+
+    def test_paginated_query_continues_after_the_last_record(self):
+        self._save_all('foo_bar',
+                       {'_id': 'c', '_timestamp': d_tz(2012, 12, 12)},
+                       {'_id': 'a', '_timestamp': d_tz(2012, 12, 13)},
+                       {'_id': 'b', '_timestamp': d_tz(2012, 12, 12)})
+
+        first_page = self.engine.execute_query(
+            'foo_bar', Query.create(limit=2, after=()))
+        second_page = self.engine.execute_query(
+            'foo_bar', Query.create(limit=2,
+                                    after=(d_tz(2012, 12, 12), 'c')))
+
+        assert_that(first_page, contains(has_entry('_id', 'b'),
+                                         has_entry('_id', 'c')))
+        assert_that(second_page, contains(has_entry('_id', 'a')))
+
     # !GROUPED!
     def test_query_grouped_by_field(self):
         self._save_all('foo_bar',
@@ -286,13 +403,62 @@ class BaseStorageTest(object):
             {'foo': 'bar', 'c': 2}
         )
 
-        results = self.engine.execute_query('foo_bar', Query.create(
-            group_by=['foo'], collect=[('c', 'sum')]))
+        query = Query.create(group_by=['foo'], collect=[('c', 'sum')])
+        results = self.engine.execute_query('foo_bar', query)
 
-        assert_that(results,
+        assert_that(flat_merge(query.group_keys, query.collect, results),
                     contains_inanyorder(
-                        has_entries({'foo': 'bar', 'c': [2]}),
-                        has_entries({'foo': 'foo', 'c': contains_inanyorder(1, 3)})))
+                        has_entries({'foo': 'bar', 'c:sum': 2}),
+                        has_entries({'foo': 'foo', 'c:sum': 4})))
+
+    def test_group_query_with_every_collect_method(self):
+        self._save_all(
+            'foo_bar',
+            {'foo': 'foo', 'c': 1},
+            {'foo': 'foo', 'c': 3},
+            {'foo': 'foo', 'c': 3}
+        )
+
+        query = Query.create(group_by=['foo'], collect=[
+            ('c', 'sum'), ('c', 'count'), ('c', 'mean'), ('c', 'set')])
+        results = self.engine.execute_query('foo_bar', query)
+
+        assert_that(flat_merge(query.group_keys, query.collect, results),
+                    contains(has_entries({
+                        '_count': 3,
+                        'c:sum': 7,
+                        'c:count': 3,
+                        'c:mean': 7 / 3.0,
+                        'c:set': [1, 3]})))
+
+    def test_group_query_with_collect_field_missing_from_some_groups(self):
+        self._save_all(
+            'foo_bar',
+            {'foo': 'foo', 'c': 1},
+            {'foo': 'foo', 'c': 3},
+            {'foo': 'bar'}
+        )
+
+        query = Query.create(group_by=['foo'], collect=[('c', 'sum')])
+        results = self.engine.execute_query('foo_bar', query)
+
+        assert_that(flat_merge(query.group_keys, query.collect, results),
+                    contains_inanyorder(
+                        has_entries({'foo': 'bar', 'c:sum': 0}),
+                        has_entries({'foo': 'foo', 'c:sum': 4})))
+
+    def test_mean_of_collect_field_missing_from_a_group_is_invalid(self):
+        self._save_all(
+            'foo_bar',
+            {'foo': 'foo', 'c': 1},
+            {'foo': 'bar'}
+        )
+
+        query = Query.create(group_by=['foo'], collect=[('c', 'mean')])
+        results = self.engine.execute_query('foo_bar', query)
+
+        assert_raises(InvalidOperationError, flat_merge,
+                      query.group_keys, query.collect, results)
 
     def test_group_and_collect_with_false_values(self):
         self._save_all('foo_bar',
@@ -301,13 +467,13 @@ class BaseStorageTest(object):
                        {'foo': 'two', 'bar': True},
                        {'foo': 'one', 'bar': False})
 
-        results = self.engine.execute_query('foo_bar', Query.create(
-            group_by=['foo'], collect=[('bar', 'sum')]))
+        query = Query.create(group_by=['foo'], collect=[('bar', 'sum')])
+        results = self.engine.execute_query('foo_bar', query)
 
-        assert_that(results,
+        assert_that(flat_merge(query.group_keys, query.collect, results),
                     contains_inanyorder(
-                        has_entries({'bar': [False, False]}),
-                        has_entries({'bar': [True, True]})))
+                        has_entries({'foo': 'one', 'bar:sum': 0}),
+                        has_entries({'foo': 'two', 'bar:sum': 2})))
 
     def test_group_query_ignores_records_without_grouping_key(self):
         self._save_all('foo_bar',
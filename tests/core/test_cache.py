@@ -0,0 +1,101 @@
+import unittest
+
+import redis
+from hamcrest import assert_that, is_, none
+from mock import Mock
+
+from backdrop.core.cache import LRUCache, RedisCache
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = LRUCache(max_size=2, ttl=10, clock=self.clock)
+
+    def test_get_returns_none_on_a_miss(self):
+        assert_that(self.cache.get('foo'), none())
+
+    def test_get_returns_a_value_that_was_set(self):
+        self.cache.set('foo', {'bar': 1})
+
+        assert_that(self.cache.get('foo'), is_({'bar': 1}))
+
+    def test_entries_expire_after_ttl(self):
+        self.cache.set('foo', 'bar')
+        self.clock.now = 10
+
+        assert_that(self.cache.get('foo'), none())
+
+    def test_setting_a_key_again_resets_its_expiry(self):
+        self.cache.set('foo', 'bar')
+        self.clock.now = 5
+        self.cache.set('foo', 'baz')
+        self.clock.now = 12
+
+        assert_that(self.cache.get('foo'), is_('baz'))
+
+    def test_least_recently_used_entry_is_evicted(self):
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+        self.cache.get('a')
+        self.cache.set('c', 3)
+
+        assert_that(self.cache.get('a'), is_(1))
+        assert_that(self.cache.get('b'), none())
+        assert_that(self.cache.get('c'), is_(3))
+
+    def test_delete_removes_an_entry(self):
+        self.cache.set('foo', 'bar')
+        self.cache.delete('foo')
+
+        assert_that(self.cache.get('foo'), none())
+
+
+class TestRedisCache(unittest.TestCase):
+
+    def setUp(self):
+        self.redis = Mock()
+        self.cache = RedisCache(self.redis, ttl=10, prefix='test:')
+
+    def test_set_stores_a_pickled_value_with_expiry(self):
+        stored = {}
+        self.redis.setex.side_effect = \
+            lambda key, ttl, value: stored.update({key: value})
+        self.redis.get.side_effect = lambda key: stored.get(key)
+
+        self.cache.set('foo', {'bar': [1, 2]})
+
+        self.redis.setex.assert_called_once_with('test:foo', 10, stored[
+            'test:foo'])
+        assert_that(self.cache.get('foo'), is_({'bar': [1, 2]}))
+
+    def test_get_returns_none_on_a_miss(self):
+        self.redis.get.return_value = None
+
+        assert_that(self.cache.get('foo'), none())
+
+    def test_redis_errors_are_treated_as_a_miss(self):
+        self.redis.get.side_effect = redis.ConnectionError('down')
+        self.redis.setex.side_effect = redis.ConnectionError('down')
+
+        self.cache.set('foo', 'bar')
+        assert_that(self.cache.get('foo'), none())
+
+    def test_redis_errors_deleting_are_logged(self):
+        self.redis.delete.side_effect = redis.ConnectionError('down')
+        self.redis.scan_iter.side_effect = redis.ConnectionError('down')
+
+        self.cache.delete('foo')
+        self.cache.clear('foo')
+
+        self.redis.delete.assert_called_once_with('test:foo')
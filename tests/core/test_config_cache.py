@@ -0,0 +1,145 @@
+import unittest
+
+from hamcrest import assert_that, is_, none
+from mock import Mock, patch
+from nose.tools import assert_raises
+
+from backdrop.core.cache import LRUCache
+from backdrop.core.config_cache import CachingAdminAPI
+
+
+CONFIG = {'name': 'foo_bar', 'data_group': 'foo', 'data_type': 'bar'}
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def _run_now(fn, *args):
+    fn(*args)
+
+
+class TestCachingAdminAPI(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.admin_api = Mock()
+        self.admin_api.get_data_set.return_value = CONFIG
+        self.admin_api.get_data_set_by_name.return_value = CONFIG
+        self.cache = LRUCache(max_size=10, ttl=100, clock=self.clock)
+        self.api = CachingAdminAPI(
+            self.admin_api, self.cache, ttl=10, clock=self.clock)
+
+    def test_configs_are_fetched_once_while_fresh(self):
+        self.api.get_data_set('foo', 'bar')
+        self.clock.now = 5
+        config = self.api.get_data_set('foo', 'bar')
+
+        assert_that(config, is_(CONFIG))
+        assert_that(self.admin_api.get_data_set.call_count, is_(1))
+
+    def test_fetching_by_group_and_type_also_caches_by_name(self):
+        self.api.get_data_set('foo', 'bar')
+        config = self.api.get_data_set_by_name('foo_bar')
+
+        assert_that(config, is_(CONFIG))
+        assert_that(self.admin_api.get_data_set_by_name.called, is_(False))
+
+    def test_missing_data_sets_are_not_cached(self):
+        self.admin_api.get_data_set_by_name.return_value = None
+
+        assert_that(self.api.get_data_set_by_name('foo_bar'), none())
+        self.api.get_data_set_by_name('foo_bar')
+
+        assert_that(self.admin_api.get_data_set_by_name.call_count, is_(2))
+
+    @patch('backdrop.core.config_cache._in_background', _run_now)
+    def test_stale_configs_are_served_and_refreshed(self):
+        self.api.get_data_set_by_name('foo_bar')
+        new_config = dict(CONFIG, bearer_token='new-token')
+        self.admin_api.get_data_set_by_name.return_value = new_config
+        self.clock.now = 20
+
+        assert_that(self.api.get_data_set_by_name('foo_bar'), is_(CONFIG))
+        assert_that(self.api.get_data_set_by_name('foo_bar'),
+                    is_(new_config))
+
+    @patch('backdrop.core.config_cache._in_background', _run_now)
+    def test_stale_configs_are_served_while_stagecraft_is_failing(self):
+        self.api.get_data_set_by_name('foo_bar')
+        self.admin_api.get_data_set_by_name.side_effect = IOError('down')
+        self.clock.now = 20
+
+        assert_that(self.api.get_data_set_by_name('foo_bar'), is_(CONFIG))
+        assert_that(self.api.get_data_set_by_name('foo_bar'), is_(CONFIG))
+
+    @patch('backdrop.core.config_cache._in_background', _run_now)
+    def test_refreshing_a_deleted_data_set_removes_it(self):
+        self.api.get_data_set_by_name('foo_bar')
+        self.admin_api.get_data_set_by_name.return_value = None
+        self.clock.now = 20
+
+        self.api.get_data_set_by_name('foo_bar')
+
+        assert_that(self.api.get_data_set_by_name('foo_bar'), none())
+
+    def test_configs_are_fetched_again_once_too_stale(self):
+        self.api.get_data_set_by_name('foo_bar')
+        self.clock.now = 100
+
+        self.api.get_data_set_by_name('foo_bar')
+
+        assert_that(self.admin_api.get_data_set_by_name.call_count, is_(2))
+
+    def test_stale_configs_are_fetched_first_when_not_serving_stale(self):
+        api = CachingAdminAPI(self.admin_api, self.cache, ttl=10,
+                              clock=self.clock, serve_stale=False)
+        api.get_data_set_by_name('foo_bar')
+        new_config = dict(CONFIG, bearer_token='new-token')
+        self.admin_api.get_data_set_by_name.return_value = new_config
+        self.clock.now = 20
+
+        assert_that(api.get_data_set_by_name('foo_bar'), is_(new_config))
+
+    def test_stale_configs_are_not_served_while_stagecraft_is_failing(self):
+        api = CachingAdminAPI(self.admin_api, self.cache, ttl=10,
+                              clock=self.clock, serve_stale=False)
+        api.get_data_set_by_name('foo_bar')
+        self.admin_api.get_data_set_by_name.side_effect = IOError('down')
+        self.clock.now = 20
+
+        assert_raises(IOError, api.get_data_set_by_name, 'foo_bar')
+
+    def test_invalidate_removes_a_config_under_both_keys(self):
+        self.api.get_data_set('foo', 'bar')
+        self.api.invalidate('foo_bar')
+
+        assert_that(self.cache.get('name:foo_bar'), none())
+        assert_that(self.cache.get('group:foo:bar'), none())
+
+    def test_invalidate_without_a_name_removes_everything(self):
+        self.api.get_data_set('foo', 'bar')
+        self.api.invalidate()
+
+        self.api.get_data_set('foo', 'bar')
+
+        assert_that(self.admin_api.get_data_set.call_count, is_(2))
+
+    def test_other_methods_are_passed_through(self):
+        self.api.list_data_sets()
+
+        self.admin_api.list_data_sets.assert_called_once_with()
+
+    def test_every_call_goes_to_stagecraft_without_a_cache(self):
+        api = CachingAdminAPI(self.admin_api, None, ttl=10)
+
+        api.get_data_set('foo', 'bar')
+        api.get_data_set('foo', 'bar')
+        api.invalidate('foo_bar')
+
+        assert_that(self.admin_api.get_data_set.call_count, is_(2))
@@ -5,6 +5,7 @@ from mock import Mock, patch
 from nose.tools import assert_raises
 
 from backdrop.core import data_set
+from backdrop.core.errors import DataSetCreationError, ParseError
 from backdrop.core.query import Query
 from backdrop.core.timeseries import WEEK, MONTH
 from tests.support.test_helpers import d, d_tz, match
@@ -84,14 +85,23 @@ class TestDataSet_store(BaseDataSetTest):
 
     def test_storing_a_simple_record(self):
         self.data_set.store([{'foo': 'bar'}])
-        self.mock_storage.save_record.assert_called_with(
-            'test_data_set', {'foo': 'bar'})
+        self.mock_storage.save_records.assert_called_with(
+            'test_data_set', [{'foo': 'bar'}])
+
+    def test_records_are_saved_in_chunks(self):
+        self.data_set.store([{'foo': i} for i in range(5)], chunk_size=2)
+        assert_that(
+            [args[1] for args, _ in
+             self.mock_storage.save_records.call_args_list],
+            is_([[{'foo': 0}, {'foo': 1}],
+                 [{'foo': 2}, {'foo': 3}],
+                 [{'foo': 4}]]))
 
     def test_id_gets_automatically_generated_if_auto_ids_are_set(self):
         self.setup_config({'auto_ids': ['foo']})
         self.data_set.store([{'foo': 'bar'}])
-        self.mock_storage.save_record.assert_called_with(
-            'test_data_set', match(has_entry('_id', 'YmFy')))
+        self.mock_storage.save_records.assert_called_with(
+            'test_data_set', match(contains(has_entry('_id', 'YmFy'))))
 
     def test_timestamp_gets_parsed(self):
         """Test that timestamps get parsed
@@ -99,9 +109,9 @@ class TestDataSet_store(BaseDataSetTest):
         see the backdrop.core.records module
         """
         self.data_set.store([{'_timestamp': '2012-12-12T00:00:00+00:00'}])
-        self.mock_storage.save_record.assert_called_with(
+        self.mock_storage.save_records.assert_called_with(
             'test_data_set',
-            match(has_entry('_timestamp',  d_tz(2012, 12, 12))))
+            match(contains(has_entry('_timestamp', d_tz(2012, 12, 12)))))
 
     def test_record_gets_validated(self):
         errors = self.data_set.store([{'_foo': 'bar'}])
@@ -120,16 +130,16 @@ class TestDataSet_store(BaseDataSetTest):
 
     def test_period_keys_are_added(self):
         self.data_set.store([{'_timestamp': '2012-12-12T00:00:00+00:00'}])
-        self.mock_storage.save_record.assert_called_with(
+        self.mock_storage.save_records.assert_called_with(
             'test_data_set',
-            match(has_entry('_day_start_at', d_tz(2012, 12, 12))))
+            match(contains(has_entry('_day_start_at', d_tz(2012, 12, 12)))))
 
-    @patch('backdrop.core.storage.mongo.MongoStorageEngine.save_record')
-    @patch('backdrop.core.records.add_period_keys')
+    @patch('backdrop.core.storage.mongo.MongoStorageEngine.save_records')
+    @patch('backdrop.core.records.period_starts')
     def test_store_returns_array_of_errors_if_errors(
             self,
-            add_period_keys_patch,
-            save_record_patch):
+            period_starts_patch,
+            save_records_patch):
         self.setup_config({
             'schema': self.schema,
             'auto_ids': ["_timestamp", "that"]})
@@ -173,15 +183,15 @@ class TestDataSet_store(BaseDataSetTest):
             len(errors),
             is_(8)
         )
-        assert_that(add_period_keys_patch.called, is_(False))
-        assert_that(save_record_patch.called, is_(False))
+        assert_that(period_starts_patch.called, is_(False))
+        assert_that(save_records_patch.called, is_(False))
 
-    @patch('backdrop.core.storage.mongo.MongoStorageEngine.save_record')
-    @patch('backdrop.core.records.add_period_keys')
+    @patch('backdrop.core.storage.mongo.MongoStorageEngine.save_records')
+    @patch('backdrop.core.records.period_starts')
     def test_store_does_not_get_auto_id_type_error_due_to_datetime(
             self,
-            add_period_keys_patch,
-            save_record_patch):
+            period_starts_patch,
+            save_records_patch):
         self.setup_config({
             'schema': self.schema,
             'auto_ids': ["_timestamp", "that"]})
@@ -213,8 +223,58 @@ class TestDataSet_store(BaseDataSetTest):
             len(errors),
             is_(5)
         )
-        assert_that(add_period_keys_patch.called, is_(False))
-        assert_that(save_record_patch.called, is_(False))
+        # only the first record is valid
+        assert_that(period_starts_patch.call_count, is_(1))
+        assert_that(save_records_patch.called, is_(False))
+
+
+class TestDataSet_store_stream(BaseDataSetTest):
+
+    def records(self, count):
+        for i in range(count):
+            yield {'_timestamp': '2014-01-{:02d}T00:00:00+00:00'.format(i + 1),
+                   'value': i}
+
+    def test_records_are_saved_in_chunks(self):
+        self.data_set.store_stream(self.records(5), chunk_size=2)
+
+        assert_that(
+            [[record['value'] for record in args[1]] for args, _ in
+             self.mock_storage.save_records.call_args_list],
+            is_([[0, 1], [2, 3], [4]]))
+
+    def test_records_are_prepared_for_storage(self):
+        self.data_set.store_stream(self.records(1))
+
+        self.mock_storage.save_records.assert_called_with(
+            'test_data_set',
+            match(contains(has_entries({
+                '_timestamp': d_tz(2014, 1, 1),
+                '_week_start_at': d_tz(2013, 12, 30)}))))
+
+    def test_count_and_time_range_are_returned(self):
+        stored = self.data_set.store_stream(self.records(3))
+
+        assert_that(stored, is_(data_set.StoredRecords(
+            [], 3, d_tz(2014, 1, 1), d_tz(2014, 1, 3))))
+
+    def test_nothing_is_saved_if_any_record_is_invalid(self):
+        records = list(self.records(3)) + [{'_foo': 'bar'}, {'value': {}}]
+
+        stored = self.data_set.store_stream(iter(records), chunk_size=2)
+
+        assert_that(stored.errors, is_([
+            'record 3: _foo is not a recognised internal field',
+            'record 4: value has an invalid value']))
+        assert_that(self.mock_storage.save_records.called, is_(False))
+
+    def test_parse_errors_are_raised_before_anything_is_saved(self):
+        def records():
+            yield {'value': 1}
+            raise ParseError('Expecting , delimiter or ] at character 12')
+
+        assert_raises(ParseError, self.data_set.store_stream, records(), 1)
+        assert_that(self.mock_storage.save_records.called, is_(False))
 
 
 class TestDataSet_patch(BaseDataSetTest):
@@ -233,15 +293,24 @@ class TestDataSet_patch(BaseDataSetTest):
     }
 
     def test_patching_a_simple_record(self):
-        self.data_set.patch('uuid', {'foo': 'bar'})
-        self.mock_storage.update_record.assert_called_with(
-            'test_data_set', 'uuid', {'foo': 'bar'})
+        self.mock_storage.patch_records.return_value = {'uuid': None}
+        result = self.data_set.patch('uuid', {'foo': 'bar'})
+        self.mock_storage.patch_records.assert_called_with(
+            'test_data_set', {'uuid': {'foo': 'bar'}})
+        assert_that(result, is_(None))
 
     def test_record_not_found(self):
-        self.mock_storage.find_record.return_value = None
+        self.mock_storage.patch_records.return_value = {}
         result = self.data_set.patch('uuid', {'foo': 'bar'})
         assert_that(result, is_('No record found with id uuid'))
 
+    def test_patching_many_records_reports_those_not_found(self):
+        self.mock_storage.patch_records.return_value = {'a': None}
+        missing = self.data_set.patch_records({'a': {'foo': 'bar'},
+                                               'b': {'foo': 'bar'}})
+        assert_that(missing, is_(['b']))
+        assert_that(self.mock_storage.find_record.called, is_(False))
+
 
 class TestDataSet_delete(BaseDataSetTest):
     schema = {
@@ -259,16 +328,24 @@ class TestDataSet_delete(BaseDataSetTest):
     }
 
     def test_deleting_a_simple_record(self):
-        self.data_set.delete('uuid')
-        self.mock_storage.delete_record.assert_called_with(
-            'test_data_set', 'uuid'
+        self.mock_storage.delete_records.return_value = {'uuid': None}
+        result = self.data_set.delete('uuid')
+        self.mock_storage.delete_records.assert_called_with(
+            'test_data_set', ['uuid']
         )
+        assert_that(result, is_(None))
 
     def test_record_not_found(self):
-        self.mock_storage.find_record.return_value = None
+        self.mock_storage.delete_records.return_value = {}
         result = self.data_set.delete('uuid')
         assert_that(result, is_('No record found with id uuid'))
 
+    def test_deleting_many_records_reports_those_not_found(self):
+        self.mock_storage.delete_records.return_value = {'b': None}
+        missing = self.data_set.delete_records(['a', 'b', 'c'])
+        assert_that(missing, is_(['a', 'c']))
+        assert_that(self.mock_storage.find_record.called, is_(False))
+
 
 class TestDataSet_execute_query(BaseDataSetTest):
 
@@ -596,6 +673,23 @@ class TestDataSet_execute_query(BaseDataSetTest):
         ))
 
 
+class TestDataSet_iter_query(BaseDataSetTest):
+
+    def test_raw_queries_are_iterated_from_storage(self):
+        self.mock_storage.iter_query.return_value = iter([{'foo': 'bar'}])
+        query = Query.create(filter_by=[['foo', 'bar']])
+
+        records = self.data_set.iter_query(query, stream_after=10)
+
+        assert_that(list(records), contains({'foo': 'bar'}))
+        self.mock_storage.iter_query.assert_called_once_with(
+            'test_data_set', query, stream_after=10)
+
+    def test_grouped_queries_cannot_be_iterated(self):
+        assert_raises(ValueError, self.data_set.iter_query,
+                      Query.create(group_by=['foo']))
+
+
 class TestDataSet_create(BaseDataSetTest):
 
     def test_data_set_is_created_if_it_does_not_exist(self):
@@ -608,3 +702,31 @@ class TestDataSet_create(BaseDataSetTest):
         self.mock_storage.data_set_exists.return_value = True
         self.data_set.create_if_not_exists()
         assert_that(self.mock_storage.create_data_set.called, is_(False))
+
+    def test_creating_a_data_set_says_whether_it_was_missing(self):
+        self.mock_storage.data_set_exists.return_value = False
+        assert_that(self.data_set.create_if_not_exists(), is_(True))
+        self.mock_storage.data_set_exists.return_value = True
+        assert_that(self.data_set.create_if_not_exists(), is_(False))
+
+    def test_indexes_are_not_built_by_writes(self):
+        self.mock_storage.data_set_exists.return_value = False
+        self.data_set.create_if_not_exists()
+        assert_that(self.mock_storage.ensure_indexes.called, is_(False))
+
+    def test_indexed_fields_are_indexed(self):
+        self.setup_config({'indexed_fields': ['name']})
+        self.data_set.ensure_indexes()
+        self.mock_storage.ensure_indexes.assert_called_with(
+            'test_data_set', ['name'])
+
+    def test_indexes_are_ensured_without_indexed_fields(self):
+        self.data_set.ensure_indexes()
+        self.mock_storage.ensure_indexes.assert_called_with(
+            'test_data_set', [])
+
+    def test_data_set_created_by_someone_else_is_not_an_error(self):
+        self.mock_storage.data_set_exists.return_value = False
+        self.mock_storage.create_data_set.side_effect = \
+            DataSetCreationError('collection test_data_set already exists')
+        assert_that(self.data_set.create_if_not_exists(), is_(True))
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+import json
+import random
+import unittest
+from io import BytesIO
+
+from hamcrest import assert_that, is_
+from nose.tools import assert_raises
+
+from backdrop.core.errors import ParseError
+from backdrop.core.json_stream import iter_json_items
+
+
+class CountingStream(BytesIO):
+
+    def __init__(self, data):
+        BytesIO.__init__(self, data)
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        data = BytesIO.read(self, size)
+        self.bytes_read += len(data)
+        return data
+
+
+def random_records(count, seed):
+    rng = random.Random(seed)
+    values = [lambda: rng.randint(-10 ** 6, 10 ** 6),
+              lambda: rng.uniform(-1e6, 1e6),
+              lambda: u''.join(rng.choice(u'ab"\\\n\xe9☃ ')
+                               for _ in range(rng.randint(0, 20))),
+              lambda: rng.choice([True, False, None]),
+              lambda: [rng.randint(0, 9) for _ in range(rng.randint(0, 3))]]
+    return [dict(('key_{}'.format(i), rng.choice(values)())
+                 for i in range(rng.randint(0, 6)))
+            for _ in range(count)]
+
+
+class IterJsonItemsTestCase(unittest.TestCase):
+
+    def parse(self, document, read_size=7):
+        return list(iter_json_items(BytesIO(document), read_size))
+
+    def test_items_are_the_same_as_from_json_loads(self):
+        records = random_records(200, seed=1)
+        for separators in [(',', ':'), (', ', ': ')]:
+            document = json.dumps(records, separators=separators, indent=1)
+            for read_size in [1, 3, 64, 64 * 1024]:
+                assert_that(self.parse(document, read_size),
+                            is_(json.loads(document)))
+
+    def test_a_document_which_is_not_an_array_is_a_single_item(self):
+        assert_that(self.parse('  {"foo": "bar"}\n'), is_([{"foo": "bar"}]))
+        assert_that(self.parse('12345'), is_([12345]))
+
+    def test_empty_arrays_have_no_items(self):
+        assert_that(self.parse(' [ \n ] '), is_([]))
+
+    def test_items_are_yielded_before_the_whole_stream_is_read(self):
+        stream = CountingStream(json.dumps(random_records(1000, seed=2)))
+
+        items = iter_json_items(stream, read_size=1024)
+        next(items)
+
+        assert_that(stream.bytes_read < 4096, is_(True))
+
+    def test_invalid_documents_raise_parse_errors(self):
+        for document, message in [
+                ('', 'No JSON object could be decoded at character 0'),
+                ('[1, 2', 'Expecting , delimiter or ] at character 5'),
+                ('[1 2]', 'Expecting , delimiter or ] at character 3'),
+                ('[1,]', 'No JSON object could be decoded at character 3'),
+                ('[{"a" 1}]', 'Expecting : delimiter at character 6'),
+                ('[1] [2]', 'Extra data at character 4')]:
+            with assert_raises(ParseError) as raised:
+                self.parse(document, read_size=2)
+            assert_that(str(raised.exception), is_(message))
+
+    def test_items_before_an_error_are_yielded(self):
+        items = iter_json_items(BytesIO('[{"a": 1}, {"b" 2}]'))
+
+        assert_that(next(items), is_({"a": 1}))
+        assert_raises(ParseError, next, items)
@@ -1,6 +1,6 @@
 from hamcrest import assert_that, is_, contains, has_entries, has_entry
 from backdrop.core.nested_merge import nested_merge, group_by, \
-    apply_collect_to_group, collect_all_values
+    apply_collect_to_group, collect_all_values, CollectedValues
 from backdrop.core.timeseries import WEEK, MONTH
 
 
@@ -91,6 +91,37 @@ class TestNestedMerge(object):
                         }),
                     ))
 
+    def test_two_level_grouping_with_summarised_collect(self):
+        data = [
+            datum(name='Jill', place='Kettering', count=2,
+                  age=CollectedValues(sum=70, count=2, distinct=[34, 36])),
+            datum(name='Jill', place='Keswick', count=2,
+                  age=CollectedValues(sum=108, count=2, distinct=[76, 32])),
+        ]
+        results = nested_merge([['name'], ['place']],
+                               [('age', 'mean'), ('age', 'set')], data)
+
+        assert_that(results,
+                    contains(
+                        has_entries({
+                            'name': 'Jill',
+                            'age:mean': 44.5,
+                            'age:set': [32, 34, 36, 76],
+                            '_subgroup': contains(
+                                has_entries({
+                                    'place': 'Keswick',
+                                    'age:mean': 54.0,
+                                    'age:set': [32, 76]
+                                }),
+                                has_entries({
+                                    'place': 'Kettering',
+                                    'age:mean': 35.0,
+                                    'age:set': [34, 36]
+                                })
+                            )
+                        }),
+                    ))
+
     def test_two_level_grouping_combination_of_keys(self):
         data = [
             datum(name='IE', version='6', place='England', age=[13, 12], count=2),
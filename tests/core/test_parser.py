@@ -33,3 +33,42 @@ class TestParser(TestCase):
         ]
         csv = "a,b,c\r\n😇,2,1\r\n😈,22,11\r\n"
         assert csv == parser.json_to_csv(data=data)
+
+    def test_iter_csv_streams_an_iterator(self):
+        data = iter([dict(a=1, b=2), dict(a=3, b=4)])
+        chunks = list(parser.iter_csv(data))
+        assert "a,b\r\n1,2\r\n3,4\r\n" == "".join(chunks)
+
+    def test_iter_csv_finds_the_header_in_the_lookahead_window(self):
+        data = iter([dict(a=1), dict(b=2), dict(a=3)])
+        csv = "a,b\r\n1,\r\n,2\r\n3,\r\n"
+        assert csv == "".join(parser.iter_csv(data, lookahead=2))
+
+    def test_iter_csv_warns_of_fields_seen_after_the_lookahead_window(self):
+        data = iter([dict(a=1), dict(b=2), dict(a=3, c=4), dict(d=5)])
+        csv = ("a,b\r\n1,\r\n,2\r\n3,\r\n,\r\n"
+               '"Warning: fields first seen after row 2 were left out: '
+               'c, d"\r\n')
+        assert csv == "".join(parser.iter_csv(data, lookahead=2))
+
+    def test_iter_csv_writes_rows_in_chunks(self):
+        data = iter([dict(a=i) for i in range(250)])
+        chunks = list(parser.iter_csv(data))
+        assert 3 == len(chunks)
+        assert 251 == "".join(chunks).count("\r\n")
+
+    def test_json_to_csv_flattens_subgroups(self):
+        data = [
+            dict(a="x", _count=3, values=[
+                dict(_start_at="2014-01-01", _count=1),
+                dict(_start_at="2014-01-08", _count=2),
+            ]),
+            dict(a="y", _count=1, values=[
+                dict(_start_at="2014-01-01", _count=1),
+            ]),
+        ]
+        csv = ("_count,_start_at,a\r\n"
+               "1,2014-01-01,x\r\n"
+               "2,2014-01-08,x\r\n"
+               "1,2014-01-01,y\r\n")
+        assert csv == parser.json_to_csv(data=data)
@@ -0,0 +1,220 @@
+import unittest
+
+import redis
+from hamcrest import assert_that, is_, none, calling, raises
+from mock import Mock
+
+from backdrop.core.pending_transforms import PendingTransforms, \
+    create_pending_transforms, dispatch_transforms
+from tests.support.test_helpers import d_tz
+
+
+class FakeRedis(object):
+
+    """Just enough of redis for PendingTransforms, with pipelines which
+    run each command straight away"""
+
+    def __init__(self):
+        self.sorted_sets = {}
+        self.values = {}
+        self.expiries = {}
+        self.results = None
+
+    def pipeline(self):
+        self.results = []
+        return self
+
+    def execute(self):
+        results, self.results = self.results, None
+        return results
+
+    def _result(self, value):
+        if self.results is None:
+            return value
+        self.results.append(value)
+        return self
+
+    def zadd(self, key, *args):
+        members = self.sorted_sets.setdefault(key, {})
+        for score, member in zip(args[::2], args[1::2]):
+            members[member] = score
+        return self._result(len(args) / 2)
+
+    def _ranked(self, key):
+        members = self.sorted_sets.get(key, {})
+        return sorted(members, key=lambda member: members[member])
+
+    def zrange(self, key, start, end):
+        ranked = self._ranked(key)
+        return self._result(ranked[start:len(ranked) + end + 1
+                                   if end < 0 else end + 1])
+
+    def zremrangebyrank(self, key, start, end):
+        ranked = self._ranked(key)
+        for member in ranked[start:len(ranked) + end + 1]:
+            del self.sorted_sets[key][member]
+        return self._result(None)
+
+    def expire(self, key, ttl):
+        self.expiries[key] = ttl
+        return self._result(True)
+
+    def set(self, key, value, ex=None, nx=False):
+        if nx and key in self.values:
+            return self._result(None)
+        self.values[key] = value
+        self.expiries[key] = ex
+        return self._result(True)
+
+    def delete(self, *keys):
+        for key in keys:
+            self.sorted_sets.pop(key, None)
+            self.values.pop(key, None)
+        return self._result(len(keys))
+
+
+class TestPendingTransforms(unittest.TestCase):
+
+    def setUp(self):
+        self.redis = FakeRedis()
+        self.pending = PendingTransforms(self.redis, ttl=60)
+
+    def test_the_first_write_in_a_window_schedules_a_dispatch(self):
+        assert_that(self.pending.add(
+            'foo', d_tz(2014, 1, 1), d_tz(2014, 1, 2)), is_(True))
+        assert_that(self.pending.add(
+            'foo', d_tz(2014, 1, 1), d_tz(2014, 1, 2)), is_(False))
+
+    def test_windows_are_kept_for_each_data_set(self):
+        self.pending.add('foo', d_tz(2014, 1, 1), d_tz(2014, 1, 2))
+
+        assert_that(self.pending.add(
+            'bar', d_tz(2014, 1, 1), d_tz(2014, 1, 2)), is_(True))
+
+    def test_a_window_covers_the_union_of_its_writes(self):
+        self.pending.add('foo', d_tz(2014, 1, 3), d_tz(2014, 1, 4))
+        self.pending.add('foo', d_tz(2014, 1, 1), d_tz(2014, 1, 2))
+        self.pending.add('foo', d_tz(2014, 1, 5), d_tz(2014, 1, 5))
+        self.pending.add('foo', d_tz(2014, 1, 2), d_tz(2014, 1, 3))
+
+        assert_that(self.pending.take('foo'),
+                    is_((d_tz(2014, 1, 1), d_tz(2014, 1, 5))))
+
+    def test_windows_only_keep_their_bounds(self):
+        for day in range(1, 10):
+            self.pending.add('foo', d_tz(2014, 1, day), d_tz(2014, 1, day))
+
+        assert_that(len(self.redis.sorted_sets.values()[0]), is_(2))
+
+    def test_times_are_converted_to_utc(self):
+        self.pending.add('foo', '2014-01-01T01:00:00+01:00',
+                         '2014-01-02T00:00:00Z')
+
+        assert_that(self.pending.take('foo'),
+                    is_((d_tz(2014, 1, 1), d_tz(2014, 1, 2))))
+
+    def test_taking_a_window_removes_it(self):
+        self.pending.add('foo', d_tz(2014, 1, 1), d_tz(2014, 1, 2))
+        self.pending.take('foo')
+
+        assert_that(self.pending.take('foo'), none())
+        assert_that(self.pending.add(
+            'foo', d_tz(2014, 1, 1), d_tz(2014, 1, 2)), is_(True))
+
+    def test_windows_expire(self):
+        self.pending.add('foo', d_tz(2014, 1, 1), d_tz(2014, 1, 2))
+
+        assert_that(set(self.redis.expiries.values()), is_(set([60])))
+
+    def test_lost_dispatches_stop_blocking_soon_after_they_were_due(self):
+        pending = PendingTransforms(self.redis, ttl=3630, debounce=30)
+
+        pending.add('foo', d_tz(2014, 1, 1), d_tz(2014, 1, 2))
+
+        assert_that(self.redis.expiries['backdrop:transforms:foo:window'],
+                    is_(3630))
+        assert_that(self.redis.expiries['backdrop:transforms:foo:scheduled'],
+                    is_(330))
+
+    def test_unscheduled_windows_are_scheduled_by_the_next_write(self):
+        self.pending.add('foo', d_tz(2014, 1, 1), d_tz(2014, 1, 2))
+
+        self.pending.unschedule('foo')
+
+        assert_that(self.pending.add(
+            'foo', d_tz(2014, 1, 3), d_tz(2014, 1, 3)), is_(True))
+        assert_that(self.pending.take('foo'),
+                    is_((d_tz(2014, 1, 1), d_tz(2014, 1, 3))))
+
+
+class TestDispatchTransforms(unittest.TestCase):
+
+    def setUp(self):
+        self.celery_app = Mock()
+        self.pending = Mock()
+
+    def test_transforms_are_dispatched_straight_away_without_debounce(self):
+        dispatch_transforms(self.celery_app, 'foo',
+                            d_tz(2014, 1, 1), d_tz(2014, 1, 2))
+
+        self.celery_app.send_task.assert_called_once_with(
+            'backdrop.transformers.dispatch.entrypoint',
+            args=('foo', d_tz(2014, 1, 1), d_tz(2014, 1, 2)))
+
+    def test_the_first_write_in_a_window_schedules_a_dispatch(self):
+        self.pending.add.return_value = True
+
+        dispatch_transforms(self.celery_app, 'foo',
+                            d_tz(2014, 1, 1), d_tz(2014, 1, 2),
+                            self.pending, 30)
+
+        self.pending.add.assert_called_once_with(
+            'foo', d_tz(2014, 1, 1), d_tz(2014, 1, 2))
+        self.celery_app.send_task.assert_called_once_with(
+            'backdrop.transformers.dispatch.dispatch_pending',
+            args=('foo',), countdown=30)
+
+    def test_windows_are_unscheduled_if_the_dispatch_cannot_be_sent(self):
+        self.pending.add.return_value = True
+        self.celery_app.send_task.side_effect = IOError('down')
+
+        assert_that(calling(dispatch_transforms).with_args(
+            self.celery_app, 'foo', d_tz(2014, 1, 1), d_tz(2014, 1, 2),
+            self.pending, 30), raises(IOError))
+
+        self.pending.unschedule.assert_called_once_with('foo')
+
+    def test_later_writes_in_a_window_are_coalesced(self):
+        self.pending.add.return_value = False
+
+        dispatch_transforms(self.celery_app, 'foo',
+                            d_tz(2014, 1, 1), d_tz(2014, 1, 2),
+                            self.pending, 30)
+
+        assert_that(self.celery_app.send_task.called, is_(False))
+
+    def test_transforms_are_dispatched_if_redis_is_down(self):
+        self.pending.add.side_effect = redis.ConnectionError('down')
+
+        dispatch_transforms(self.celery_app, 'foo',
+                            d_tz(2014, 1, 1), d_tz(2014, 1, 2),
+                            self.pending, 30)
+
+        self.celery_app.send_task.assert_called_once_with(
+            'backdrop.transformers.dispatch.entrypoint',
+            args=('foo', d_tz(2014, 1, 1), d_tz(2014, 1, 2)))
+
+
+class TestCreatePendingTransforms(unittest.TestCase):
+
+    def test_transforms_are_not_coalesced_by_default(self):
+        assert_that(create_pending_transforms({}), none())
+
+    def test_windows_outlast_the_debounce_interval(self):
+        pending = create_pending_transforms({
+            'TRANSFORM_DEBOUNCE': 30,
+            'TRANSFORM_PENDING_TTL': 60,
+            'BROKER_URL': 'redis://localhost:6379'})
+
+        assert_that(pending.ttl, is_(90))
+        assert_that(pending.scheduled_ttl, is_(90))
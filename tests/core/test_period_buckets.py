@@ -0,0 +1,71 @@
+import random
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+import pytz
+from hamcrest import assert_that, is_
+
+from backdrop.core.period_buckets import period_starts, batch_period_starts
+from backdrop.core.timeseries import PERIODS
+from tests.support.test_helpers import d_tz
+
+
+def random_timestamps(count, seed, tzinfo=pytz.UTC):
+    """Timestamps spread from 1900 to 2100 with random times of day"""
+    rng = random.Random(seed)
+    start = datetime(1900, 1, 1, tzinfo=tzinfo)
+    span = int((datetime(2100, 1, 1) - datetime(1900, 1, 1)).total_seconds())
+    return [start + timedelta(seconds=rng.randint(0, span),
+                              microseconds=rng.randint(0, 999999))
+            for _ in range(count)]
+
+
+def expected_starts(timestamp):
+    return dict((period.start_at_key, period.start(timestamp))
+                for period in PERIODS)
+
+
+class TestPeriodStarts(TestCase):
+
+    def test_matches_period_start_for_random_timestamps(self):
+        for timestamp in random_timestamps(5000, seed=1):
+            assert_that(period_starts(timestamp),
+                        is_(expected_starts(timestamp)))
+
+    def test_matches_period_start_around_boundaries(self):
+        # the last moment of each year and the first of the next, for
+        # a run of years covering leap years and every weekday
+        for year in range(1968, 2032):
+            boundary = d_tz(year, 1, 1)
+            for timestamp in [boundary - timedelta(microseconds=1),
+                              boundary,
+                              boundary + timedelta(days=3, hours=23)]:
+                assert_that(period_starts(timestamp),
+                            is_(expected_starts(timestamp)))
+
+    def test_matches_period_start_for_naive_timestamps(self):
+        for timestamp in random_timestamps(500, seed=2, tzinfo=None):
+            assert_that(period_starts(timestamp),
+                        is_(expected_starts(timestamp)))
+
+    def test_keeps_the_timezone_of_the_timestamp(self):
+        starts = period_starts(d_tz(2014, 3, 5, 10, 30))
+
+        assert_that(set(start.tzinfo for start in starts.values()),
+                    is_(set([pytz.UTC])))
+
+
+class TestBatchPeriodStarts(TestCase):
+
+    def test_matches_period_starts_for_each_timestamp(self):
+        # a shuffled mix of timestamps sharing only a few days between them
+        timestamps = [timestamp + timedelta(hours=hours)
+                      for timestamp in random_timestamps(20, seed=3)
+                      for hours in range(0, 48, 5)]
+        random.Random(4).shuffle(timestamps)
+
+        assert_that(batch_period_starts(timestamps),
+                    is_([expected_starts(t) for t in timestamps]))
+
+    def test_empty_batch(self):
+        assert_that(batch_period_starts([]), is_([]))
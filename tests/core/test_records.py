@@ -1,8 +1,9 @@
 from unittest import TestCase
-from hamcrest import assert_that, is_
+from hamcrest import assert_that, is_, has_entries, has_key, is_not
 from nose.tools import assert_raises
-from backdrop.core.records import _generate_auto_id
+from backdrop.core.records import _generate_auto_id, process_records
 from backdrop.core.errors import ValidationError
+from tests.support.test_helpers import d_tz
 
 
 class TestRecords(TestCase):
@@ -18,3 +19,57 @@ class TestRecords(TestCase):
             _generate_auto_id,
             {'foo': 1},
             ['bar'])
+
+
+class TestProcessRecords(TestCase):
+    schema = {
+        "type": "object",
+        "properties": {"count": {"type": "integer"}},
+        "required": ["count"]
+    }
+
+    def test_records_are_prepared_in_place(self):
+        record = {'_timestamp': '2012-12-12T12:12:00+00:00', 'name': u'foo'}
+
+        [(index, processed, errors)] = process_records(
+            [record], auto_ids=['name'])
+
+        assert_that(processed, is_(record))
+        assert_that(errors, is_([]))
+        assert_that(record, has_entries({
+            '_id': 'Zm9v',
+            '_timestamp': d_tz(2012, 12, 12, 12, 12),
+            '_week_start_at': d_tz(2012, 12, 10),
+        }))
+
+    def test_errors_are_reported_against_each_record(self):
+        results = process_records(
+            [{'count': 1}, {'count': 'one'}, {'_foo': 1}], schema=self.schema)
+
+        assert_that([(index, errors) for index, _, errors in results], is_([
+            (0, []),
+            (1, ["'one' is not of type 'integer'"]),
+            (2, ["'count' is a required property",
+                 '_foo is not a recognised internal field']),
+        ]))
+
+    def test_missing_auto_id_fields_are_only_reported_once(self):
+        results = process_records([{}, {}, {'foo': 'a'}], auto_ids=['foo'])
+
+        assert_that([errors for _, _, errors in results], is_([
+            ['The following required id fields are missing: foo'], [], []]))
+
+    def test_period_keys_are_not_added_to_invalid_records(self):
+        [(_, record, _)] = process_records(
+            [{'_timestamp': '2012-12-12T12:12:00+00:00', '_foo': 1}])
+
+        assert_that(record, is_not(has_key('_day_start_at')))
+
+    def test_records_are_processed_lazily(self):
+        def records():
+            yield {'count': 1}
+            raise AssertionError('only the first record should be read')
+
+        results = process_records(records())
+
+        assert_that(next(results)[0], is_(0))
@@ -0,0 +1,344 @@
+import unittest
+
+from hamcrest import assert_that, is_, none, contains, has_entries
+from nose.tools import assert_raises
+
+from backdrop.core.data_set import DataSet
+from backdrop.core.errors import InvalidOperationError
+from backdrop.core.query import Query
+from backdrop.core.rollups import PeriodRollups, MAX_DISTINCT_VALUES
+from backdrop.core.timeseries import HOUR, DAY, WEEK, MONTH
+from tests.support.test_helpers import d_tz
+
+
+class InMemoryStorage(object):
+    """Just enough of a storage engine to hold raw records and rollups"""
+
+    def __init__(self):
+        self.data_sets = {}
+        self.clock = 0
+
+    def _matching(self, data_set_id, query):
+        for record in self.data_sets.get(data_set_id, {}).values():
+            timestamp = record.get('_timestamp')
+            if query.start_at and (timestamp is None or
+                                   timestamp < query.start_at):
+                continue
+            if query.end_at and (timestamp is None or
+                                 timestamp >= query.end_at):
+                continue
+            if any(record.get(key) != value
+                   for key, value in query.filter_by):
+                continue
+            yield dict(record)
+
+    def iter_query(self, data_set_id, query, stream_after=None):
+        return self._matching(data_set_id, query)
+
+    def execute_query(self, data_set_id, query):
+        return list(self._matching(data_set_id, query))
+
+    def save_records(self, data_set_id, records):
+        data_set = self.data_sets.setdefault(data_set_id, {})
+        self.clock += 1
+        for record in records:
+            record['_updated_at'] = self.clock
+            data_set[record.get('_id', id(record))] = record
+
+    def get_last_updated(self, data_set_id):
+        return max([record['_updated_at'] for record
+                    in self.data_sets.get(data_set_id, {}).values()] or
+                   [None])
+
+    def delete_record(self, data_set_id, record_id):
+        self.data_sets.get(data_set_id, {}).pop(record_id, None)
+
+    def patch_records(self, data_set_id, patches):
+        data_set = self.data_sets.get(data_set_id, {})
+        previous = {}
+        for record_id, fields in patches.items():
+            if record_id in data_set:
+                previous[record_id] = data_set[record_id].get('_timestamp')
+                data_set[record_id].update(fields)
+        return previous
+
+    def delete_records(self, data_set_id, record_ids):
+        data_set = self.data_sets.get(data_set_id, {})
+        return dict((record_id, data_set.pop(record_id).get('_timestamp'))
+                    for record_id in record_ids if record_id in data_set)
+
+    def delete_records_between(self, data_set_id, start_at, end_at):
+        data_set = self.data_sets.get(data_set_id, {})
+        record_ids = [record['_id'] for record in self._matching(
+            data_set_id, Query.create(start_at=start_at, end_at=end_at))]
+        for record_id in record_ids:
+            del data_set[record_id]
+        return len(record_ids)
+
+    def delete_data_set(self, data_set_id):
+        self.data_sets.pop(data_set_id, None)
+
+
+class TestPeriodRollups(unittest.TestCase):
+
+    def setUp(self):
+        self.storage = InMemoryStorage()
+        self.rollups = PeriodRollups(self.storage, 'foo')
+
+    def _save(self, *records):
+        self.storage.save_records('foo', list(records))
+
+    def test_queries_are_not_answered_until_rollups_are_complete(self):
+        self._save({'_id': '1', '_timestamp': d_tz(2014, 1, 6), 'a': 1})
+        self.rollups.update([d_tz(2014, 1, 6)])
+
+        assert_that(self.rollups.execute_query(Query.create(period=WEEK)),
+                    none())
+
+    def test_grouped_and_filtered_queries_are_not_answered(self):
+        self.rollups.rebuild()
+
+        assert_that(self.rollups.execute_query(
+            Query.create(period=WEEK, group_by=['a'])), none())
+        assert_that(self.rollups.execute_query(
+            Query.create(period=WEEK, filter_by=[['a', 1]])), none())
+
+    def test_weeks_are_merged_from_days(self):
+        self._save({'_id': '1', '_timestamp': d_tz(2014, 1, 6, 9), 'a': 1},
+                   {'_id': '2', '_timestamp': d_tz(2014, 1, 8, 9), 'a': 2},
+                   {'_id': '3', '_timestamp': d_tz(2014, 1, 13), 'a': 4})
+        self.rollups.rebuild()
+
+        results = self.rollups.execute_query(Query.create(
+            period=WEEK, collect=[('a', 'sum')]))
+
+        assert_that(results, contains(
+            has_entries({'_week_start_at': d_tz(2014, 1, 6), '_count': 2}),
+            has_entries({'_week_start_at': d_tz(2014, 1, 13), '_count': 1})))
+        assert_that(results[0]['a'].reduce('sum'), is_(3))
+
+    def test_hours_are_answered_from_the_hours_in_each_day(self):
+        self._save({'_id': '1', '_timestamp': d_tz(2014, 1, 6, 9), 'a': 1},
+                   {'_id': '2', '_timestamp': d_tz(2014, 1, 6, 9, 30), 'a': 2},
+                   {'_id': '3', '_timestamp': d_tz(2014, 1, 6, 11), 'a': 4})
+        self.rollups.rebuild()
+
+        results = self.rollups.execute_query(Query.create(
+            period=HOUR, start_at=d_tz(2014, 1, 6, 9),
+            end_at=d_tz(2014, 1, 6, 10)))
+
+        assert_that(results, contains(
+            has_entries({'_hour_start_at': d_tz(2014, 1, 6, 9),
+                         '_count': 2})))
+
+    def test_writes_rebuild_the_days_they_touch(self):
+        self.rollups.rebuild()
+        self._save({'_id': '1', '_timestamp': d_tz(2014, 1, 6), 'a': 1})
+        self.rollups.update([d_tz(2014, 1, 6)])
+
+        results = self.rollups.execute_query(Query.create(period=DAY))
+
+        assert_that(results, contains(has_entries({'_count': 1})))
+
+    def test_days_left_empty_are_removed(self):
+        self._save({'_id': '1', '_timestamp': d_tz(2014, 1, 6), 'a': 1})
+        self.rollups.rebuild()
+        self.storage.delete_record('foo', '1')
+        self.rollups.update([d_tz(2014, 1, 6)])
+
+        assert_that(self.rollups.execute_query(Query.create(period=DAY)),
+                    is_([]))
+
+    def test_deleting_a_time_range_rebuilds_only_the_days_at_its_ends(self):
+        self._save(*[{'_id': str(day), '_timestamp': d_tz(2014, 1, day, 12)}
+                     for day in range(6, 11)])
+        self.rollups.rebuild()
+        self.storage.delete_records_between(
+            'foo', d_tz(2014, 1, 7, 12), d_tz(2014, 1, 9, 13))
+        self.storage.iter_query = self._counting(self.storage.iter_query)
+
+        self.rollups.delete_between(d_tz(2014, 1, 7, 12), d_tz(2014, 1, 9, 13))
+
+        assert_that(self.rollups.execute_query(Query.create(period=DAY)),
+                    contains(
+                        has_entries({'_day_start_at': d_tz(2014, 1, 6)}),
+                        has_entries({'_day_start_at': d_tz(2014, 1, 10)})))
+        assert_that(self.calls, is_(2))
+
+    def test_deleting_a_time_range_keeps_the_rollups_complete(self):
+        self._save({'_id': '1', '_timestamp': d_tz(2014, 1, 6), 'a': 1})
+        self.rollups.rebuild()
+        self.storage.delete_records_between(
+            'foo', d_tz(1960, 1, 1), d_tz(2014, 1, 6))
+
+        self.rollups.delete_between(d_tz(1960, 1, 1), d_tz(2014, 1, 6))
+
+        assert_that(self.rollups.is_complete(), is_(True))
+
+    def test_rebuilding_removes_days_without_records(self):
+        self._save({'_id': '1', '_timestamp': d_tz(2014, 1, 6), 'a': 1})
+        self.rollups.rebuild()
+        self.storage.delete_record('foo', '1')
+
+        assert_that(self.rollups.rebuild(), is_(True))
+
+        assert_that(self.rollups.execute_query(Query.create(period=DAY)),
+                    is_([]))
+
+    def test_rollups_written_to_during_a_rebuild_are_not_complete(self):
+        self._save({'_id': '1', '_timestamp': d_tz(2014, 1, 6), 'a': 1})
+        iter_query = self.storage.iter_query
+
+        def write_during_scan(data_set_id, query):
+            self.storage.iter_query = iter_query
+            self._save({'_id': '2', '_timestamp': d_tz(2014, 1, 7), 'a': 2})
+            self.rollups.update([d_tz(2014, 1, 7)])
+            return iter_query(data_set_id, query)
+        self.storage.iter_query = write_during_scan
+
+        assert_that(self.rollups.rebuild(), is_(False))
+
+        assert_that(PeriodRollups(self.storage, 'foo').is_complete(),
+                    is_(False))
+        assert_that(self.rollups.execute_query(Query.create(period=DAY)),
+                    none())
+
+    def test_records_written_during_a_rebuild_leave_it_incomplete(self):
+        self._save({'_id': '1', '_timestamp': d_tz(2014, 1, 6), 'a': 1})
+        save_records = self.storage.save_records
+
+        def write_while_saving(data_set_id, records):
+            save_records(data_set_id, records)
+            if data_set_id == '_rollups_foo':
+                self.storage.save_records = save_records
+                self._save({'_id': '2', '_timestamp': d_tz(2014, 1, 7)})
+        self.storage.save_records = write_while_saving
+
+        assert_that(self.rollups.rebuild(), is_(False))
+
+    def test_the_marker_is_looked_up_once(self):
+        self.rollups.rebuild()
+        rollups = PeriodRollups(self.storage, 'foo')
+        self.storage.execute_query = self._counting(
+            self.storage.execute_query)
+
+        rollups.execute_query(Query.create(period=DAY))
+        rollups.execute_query(Query.create(period=WEEK))
+
+        assert_that(self.calls, is_(3))
+
+    def _counting(self, method):
+        self.calls = 0
+
+        def counted(*args):
+            self.calls += 1
+            return method(*args)
+        return counted
+
+    def test_sets_with_too_many_values_fall_back_to_raw_queries(self):
+        self._save(*[{'_id': str(i), '_timestamp': d_tz(2014, 1, 6), 'a': i}
+                     for i in range(MAX_DISTINCT_VALUES + 1)])
+        self.rollups.rebuild()
+
+        assert_that(self.rollups.execute_query(Query.create(
+            period=DAY, collect=[('a', 'set')])), none())
+        assert_that(self.rollups.execute_query(Query.create(
+            period=DAY, collect=[('a', 'sum')]))[0]['a'].reduce('sum'),
+            is_(sum(range(MAX_DISTINCT_VALUES + 1))))
+
+
+class TestDataSetWithPeriodRollups(unittest.TestCase):
+
+    def setUp(self):
+        self.storage = InMemoryStorage()
+        self.data_set = DataSet(self.storage, {'name': 'foo'},
+                                period_rollups=True)
+        self.data_set.rebuild_rollups()
+
+    def test_stored_records_are_rolled_up(self):
+        self.data_set.store([
+            {'_id': 'a', '_timestamp': '2014-01-06T10:00:00+00:00',
+             'value': 2, 'kind': 'x'},
+            {'_id': 'b', '_timestamp': '2014-01-07T10:00:00+00:00',
+             'value': 3, 'kind': 'y'},
+            {'_id': 'c', '_timestamp': '2014-02-03T10:00:00+00:00',
+             'value': 5, 'kind': 'x'},
+        ])
+
+        data = self.data_set.execute_query(Query.create(
+            period=MONTH, start_at=d_tz(2014, 1, 1), end_at=d_tz(2014, 3, 1),
+            collect=[('value', 'sum'), ('value', 'mean'), ('kind', 'set')]))
+
+        assert_that(data, contains(
+            has_entries({'_start_at': d_tz(2014, 1, 1), '_count': 2,
+                         'value:sum': 5, 'value:mean': 2.5,
+                         'kind:set': ['x', 'y']}),
+            has_entries({'_start_at': d_tz(2014, 2, 1), '_count': 1,
+                         'value:sum': 5, 'value:mean': 5.0, 'kind:set': ['x']})))
+
+    def test_summing_non_numeric_values_still_fails(self):
+        self.data_set.store([
+            {'_id': 'a', '_timestamp': '2014-01-06T10:00:00+00:00',
+             'kind': 'x'}])
+
+        assert_raises(InvalidOperationError, self.data_set.execute_query,
+                      Query.create(period=DAY, collect=[('kind', 'sum')]))
+
+    def test_rollups_follow_deleted_records(self):
+        self.data_set.store([
+            {'_id': 'a', '_timestamp': '2014-01-06T10:00:00+00:00'}])
+
+        self.data_set.delete('a')
+
+        assert_that(
+            self.data_set.execute_query(Query.create(period=DAY)), is_(()))
+
+    def test_rollups_follow_patched_records(self):
+        self.data_set.store([
+            {'_id': 'a', '_timestamp': '2014-01-06T10:00:00+00:00'}])
+
+        self.data_set.patch('a', {'_timestamp': d_tz(2014, 1, 7, 10)})
+
+        assert_that(
+            self.data_set.execute_query(Query.create(period=DAY)),
+            contains(has_entries({'_start_at': d_tz(2014, 1, 7),
+                                  '_count': 1})))
+
+    def test_rollups_follow_records_deleted_by_time_range(self):
+        self.data_set.store([
+            {'_id': 'a', '_timestamp': '2014-01-06T10:00:00+00:00'},
+            {'_id': 'b', '_timestamp': '2014-01-07T10:00:00+00:00'}])
+
+        deleted = self.data_set.delete_between(
+            d_tz(2014, 1, 6), d_tz(2014, 1, 7))
+
+        assert_that(deleted, is_(1))
+        assert_that(
+            self.data_set.execute_query(Query.create(period=DAY)),
+            contains(has_entries({'_start_at': d_tz(2014, 1, 7),
+                                  '_count': 1})))
+
+    def test_rollup_updates_can_be_queued(self):
+        queued = []
+        data_set = DataSet(self.storage, {'name': 'foo'},
+                           period_rollups=True,
+                           queue_rollup_update=lambda *args:
+                           queued.append(args))
+
+        data_set.store([
+            {'_id': 'a', '_timestamp': '2014-01-06T10:00:00+00:00'},
+            {'_id': 'b', '_timestamp': '2014-01-06T11:00:00+00:00'}])
+
+        assert_that(queued, is_([('foo', [d_tz(2014, 1, 6)])]))
+        assert_that(
+            self.data_set.execute_query(Query.create(period=DAY)), is_(()))
+
+    def test_rollups_last_updated_is_given_for_queries_they_answer(self):
+        self.data_set.store([
+            {'_id': 'a', '_timestamp': '2014-01-06T10:00:00+00:00'}])
+
+        assert_that(self.data_set.get_rollups_last_updated(
+            Query.create(period=DAY)),
+            is_(self.storage.get_last_updated('_rollups_foo')))
+        assert_that(self.data_set.get_rollups_last_updated(
+            Query.create(period=DAY, collect=[('_id', 'set')])), none())
@@ -0,0 +1,105 @@
+import unittest
+
+from hamcrest import assert_that, is_, none, same_instance, \
+    contains_inanyorder
+from mock import patch
+
+from backdrop.core import schema_validators
+from backdrop.core.schema_validators import compile_validator, \
+    compile_fast_validator, get_validator
+
+
+schema = {
+    "$schema": "http://json-schema.org/schema#",
+    "title": "Visits",
+    "type": "object",
+    "properties": {
+        "_timestamp": {
+            "description": "An ISO8601 formatted date time",
+            "type": "string",
+            "format": "date-time"
+        },
+        "count": {"type": "integer"},
+        "rate": {"type": ["number", "null"]},
+        "device": {"type": "string", "enum": ["desktop", "mobile"]},
+        "flagged": {"type": "boolean"}
+    },
+    "required": ["_timestamp", "count"]
+}
+
+records = [
+    {"_timestamp": "2014-01-01T00:00:00+00:00", "count": 1},
+    {"_timestamp": "2014-01-01T00:00:00+00:00", "count": 1, "rate": None,
+     "device": "mobile", "flagged": False},
+    {"_timestamp": "555", "count": "1"},
+    {"count": True, "rate": True, "device": "tablet", "flagged": 0},
+    {"count": 1.0, "rate": 1, "device": None},
+    {"_timestamp": 20140101},
+    {},
+    "not an object",
+]
+
+
+class TestCompileFastValidator(unittest.TestCase):
+
+    def test_gives_the_same_errors_as_jsonschema(self):
+        fast = compile_fast_validator(schema)
+        slow = compile_validator(schema, fast=False)
+
+        for record in records:
+            assert_that(fast(record), is_(slow(record)))
+
+    def test_empty_schemas(self):
+        validate = compile_fast_validator({"properties": {}, "required": []})
+
+        assert_that(validate({"a": 1}), is_([]))
+
+    def test_unsupported_keywords_are_not_compiled(self):
+        assert_that(compile_fast_validator(
+            {"type": "object", "additionalProperties": False}), none())
+        assert_that(compile_fast_validator(
+            {"properties": {"a": {"type": "string", "maxLength": 3}}}),
+            none())
+        assert_that(compile_fast_validator(
+            {"properties": {"a": {"type": "date"}}}), none())
+        assert_that(compile_fast_validator({"type": "array"}), none())
+
+    def test_unsupported_schemas_fall_back_to_jsonschema(self):
+        validate = compile_validator(
+            {"properties": {"a": {"type": "string", "maxLength": 3}}})
+
+        assert_that(validate({"a": "abcd"}), is_(["'abcd' is too long"]))
+
+    def test_property_names_are_not_interpreted_as_code(self):
+        validate = compile_fast_validator(
+            {"properties": {"a'): pass\n": {"type": "string"}},
+             "required": ["%s"]})
+
+        assert_that(validate({"a'): pass\n": 1}), contains_inanyorder(
+            "1 is not of type 'string'", "'%s' is a required property"))
+
+
+class TestGetValidator(unittest.TestCase):
+
+    def setUp(self):
+        schema_validators._validators.clear()
+
+    def test_validators_are_reused_for_equal_schemas(self):
+        a = get_validator({"required": ["a"], "type": "object"})
+        b = get_validator({"type": "object", "required": ["a"]})
+
+        assert_that(a, same_instance(b))
+
+    @patch('backdrop.core.schema_validators.compile_validator')
+    def test_schemas_are_compiled_once(self, compile_validator):
+        get_validator(schema)
+        get_validator(schema)
+
+        assert_that(compile_validator.call_count, is_(1))
+
+    def test_different_schemas_get_different_validators(self):
+        a = get_validator({"required": ["a"]})
+        b = get_validator({"required": ["b"]})
+
+        assert_that(a({"b": 1}), is_(["'a' is a required property"]))
+        assert_that(b({"b": 1}), is_([]))
@@ -1,8 +1,10 @@
 import unittest
 from hamcrest import assert_that, equal_to
+from dateutil import parser
 import pytz
 import datetime
-from backdrop.core.timeutils import parse_time_as_utc, as_seconds
+from backdrop.core.timeutils import parse_time_as_utc, parse_iso8601, \
+    as_seconds
 from tests.support.test_helpers import d_tz, d
 
 
@@ -30,6 +32,52 @@ class ParseTimeAsUTCTestCase(unittest.TestCase):
                     equal_to(d_tz(2012, 12, 12, 12)))
 
 
+class ParseISO8601TestCase(unittest.TestCase):
+
+    def assert_same_as_dateutil(self, time_string):
+        expected = parser.parse(time_string)
+        parsed = parse_iso8601(time_string)
+
+        assert_that(parsed, equal_to(expected))
+        assert_that(parsed.utcoffset(), equal_to(expected.utcoffset()))
+        assert_that(parsed.timetuple(), equal_to(expected.timetuple()))
+
+    def test_strict_time_strings_parse_as_dateutil_does(self):
+        for time_string in ["2012-12-12T12:12:12Z",
+                            "2012-12-12T12:12:12+00:00",
+                            "2012-12-12T12:12:12-00:00",
+                            "2012-12-12T12:12:12+0100",
+                            "2012-12-12T23:59:59-05:30",
+                            "2012-02-29T00:00:00+14:00",
+                            "2012-12-12T12:12:12.5Z",
+                            "2012-12-12T12:12:12.123456+01:00",
+                            "2012-12-12T12:12:12"]:
+            self.assert_same_as_dateutil(time_string)
+
+    def test_other_time_strings_are_left_to_dateutil(self):
+        for time_string in ["2012-12-12",
+                            "12 December 2012 12:12",
+                            "2012-12-12 12:12:12+00:00",
+                            "2012-12-12T12:12:12.1234567Z"]:
+            self.assert_same_as_dateutil(time_string)
+
+    def test_invalid_dates_raise_the_same_errors_as_dateutil(self):
+        for time_string in ["2013-02-29T00:00:00Z",
+                            "2012-13-01T00:00:00Z",
+                            "2012-12-12T25:00:00Z",
+                            "31-11-12T00:00:00"]:
+            self.assertRaises(ValueError, parse_iso8601, time_string)
+        self.assertRaises(TypeError, parse_iso8601, "not a date")
+
+    def test_offsets_are_kept(self):
+        # Monday in London is still Sunday in UTC
+        parsed = parse_iso8601("2014-01-06T00:00:00+01:00")
+
+        assert_that(parsed.weekday(), equal_to(0))
+        assert_that(parse_time_as_utc("2014-01-06T00:00:00+01:00"),
+                    equal_to(d_tz(2014, 1, 5, 23)))
+
+
 class TransformTimesTestCase(unittest.TestCase):
 
     def test_datetime_is_converted_to_seconds(self):
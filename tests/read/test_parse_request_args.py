@@ -162,3 +162,26 @@ class Test_parse_request_args(unittest.TestCase):
         args = parse_request_args(request_args)
 
         assert_that(args['collect'], is_([("some_key", "mean")]))
+
+    def test_ids_are_parsed(self):
+        request_args = MultiDict([("id", "a"), ("id", "b")])
+
+        args = parse_request_args(request_args)
+
+        assert_that(args['ids'], is_(['a', 'b']))
+
+    def test_after_is_parsed(self):
+        request_args = MultiDict([
+            ("after", "2012-12-12T08:12:43+00:00,some-id")])
+
+        args = parse_request_args(request_args)
+
+        assert_that(args['after'], is_(
+            (datetime(2012, 12, 12, 8, 12, 43, tzinfo=pytz.UTC), 'some-id')))
+
+    def test_an_empty_after_is_the_first_page(self):
+        request_args = MultiDict([("after", "")])
+
+        args = parse_request_args(request_args)
+
+        assert_that(args['after'], is_(()))
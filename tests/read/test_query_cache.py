@@ -0,0 +1,170 @@
+import unittest
+
+from hamcrest import assert_that, is_, equal_to, is_not
+from mock import Mock, patch
+
+from backdrop.core.cache import LRUCache
+from backdrop.core.query import Query
+from backdrop.core.timeseries import WEEK
+from backdrop.read.query_cache import QueryResultCache, query_cache_key, \
+    create_query_result_cache
+from tests.support.test_helpers import d_tz
+
+
+def _data_set(name='foo', last_updated=None, rollups_last_updated=None):
+    data_set = Mock()
+    data_set.name = name
+    data_set.get_last_updated.return_value = last_updated
+    data_set.get_rollups_last_updated.return_value = rollups_last_updated
+    data_set.execute_query.return_value = [{'value': 1}]
+    return data_set
+
+
+class TestQueryCacheKey(unittest.TestCase):
+
+    def test_key_is_the_same_for_equivalent_queries(self):
+        data_set = _data_set()
+        a = Query.create(collect=[('a', 'sum'), ('b', 'count')],
+                         filter_by=[['x', '1'], ['y', '2']])
+        b = Query.create(collect=[('b', 'count'), ('a', 'sum')],
+                         filter_by=[['y', '2'], ['x', '1']])
+
+        assert_that(query_cache_key(data_set, a),
+                    equal_to(query_cache_key(data_set, b)))
+
+    def test_key_handles_periods_and_dates(self):
+        data_set = _data_set()
+        query = Query.create(period=WEEK,
+                             start_at=d_tz(2014, 1, 6),
+                             end_at=d_tz(2014, 1, 13))
+
+        assert_that(query_cache_key(data_set, query),
+                    is_not(equal_to(query_cache_key(data_set, Query.create()))))
+
+    def test_key_changes_with_the_data_set_name(self):
+        query = Query.create()
+
+        assert_that(query_cache_key(_data_set('foo'), query),
+                    is_not(equal_to(query_cache_key(_data_set('bar'), query))))
+
+    def test_key_changes_when_the_data_set_is_updated(self):
+        query = Query.create()
+        before = _data_set(last_updated=d_tz(2014, 1, 1))
+        after = _data_set(last_updated=d_tz(2014, 1, 2))
+
+        assert_that(query_cache_key(before, query),
+                    is_not(equal_to(query_cache_key(after, query))))
+
+    def test_key_changes_when_the_rollups_catch_up(self):
+        query = Query.create(period=WEEK)
+        before = _data_set(last_updated=d_tz(2014, 1, 2),
+                           rollups_last_updated=d_tz(2014, 1, 1))
+        after = _data_set(last_updated=d_tz(2014, 1, 2),
+                          rollups_last_updated=d_tz(2014, 1, 2))
+
+        assert_that(query_cache_key(before, query),
+                    is_not(equal_to(query_cache_key(after, query))))
+
+
+class TestQueryResultCache(unittest.TestCase):
+
+    def test_executes_every_query_without_a_backend(self):
+        data_set = _data_set()
+        cache = QueryResultCache(None)
+
+        cache.execute_query(data_set, Query.create())
+        cache.execute_query(data_set, Query.create())
+
+        assert_that(data_set.execute_query.call_count, is_(2))
+
+    def test_repeated_queries_are_served_from_the_cache(self):
+        data_set = _data_set()
+        cache = QueryResultCache(LRUCache(max_size=10, ttl=60))
+
+        first = cache.execute_query(data_set, Query.create())
+        second = cache.execute_query(data_set, Query.create())
+
+        assert_that(data_set.execute_query.call_count, is_(1))
+        assert_that(second, equal_to(first))
+
+    def test_writes_to_the_data_set_invalidate_the_cache(self):
+        data_set = _data_set(last_updated=d_tz(2014, 1, 1))
+        cache = QueryResultCache(LRUCache(max_size=10, ttl=60))
+
+        cache.execute_query(data_set, Query.create())
+        data_set.get_last_updated.return_value = d_tz(2014, 1, 2)
+        cache.execute_query(data_set, Query.create())
+
+        assert_that(data_set.execute_query.call_count, is_(2))
+
+    def test_invalidating_a_data_set_drops_only_its_results(self):
+        foo, bar = _data_set('foo'), _data_set('bar')
+        cache = QueryResultCache(LRUCache(max_size=10, ttl=60))
+        cache.execute_query(foo, Query.create())
+        cache.execute_query(bar, Query.create())
+
+        cache.invalidate('foo')
+        cache.execute_query(foo, Query.create())
+        cache.execute_query(bar, Query.create())
+
+        assert_that(foo.execute_query.call_count, is_(2))
+        assert_that(bar.execute_query.call_count, is_(1))
+
+    @patch('backdrop.read.query_cache.statsd')
+    def test_hits_and_misses_are_counted(self, statsd):
+        data_set = _data_set()
+        cache = QueryResultCache(LRUCache(max_size=10, ttl=60))
+
+        cache.execute_query(data_set, Query.create())
+        cache.execute_query(data_set, Query.create())
+
+        statsd.incr.assert_any_call('read.query_cache.miss', data_set='foo')
+        statsd.incr.assert_any_call('read.query_cache.hit', data_set='foo')
+
+    def test_small_raw_results_are_cached_rather_than_streamed(self):
+        data_set = _data_set()
+        data_set.iter_query.side_effect = lambda query, stream_after: iter([{'value': 1}])
+        cache = QueryResultCache(LRUCache(max_size=10, ttl=60))
+
+        first = cache.execute_or_stream(data_set, Query.create(), 2)
+        second = cache.execute_or_stream(data_set, Query.create(), 2)
+
+        assert_that(first, is_(({'value': 1},)))
+        assert_that(second, equal_to(first))
+        assert_that(data_set.iter_query.call_count, is_(1))
+
+    def test_large_raw_results_are_streamed_and_not_cached(self):
+        data_set = _data_set()
+        data_set.iter_query.side_effect = \
+            lambda query, stream_after: iter([{'value': 1}, {'value': 2}])
+        cache = QueryResultCache(LRUCache(max_size=10, ttl=60))
+
+        first = cache.execute_or_stream(data_set, Query.create(), 1)
+        cache.execute_or_stream(data_set, Query.create(), 1)
+
+        assert_that(list(first), is_([{'value': 1}, {'value': 2}]))
+        assert_that(data_set.iter_query.call_count, is_(2))
+
+
+class TestCreateQueryResultCache(unittest.TestCase):
+
+    def test_no_backend_caches_nothing(self):
+        assert_that(create_query_result_cache({})._backend, is_(None))
+
+    def test_lru_results_expire_within_the_lru_ttl(self):
+        cache = create_query_result_cache({
+            'QUERY_CACHE_BACKEND': 'lru',
+            'QUERY_CACHE_TTL': 300,
+            'QUERY_CACHE_LRU_TTL': 30,
+        })
+
+        assert_that(cache._backend.ttl, is_(30))
+
+    def test_redis_results_use_the_query_cache_ttl(self):
+        cache = create_query_result_cache({
+            'QUERY_CACHE_BACKEND': 'redis',
+            'QUERY_CACHE_TTL': 300,
+            'QUERY_CACHE_REDIS_URL': 'redis://localhost:6379/0',
+        })
+
+        assert_that(cache._backend.ttl, is_(300))
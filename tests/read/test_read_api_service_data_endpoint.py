@@ -3,6 +3,7 @@ import urllib
 import datetime
 from hamcrest import assert_that, is_
 from mock import patch
+from psycopg2.pool import PoolError
 import pytz
 from backdrop.core.timeseries import WEEK
 from backdrop.read import api
@@ -110,6 +111,13 @@ class QueryingApiTestCase(unittest.TestCase):
         response = self.app.get('/data/no-group/no-type')
         assert_that(response, has_status(404))
 
+    @fake_data_set_exists("foo", data_group="some-group", data_type="some-type")
+    @patch('backdrop.core.data_set.DataSet.execute_query')
+    def test_returns_503_when_no_database_connection_is_free(self, mock_query):
+        mock_query.side_effect = PoolError('no connection returned')
+        response = self.app.get('/data/some-group/some-type?group_by=zombies')
+        assert_that(response, has_status(503))
+
 
 class PreflightChecksApiTestCase(unittest.TestCase):
 
@@ -0,0 +1,224 @@
+import json
+import unittest
+
+from hamcrest import assert_that, is_
+from bson import ObjectId
+from mock import patch
+
+from backdrop.read import api
+from tests.support.performanceplatform_client import fake_data_set_exists
+from tests.support.test_helpers import d_tz, has_status
+
+
+class StreamingRawQueryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = api.app.test_client()
+        api.app.config['RAW_QUERY_STREAM_THRESHOLD'] = 2
+
+    def tearDown(self):
+        del api.app.config['RAW_QUERY_STREAM_THRESHOLD']
+
+    @fake_data_set_exists("foo", raw_queries_allowed=True)
+    @patch('backdrop.core.data_set.DataSet.iter_query')
+    def test_large_raw_queries_are_streamed(self, iter_query):
+        iter_query.return_value = iter([
+            {'_timestamp': d_tz(2014, 1, 1), 'n': 1},
+            {'_timestamp': d_tz(2014, 1, 2), 'n': 2},
+            {'_timestamp': d_tz(2014, 1, 3), 'n': 3},
+        ])
+
+        response = self.app.get('/foo?filter_by=foo:bar')
+
+        assert_that(response, has_status(200))
+        # streamed responses are not hashed for an etag
+        assert_that('ETag' in response.headers, is_(False))
+        assert_that(json.loads(response.data), is_({
+            'data': [
+                {'_timestamp': '2014-01-01T00:00:00+00:00', 'n': 1},
+                {'_timestamp': '2014-01-02T00:00:00+00:00', 'n': 2},
+                {'_timestamp': '2014-01-03T00:00:00+00:00', 'n': 3},
+            ]
+        }))
+
+    @fake_data_set_exists("foo", raw_queries_allowed=True)
+    @patch('backdrop.core.data_set.DataSet.iter_query')
+    def test_small_raw_queries_are_not_streamed(self, iter_query):
+        iter_query.return_value = iter([{'n': 1}, {'n': 2}])
+
+        response = self.app.get('/foo?filter_by=foo:bar')
+
+        assert_that('ETag' in response.headers, is_(True))
+        assert_that(json.loads(response.data),
+                    is_({'data': [{'n': 1}, {'n': 2}]}))
+
+    @fake_data_set_exists("foo", raw_queries_allowed=True, published=False)
+    @patch('backdrop.core.data_set.DataSet.iter_query')
+    def test_streamed_unpublished_data_sets_keep_the_warning(
+            self, iter_query):
+        iter_query.return_value = iter([{'n': 1}, {'n': 2}, {'n': 3}])
+
+        response = self.app.get('/foo?filter_by=foo:bar')
+
+        body = json.loads(response.data)
+        assert_that(len(body['data']), is_(3))
+        assert_that(body['warning'].startswith('Warning'), is_(True))
+        assert_that(response.headers['Cache-Control'], is_('no-cache'))
+
+    @fake_data_set_exists("foo", raw_queries_allowed=True)
+    @patch('backdrop.core.data_set.DataSet.execute_query')
+    def test_grouped_queries_are_not_streamed(self, execute_query):
+        execute_query.return_value = ()
+
+        self.app.get('/foo?group_by=foo')
+
+        assert_that(execute_query.called, is_(True))
+
+
+class CsvExportTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = api.app.test_client()
+
+    @fake_data_set_exists("foo")
+    @patch('backdrop.core.data_set.DataSet.execute_query')
+    def test_grouped_output_is_flattened_into_rows(self, execute_query):
+        execute_query.return_value = (
+            {'foo': 'a', '_count': 3, 'values': [
+                {'_start_at': '2014-01-06', '_count': 1},
+                {'_start_at': '2014-01-13', '_count': 2}]},
+        )
+
+        response = self.app.get('/foo?group_by=foo&period=week'
+                                '&start_at=2014-01-06T00:00:00Z'
+                                '&end_at=2014-01-20T00:00:00Z&format=csv')
+
+        assert_that(response, has_status(200))
+        assert_that(response.headers['Content-Type'], is_('text/csv'))
+        assert_that(response.data, is_(
+            '_count,_start_at,foo\r\n1,2014-01-06,a\r\n2,2014-01-13,a\r\n'))
+        assert_that('ETag' in response.headers, is_(True))
+
+    @fake_data_set_exists("foo", raw_queries_allowed=True)
+    @patch('backdrop.core.data_set.DataSet.iter_query')
+    def test_large_raw_queries_are_streamed(self, iter_query):
+        api.app.config['RAW_QUERY_STREAM_THRESHOLD'] = 1
+        iter_query.return_value = iter([{'n': 1}, {'n': 2}])
+
+        try:
+            response = self.app.get('/foo?filter_by=foo:bar&format=csv')
+        finally:
+            del api.app.config['RAW_QUERY_STREAM_THRESHOLD']
+
+        assert_that(response.data, is_('n\r\n1\r\n2\r\n'))
+
+
+class PaginatedRawQueryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = api.app.test_client()
+
+    @fake_data_set_exists("foo", raw_queries_allowed=True)
+    @patch('backdrop.core.data_set.DataSet.execute_query')
+    def test_full_pages_link_to_the_next_page(self, execute_query):
+        execute_query.return_value = (
+            {'_id': 'a', '_timestamp': d_tz(2014, 1, 1)},
+            {'_id': 'b', '_timestamp': d_tz(2014, 1, 2)},
+        )
+
+        response = self.app.get('/foo?limit=2&after=')
+
+        assert_that(json.loads(response.data)['next'],
+                    is_('2014-01-02T00:00:00+00:00,b'))
+        query = execute_query.call_args[0][0]
+        assert_that(query.is_paginated, is_(True))
+
+    @fake_data_set_exists("foo", raw_queries_allowed=True)
+    @patch('backdrop.core.data_set.DataSet.execute_query')
+    def test_limited_queries_are_not_paged_without_after(self,
+                                                         execute_query):
+        execute_query.return_value = (
+            {'_id': 'a', '_timestamp': d_tz(2014, 1, 1)},
+            {'_id': 'b', '_timestamp': d_tz(2014, 1, 2)},
+        )
+
+        response = self.app.get('/foo?limit=2')
+
+        assert_that('next' in json.loads(response.data), is_(False))
+        query = execute_query.call_args[0][0]
+        assert_that(query.is_paginated, is_(False))
+
+    @fake_data_set_exists("foo", raw_queries_allowed=True)
+    @patch('backdrop.core.data_set.DataSet.execute_query')
+    def test_pages_continue_from_object_ids(self, execute_query):
+        execute_query.return_value = (
+            {'_id': ObjectId('5284f27b2c54f3c2ee0d8d3a'),
+             '_timestamp': d_tz(2014, 1, 1)},
+        )
+
+        response = self.app.get('/foo?limit=1&after=')
+
+        assert_that(
+            json.loads(response.data)['next'],
+            is_('2014-01-01T00:00:00+00:00,'
+                'ObjectId(5284f27b2c54f3c2ee0d8d3a)'))
+
+    @fake_data_set_exists("foo", raw_queries_allowed=True)
+    @patch('backdrop.core.data_set.DataSet.execute_query')
+    def test_pages_ending_without_a_timestamp_are_refused(self,
+                                                          execute_query):
+        execute_query.return_value = ({'_id': 'a'},)
+
+        response = self.app.get('/foo?limit=1&after=')
+
+        assert_that(response, has_status(400))
+
+    @fake_data_set_exists("foo", raw_queries_allowed=True)
+    @patch('backdrop.core.data_set.DataSet.execute_query')
+    def test_the_last_page_has_no_next_page(self, execute_query):
+        execute_query.return_value = (
+            {'_id': 'a', '_timestamp': d_tz(2014, 1, 1)},
+        )
+
+        response = self.app.get(
+            '/foo?limit=2&after=2013-12-31T00:00:00%2B00:00,z')
+
+        assert_that(response, has_status(200))
+        assert_that(json.loads(response.data)['next'], is_(None))
+        query = execute_query.call_args[0][0]
+        assert_that(query.after, is_((d_tz(2013, 12, 31), 'z')))
+
+    @fake_data_set_exists("foo", raw_queries_allowed=True)
+    @patch('backdrop.core.data_set.DataSet.iter_query')
+    def test_streamed_pages_link_to_the_next_page(self, iter_query):
+        api.app.config['RAW_QUERY_STREAM_THRESHOLD'] = 1
+        iter_query.return_value = iter([
+            {'_id': 'a', '_timestamp': d_tz(2014, 1, 1)},
+            {'_id': 'b', '_timestamp': d_tz(2014, 1, 2)},
+        ])
+
+        try:
+            response = self.app.get('/foo?limit=2&after=')
+        finally:
+            del api.app.config['RAW_QUERY_STREAM_THRESHOLD']
+
+        body = json.loads(response.data)
+        assert_that(len(body['data']), is_(2))
+        assert_that(body['next'], is_('2014-01-02T00:00:00+00:00,b'))
+
+    @fake_data_set_exists("foo", raw_queries_allowed=True)
+    @patch('backdrop.core.data_set.DataSet.iter_query')
+    def test_streamed_pages_say_why_they_cannot_be_continued(self,
+                                                             iter_query):
+        api.app.config['RAW_QUERY_STREAM_THRESHOLD'] = 1
+        iter_query.return_value = iter([
+            {'_id': 'a', '_timestamp': d_tz(2014, 1, 1)},
+            {'_id': 'b'},
+        ])
+
+        try:
+            response = self.app.get('/foo?limit=2&after=')
+        finally:
+            del api.app.config['RAW_QUERY_STREAM_THRESHOLD']
+
+        body = json.loads(response.data)
+        assert_that(body['next'], is_(None))
+        assert_that(body['error'], is_(
+            'Records without a _timestamp and an _id cannot be paged through'))
@@ -13,6 +13,37 @@ def validate_request_args(request_args, raw_queries_allowed=True):
 
 
 class TestRequestValidation(TestCase):
+    def test_after_must_be_a_timestamp_and_an_id(self):
+        assert_that(
+            validate_request_args({'after': '2014-01-01T00:00:00+00:00'}),
+            is_invalid_with_message(
+                "'after' must be a _timestamp and an _id separated by a comma"))
+        assert_that(
+            validate_request_args({'after': '2014-01-01T00:00:00+00:00,abc'}),
+            is_valid())
+
+    def test_an_empty_after_asks_for_the_first_page(self):
+        assert_that(validate_request_args({'after': ''}), is_valid())
+
+    def test_queries_can_ask_for_a_set_of_ids(self):
+        assert_that(
+            validate_request_args(MultiDict([('id', 'a'), ('id', 'b')])),
+            is_valid())
+
+    def test_queries_cannot_ask_for_too_many_ids(self):
+        assert_that(
+            validate_request_args(MultiDict(
+                [('id', str(i)) for i in range(1001)])),
+            is_invalid_with_message("A query can ask for at most 1000 ids"))
+
+    def test_after_cannot_be_used_with_sort_by(self):
+        assert_that(
+            validate_request_args({'after': '2014-01-01T00:00:00+00:00,abc',
+                                   'sort_by': 'foo:ascending'}),
+            is_invalid_with_message(
+                "'after' can only be used to page through raw queries "
+                "without sort_by"))
+
     def test_queries_with_badly_formatted_start_at_are_disallowed(self):
         assert_that(
             validate_request_args({
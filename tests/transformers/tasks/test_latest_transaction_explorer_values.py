@@ -233,21 +233,22 @@ quarterly_data_not_latest = [
 ]
 
 
+def _existing_records(timestamp):
+    def get(query_parameters):
+        return {'data': [
+            {'_id': record_id, '_count': 1.0, '_timestamp': timestamp}
+            for record_id in query_parameters['id']]}
+    return get
+
+
 class ComputeTestCase(unittest.TestCase):
 
     @patch("performanceplatform.client.DataSet.from_group_and_type")
     @patch("performanceplatform.client.AdminAPI.get_dashboard_by_tx_id")
     def test_compute(self, mock_dashboard_finder, mock_dataset):
         mockdata = Mock()
-        mockdata.get.return_value = {
-            'data': [
-                {
-                    '_count': 1.0,
-                    '_end_at': '2012-01-19T00:00:00+00:00',
-                    '_timestamp': '2012-01-12T00:00:00+00:00'
-                }
-            ]
-        }
+        mockdata.get.side_effect = _existing_records(
+            '2012-01-12T00:00:00+00:00')
         mock_dataset.return_value = mockdata
 
         mock_dashboard_finder.side_effect = lambda x: {
@@ -270,15 +271,8 @@ class ComputeTestCase(unittest.TestCase):
             mock_dashboard_finder,
             mock_dataset):
         mockdata = Mock()
-        mockdata.get.return_value = {
-            'data': [
-                {
-                    '_count': 1.0,
-                    '_end_at': '2018-01-19T00:00:00+00:00',
-                    '_timestamp': '2018-01-12T00:00:00+00:00'
-                }
-            ]
-        }
+        mockdata.get.side_effect = _existing_records(
+            '2018-01-12T00:00:00+00:00')
         mock_dataset.return_value = mockdata
 
         mock_dashboard_finder.side_effect = lambda x: {
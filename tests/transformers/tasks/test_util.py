@@ -7,7 +7,9 @@ from mock import patch, Mock
 from backdrop.transformers.tasks.util import(
     encode_id,
     group_by,
-    is_latest_data)
+    is_latest_data,
+    latest_timestamps_by_id,
+    filter_latest_data)
 
 
 class UtilTestCase(unittest.TestCase):
@@ -155,3 +157,56 @@ class UtilTestCase(unittest.TestCase):
             'period': 'year',
             'sort_by': '_timestamp:descending'})
         assert_that(is_actually_latest_data, is_(True))
+
+    @freeze_time('2018, 1, 09 00:00:00')
+    @patch("backdrop.transformers.tasks.util.ID_QUERY_CHUNK_SIZE", 2)
+    @patch("performanceplatform.client.DataSet.from_group_and_type")
+    def test_latest_timestamps_by_id(self, mock_dataset):
+        mockdata = Mock()
+        mockdata.get.side_effect = [
+            {'data': [
+                {'_id': 'a', '_timestamp': '2013-01-01T00:00:00+00:00'},
+                {'_id': 'a', '_timestamp': '2013-03-01T00:00:00+00:00'},
+                {'_id': 'b', '_timestamp': '2013-02-01T00:00:00+00:00'},
+            ]},
+            {'data': []},
+        ]
+        mock_dataset.return_value = mockdata
+
+        latest = latest_timestamps_by_id(
+            {'data_group': 'group', 'data_type': 'type'},
+            ['c', 'b', 'a', 'a'],
+            '2013-01-01T00:00:00+00:00')
+
+        assert_that(latest, is_({
+            'a': '2013-03-01T00:00:00+00:00',
+            'b': '2013-02-01T00:00:00+00:00'}))
+        assert_that(mockdata.get.call_args_list[0][1], is_({
+            'query_parameters': {
+                'id': ['a', 'b'],
+                'start_at': '2013-01-01T00:00:00+00:00',
+                'end_at': '2018-01-09T00:00:00+00:00'}}))
+        assert_that(
+            mockdata.get.call_args_list[1][1]['query_parameters']['id'],
+            is_(['c']))
+
+    @freeze_time('2018, 1, 09 00:00:00')
+    @patch("performanceplatform.client.DataSet.from_group_and_type")
+    def test_filter_latest_data(self, mock_dataset):
+        mockdata = Mock()
+        mockdata.get.return_value = {'data': [
+            {'_id': 'a', '_timestamp': '2013-04-01T00:00:00+00:00'},
+            {'_id': 'b', '_timestamp': '2013-06-01T00:00:00+00:00'},
+        ]}
+        mock_dataset.return_value = mockdata
+
+        latest_data = filter_latest_data(
+            {'data_group': 'group', 'data_type': 'type'},
+            {},
+            [{'_id': 'a', '_timestamp': '2013-04-01T00:00:00+00:00'},
+             {'_id': 'b', '_timestamp': '2013-05-01T00:00:00+00:00'},
+             {'_id': 'c', '_timestamp': '2013-05-01T00:00:00+00:00'}])
+
+        assert_that([datum['_id'] for datum in latest_data],
+                    is_(['a', 'c']))
+        assert_that(mockdata.get.call_count, is_(1))
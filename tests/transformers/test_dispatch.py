@@ -8,6 +8,7 @@ from mock import patch, MagicMock
 
 from backdrop.transformers.dispatch import (
     entrypoint,
+    dispatch_pending,
     run_transform,
     get_query_parameters,
     get_or_get_and_create_output_dataset
@@ -48,6 +49,35 @@ class DispatchTestCase(unittest.TestCase):
                 earliest,
                 latest))
 
+    @patch('backdrop.transformers.dispatch.entrypoint')
+    @patch('backdrop.transformers.dispatch.pending_transforms')
+    def test_dispatch_pending(self, mock_pending, mock_entrypoint):
+        earliest = datetime(2014, 12, 10, 12, 00, 00, tzinfo=pytz.utc)
+        latest = datetime(2014, 12, 14, 12, 00, 00, tzinfo=pytz.utc)
+        mock_pending.take.return_value = (earliest, latest)
+
+        dispatch_pending('dataset123')
+
+        mock_pending.take.assert_called_once_with('dataset123')
+        mock_entrypoint.assert_called_once_with('dataset123', earliest, latest)
+
+    @patch('backdrop.transformers.dispatch.entrypoint')
+    @patch('backdrop.transformers.dispatch.pending_transforms')
+    def test_dispatch_pending_with_nothing_pending(
+            self, mock_pending, mock_entrypoint):
+        mock_pending.take.return_value = None
+
+        dispatch_pending('dataset123')
+
+        assert_that(mock_entrypoint.called, is_(False))
+
+    @patch('backdrop.transformers.dispatch.entrypoint')
+    @patch('backdrop.transformers.dispatch.pending_transforms', None)
+    def test_dispatch_pending_without_a_debounce(self, mock_entrypoint):
+        dispatch_pending('dataset123')
+
+        assert_that(mock_entrypoint.called, is_(False))
+
     @patch('backdrop.transformers.dispatch.AdminAPI')
     @patch('backdrop.transformers.dispatch.DataSet')
     @patch('backdrop.transformers.tasks.debug.logging')
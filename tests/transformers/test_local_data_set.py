@@ -0,0 +1,127 @@
+import unittest
+from datetime import datetime
+
+import pytz
+from hamcrest import assert_that, is_, calling, raises, has_entries, \
+    contains
+from mock import Mock, patch
+
+from backdrop.core.errors import ValidationError
+from backdrop.transformers.dispatch import (
+    get_or_get_and_create_output_dataset,
+    run_transform,
+)
+from backdrop.transformers.local_data_set import LocalDataSet
+from tests.support.test_helpers import d_tz
+
+
+class LocalDataSetTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.storage = Mock()
+        self.storage.data_set_exists.return_value = True
+        self.on_stored = Mock()
+        self.data_set = LocalDataSet(
+            self.storage, {'name': 'foo_bar', 'capped_size': 0},
+            on_stored=self.on_stored)
+
+    def test_get_queries_storage_with_the_query_parameters(self):
+        self.storage.execute_query.return_value = []
+
+        self.data_set.get(query_parameters={
+            'start_at': '2014-01-01T00:00:00+00:00',
+            'end_at': '2014-01-08T00:00:00+00:00',
+            'filter_by': ['a:b', 'c:d'],
+            'sort_by': '_timestamp:descending',
+            'limit': 1,
+        })
+
+        name, query = self.storage.execute_query.call_args[0]
+        assert_that(name, is_('foo_bar'))
+        assert_that(query.start_at, is_(d_tz(2014, 1, 1)))
+        assert_that(query.end_at, is_(d_tz(2014, 1, 8)))
+        assert_that(query.filter_by, is_([['a', 'b'], ['c', 'd']]))
+        assert_that(query.sort_by, is_(['_timestamp', 'descending']))
+        assert_that(query.limit, is_(1))
+
+    def test_get_returns_data_as_the_read_api_would(self):
+        self.storage.execute_query.return_value = [
+            {'_timestamp': datetime(2014, 1, 1, tzinfo=pytz.UTC),
+             'value': 1}]
+
+        assert_that(self.data_set.get(), is_({'data': [
+            {'_timestamp': '2014-01-01T00:00:00+00:00', 'value': 1}]}))
+
+    def test_post_stores_records(self):
+        self.data_set.post([
+            {'_timestamp': '2014-01-02T00:00:00Z', 'value': 1},
+            {'_timestamp': '2014-01-01T00:00:00Z', 'value': 2},
+        ])
+
+        name, records = self.storage.save_records.call_args[0]
+        assert_that(name, is_('foo_bar'))
+        assert_that([record['value'] for record in records], is_([1, 2]))
+        self.on_stored.assert_called_once_with(
+            'foo_bar', d_tz(2014, 1, 1), d_tz(2014, 1, 2))
+
+    def test_post_creates_the_data_set(self):
+        self.storage.data_set_exists.return_value = False
+
+        self.data_set.post([{'value': 1}])
+
+        self.storage.create_data_set.assert_called_once_with('foo_bar', 0)
+        assert_that(self.on_stored.called, is_(False))
+
+    def test_post_raises_on_invalid_records(self):
+        assert_that(calling(self.data_set.post).with_args([{'_foo': 1}]),
+                    raises(ValidationError))
+        assert_that(self.storage.save_records.called, is_(False))
+
+
+class LocalDispatchTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.config = patch('backdrop.transformers.dispatch.config')
+        config = self.config.start()
+        config.DATA_SET_BACKEND = 'local'
+        self.storage = patch(
+            'backdrop.transformers.local_data_set._storage', Mock())
+        self.storage.start()
+
+    def tearDown(self):
+        self.config.stop()
+        self.storage.stop()
+
+    @patch('backdrop.transformers.dispatch.DataSet')
+    @patch('backdrop.transformers.dispatch.AdminAPI')
+    def test_output_data_set_is_local(self, mock_admin_api, mock_data_set):
+        mock_admin_api.return_value.get_data_set.return_value = {
+            'name': 'group_output', 'bearer_token': 'token'}
+
+        output = get_or_get_and_create_output_dataset(
+            {'output': {'data-type': 'output'}}, {'data_group': 'group'})
+
+        assert_that(output, is_(LocalDataSet))
+        assert_that(mock_data_set.from_group_and_type.called, is_(False))
+
+    @patch('backdrop.transformers.dispatch.get_or_get_and_create_output_dataset')
+    @patch('backdrop.transformers.dispatch.get_transform_function')
+    @patch('backdrop.transformers.dispatch.DataSet')
+    def test_run_transform_reads_from_storage(
+            self, mock_data_set, mock_get_function, mock_get_output):
+        from backdrop.transformers import local_data_set
+        local_data_set._storage.execute_query.return_value = [
+            {'_timestamp': d_tz(2014, 12, 10), 'value': 1}]
+        mock_get_function.return_value = \
+            lambda data, transform, data_set_config: data
+
+        run_transform(
+            {'name': 'group_type', 'data_group': 'group',
+             'data_type': 'type'},
+            {'options': {}, 'output': {'data-type': 'output'}},
+            '2014-12-10T00:00:00+00:00', '2014-12-14T00:00:00+00:00')
+
+        assert_that(mock_data_set.from_group_and_type.called, is_(False))
+        [posted] = mock_get_output.return_value.post.call_args[0]
+        assert_that(posted, contains(has_entries({
+            '_timestamp': '2014-12-10T00:00:00+00:00', 'value': 1})))
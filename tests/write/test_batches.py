@@ -0,0 +1,133 @@
+import unittest
+
+from hamcrest import assert_that, is_, none, has_entries, has_key
+from mock import Mock
+
+from backdrop.write.batches import BatchQueue, create_batch_queue
+from tests.support.test_helpers import d_tz
+
+
+class FakeRedis(object):
+
+    def __init__(self):
+        self.values = {}
+        self.expiries = {}
+
+    def set(self, key, value, ex=None):
+        self.values[key] = value
+        self.expiries[key] = ex
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def delete(self, key):
+        self.values.pop(key, None)
+
+    def expire(self, key, ex):
+        if key not in self.values:
+            return False
+        self.expiries[key] = ex
+        return True
+
+
+class TestBatchQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.redis = FakeRedis()
+        self.queue = BatchQueue(self.redis, ttl=60)
+        self.config = {'name': 'foo', 'bearer_token': 'bar'}
+
+    def test_records_can_be_loaded_by_batch_id(self):
+        records = [{'_id': 'a', '_timestamp': d_tz(2014, 1, 1)}]
+        batch_id = self.queue.create(self.config, records)
+
+        assert_that(self.queue.load(batch_id), is_((self.config, records)))
+
+    def test_a_new_batch_is_queued(self):
+        batch_id = self.queue.create(self.config, [{'_id': 'a'}, {'_id': 'b'}])
+
+        assert_that(self.queue.status(batch_id), has_entries({
+            'state': 'queued',
+            'data_set': 'foo',
+            'count': 2,
+        }))
+
+    def test_records_without_an_id_are_given_one(self):
+        batch_id = self.queue.create(self.config, [{'foo': 'bar'}])
+
+        _, [record] = self.queue.load(batch_id)
+        assert_that(record, has_key('_id'))
+
+    def test_batches_expire(self):
+        self.queue.create(self.config, [{'_id': 'a'}])
+
+        assert_that(set(self.redis.expiries.values()), is_(set([60])))
+
+    def test_stored_batches_lose_their_records(self):
+        batch_id = self.queue.create(self.config, [{'_id': 'a'}])
+
+        self.queue.stored(batch_id)
+
+        assert_that(self.queue.load(batch_id), none())
+        assert_that(self.queue.status(batch_id), has_entries({
+            'state': 'stored',
+            'count': 1,
+            'error': None,
+        }))
+
+    def test_failed_batches_keep_their_records(self):
+        batch_id = self.queue.create(self.config, [{'_id': 'a'}])
+
+        self.queue.failed(batch_id, 'it broke')
+
+        assert_that(self.queue.load(batch_id), is_((self.config, [
+            {'_id': 'a'}])))
+        assert_that(self.queue.status(batch_id), has_entries({
+            'state': 'failed',
+            'error': 'it broke',
+        }))
+
+    def test_failed_batches_can_be_queued_again(self):
+        batch_id = self.queue.create(self.config, [{'_id': 'a'}])
+        self.queue.failed(batch_id, 'it broke')
+
+        assert_that(self.queue.requeue(batch_id), is_(True))
+
+        assert_that(self.queue.status(batch_id), has_entries({
+            'state': 'queued',
+        }))
+        assert_that(self.queue.load(batch_id), is_((self.config, [
+            {'_id': 'a'}])))
+
+    def test_expired_batches_cannot_be_queued_again(self):
+        batch_id = self.queue.create(self.config, [{'_id': 'a'}])
+        self.queue.failed(batch_id, 'it broke')
+        self.redis.delete(self.queue._records_key(batch_id))
+
+        assert_that(self.queue.requeue(batch_id), is_(False))
+        assert_that(self.queue.status(batch_id), has_entries({
+            'state': 'failed',
+        }))
+
+    def test_retrying_batches_are_still_queued(self):
+        batch_id = self.queue.create(self.config, [{'_id': 'a'}])
+
+        self.queue.retrying(batch_id, 'it broke')
+
+        assert_that(self.queue.status(batch_id), has_entries({
+            'state': 'queued',
+            'error': 'it broke',
+        }))
+
+    def test_unknown_batches_have_no_status(self):
+        assert_that(self.queue.status('nope'), none())
+        assert_that(self.queue.load('nope'), none())
+
+
+class TestCreateBatchQueue(unittest.TestCase):
+
+    def test_batch_ttl_is_configurable(self):
+        queue = create_batch_queue({
+            'BROKER_URL': 'redis://localhost:6379', 'BATCH_TTL': 10})
+
+        assert_that(queue.ttl, is_(10))
@@ -0,0 +1,85 @@
+import unittest
+
+from hamcrest import assert_that, is_, calling, raises
+from mock import patch
+
+from backdrop.write.worker import store_batch, ensure_indexes
+from tests.support.test_helpers import d_tz
+
+
+@patch('backdrop.write.worker.app')
+@patch('backdrop.write.worker.storage')
+@patch('backdrop.write.worker.batch_queue')
+class StoreBatchTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.config = {'name': 'foo', 'capped_size': 0}
+        self.records = [
+            {'_id': 'a', '_timestamp': d_tz(2014, 1, 2)},
+            {'_id': 'b', '_timestamp': d_tz(2014, 1, 1)},
+        ]
+
+    def test_records_are_stored(self, batch_queue, storage, app):
+        batch_queue.load.return_value = (self.config, self.records)
+
+        store_batch('1234')
+
+        storage.save_records.assert_called_once_with('foo', self.records)
+        batch_queue.stored.assert_called_once_with('1234')
+
+    def test_transforms_are_triggered(self, batch_queue, storage, app):
+        batch_queue.load.return_value = (self.config, self.records)
+
+        store_batch('1234')
+
+        app.send_task.assert_called_once_with(
+            'backdrop.transformers.dispatch.entrypoint',
+            args=('foo', d_tz(2014, 1, 1), d_tz(2014, 1, 2)))
+
+    def test_new_data_sets_are_indexed(self, batch_queue, storage, app):
+        batch_queue.load.return_value = (
+            dict(self.config, indexed_fields=['name']), self.records)
+        storage.data_set_exists.return_value = False
+
+        store_batch('1234')
+
+        storage.ensure_indexes.assert_called_once_with('foo', ['name'])
+
+    def test_existing_data_sets_are_not_indexed(self, batch_queue, storage,
+                                                app):
+        batch_queue.load.return_value = (self.config, self.records)
+        storage.data_set_exists.return_value = True
+
+        store_batch('1234')
+
+        assert_that(storage.ensure_indexes.called, is_(False))
+
+    def test_missing_batches_are_skipped(self, batch_queue, storage, app):
+        batch_queue.load.return_value = None
+
+        store_batch('1234')
+
+        assert_that(storage.save_records.called, is_(False))
+        assert_that(app.send_task.called, is_(False))
+
+    def test_failures_are_recorded(self, batch_queue, storage, app):
+        batch_queue.load.return_value = (self.config, self.records)
+        storage.save_records.side_effect = IOError('down')
+
+        with patch.object(store_batch, 'max_retries', 0):
+            assert_that(calling(store_batch).with_args('1234'),
+                        raises(IOError))
+
+        batch_queue.failed.assert_called_once_with(
+            '1234', "IOError('down',)")
+        assert_that(batch_queue.stored.called, is_(False))
+        assert_that(app.send_task.called, is_(False))
+
+
+@patch('backdrop.write.worker.storage')
+class EnsureIndexesTestCase(unittest.TestCase):
+
+    def test_indexes_are_built(self, storage):
+        ensure_indexes('foo', ['name'])
+
+        storage.ensure_indexes.assert_called_once_with('foo', ['name'])
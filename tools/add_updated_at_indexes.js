@@ -0,0 +1,17 @@
+/*
+    Index _updated_at on every collection, for those created before
+    get_last_updated needed it and not written to since. From the backdrop
+    repository, run:
+    mongo tools/add_updated_at_indexes.js
+*/
+
+conn = new Mongo();
+db = conn.getDB("backdrop");
+
+db.getCollectionNames().forEach(function (name) {
+    if (name.indexOf("system.") === 0) {
+        return;
+    }
+    db.getCollection(name).createIndex({"_updated_at": -1}, {"background": true});
+    printjson({"Indexed _updated_at": name});
+});
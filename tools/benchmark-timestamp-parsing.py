@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+Compare parsing record timestamps with dateutil against the strict ISO-8601
+fast path in backdrop.core.timeutils.
+
+    python tools/benchmark-timestamp-parsing.py [number of timestamps]
+"""
+
+import sys
+import timeit
+
+from dateutil import parser
+
+from backdrop.core.timeutils import parse_iso8601
+
+TIME_STRINGS = [
+    '2014-01-06T09:30:00Z',
+    '2014-01-06T09:30:00+00:00',
+    '2014-01-06T09:30:00+01:00',
+    '2014-01-06T09:30:00.123456-05:00',
+]
+
+
+def main(count):
+    time_strings = (TIME_STRINGS * (count // len(TIME_STRINGS) + 1))[:count]
+
+    for name, parse in [('dateutil', parser.parse),
+                        ('parse_iso8601', parse_iso8601)]:
+        seconds = min(timeit.repeat(
+            lambda: [parse(time_string) for time_string in time_strings],
+            repeat=3, number=1))
+        print '{:<14} {:>8.1f} µs per timestamp'.format(
+            name, seconds / count * 1e6)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+Build the indexes added to the mongo table after it was first deployed on a
+database created before them, without blocking writes. This needs to be run
+once on existing databases, before deploying the features that rely on them.
+
+    python tools/index-postgres.py <database url>
+
+mongo_collection_timestamp_id serves raw queries paged through with after,
+and mongo_record serves filter_by and filter_by_prefix. The ingestion worker
+builds them too, the first time it builds a data set's indexes. A build
+which failed part way through is dropped and built again.
+
+A partitioned table is created with these indexes, so there is nothing to
+do for one.
+"""
+
+import sys
+
+from backdrop.core.storage.postgres import PostgresStorageEngine
+
+
+def main(database_url):
+    PostgresStorageEngine(database_url).ensure_table_indexes()
+    print("Built the table indexes")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 2:
+        main(sys.argv[1])
+    else:
+        print("Usage: {} <database url>".format(sys.argv[0]))
+        sys.exit(2)
@@ -0,0 +1,315 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+Move a Postgres database on to the schema used with DATABASE_PARTITIONED,
+where the mongo table is list-partitioned by collection, while backdrop
+keeps running. This needs Postgres 11 or later.
+
+    python tools/partition-postgres.py <database url> prepare
+    python tools/partition-postgres.py <database url> swap
+    python tools/partition-postgres.py <database url> move [collection ...]
+
+1. prepare builds a unique index on (collection, id), and any of the indexes
+   added to the table since it was first deployed that are missing, without
+   blocking writes. With them in place backdrop can be deployed with
+   DATABASE_PARTITIONED=true, as its upserts conflict on (collection, id).
+2. swap checks that every index prepare builds is there, then renames the
+   table to mongo_default and attaches it as the default partition of a
+   new, partitioned, mongo table. It only holds its lock for the renames.
+   Restart backdrop afterwards so that it creates partitions for the data
+   sets it writes to from then on.
+3. move moves the rows of each collection given, or of every collection
+   still in the default partition, into a partition of its own. A trigger
+   records the ids of the collection's rows written to while the rows are
+   copied across in batches, and the partition's indexes are built, without
+   blocking reads or writes. Then the mongo table is locked while the rows
+   written to since are copied again, the collection's rows are deleted
+   from the default partition and the partition is attached, which scans
+   the default partition. The lock is given up and taken again later if it
+   can't be taken straight away, so that it doesn't queue other queries
+   behind long reads.
+"""
+
+import sys
+import time
+
+import psycopg2
+import psycopg2.errorcodes
+
+from backdrop.core.storage.sql_query_factory import partition_name, \
+    create_table_index_queries
+
+COLUMNS = """
+    id         VARCHAR   NOT NULL,
+    collection VARCHAR   NOT NULL,
+    timestamp  TIMESTAMP NOT NULL,
+    updated_at TIMESTAMP NOT NULL,
+    record     JSONB     NOT NULL
+"""
+
+INDEXES = [
+    ('mongo_timestamp', '(timestamp)'),
+    ('mongo_updated_at', '(updated_at)'),
+    ('mongo_collection_timestamp', '(collection, timestamp)'),
+    ('mongo_collection_updated_at', '(collection, updated_at)'),
+    ('mongo_collection_timestamp_id', '(collection, timestamp, id)'),
+    ('mongo_record', 'USING gin (record jsonb_path_ops)'),
+]
+
+BATCH_SIZE = 10000
+LOCK_TIMEOUT = '5s'
+LOCK_ATTEMPTS = 10
+LOCK_RETRY_DELAY = 30
+
+# Records the id of each row of a collection written to in the default
+# partition, in the table named by the trigger's first argument
+CREATE_CHANGES_FUNCTION = """
+    CREATE OR REPLACE FUNCTION mongo_move_changed() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            IF OLD.collection = TG_ARGV[1] THEN
+                EXECUTE format(
+                    'INSERT INTO %I VALUES ($1) ON CONFLICT DO NOTHING',
+                    TG_ARGV[0]) USING OLD.id;
+            END IF;
+        ELSIF NEW.collection = TG_ARGV[1] THEN
+            EXECUTE format(
+                'INSERT INTO %I VALUES ($1) ON CONFLICT DO NOTHING',
+                TG_ARGV[0]) USING NEW.id;
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+"""
+
+
+def prepare(connection):
+    connection.autocommit = True
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS
+            mongo_collection_id ON mongo (collection, id)
+        """)
+        # Databases created before these indexes were added need them built
+        # before the swap, which expects them
+        for query in create_table_index_queries():
+            cursor.execute(query)
+
+
+def swap(connection):
+    with connection.cursor() as cursor:
+        cursor.execute("LOCK TABLE mongo IN ACCESS EXCLUSIVE MODE")
+        missing = _missing_indexes(
+            cursor,
+            ['mongo_pkey', 'mongo_collection_id'] +
+            [name for name, _ in INDEXES])
+        if missing:
+            connection.rollback()
+            raise ValueError(
+                'Missing or invalid indexes {}, run prepare first'.format(
+                    ', '.join(missing)))
+
+        cursor.execute("ALTER TABLE mongo RENAME TO mongo_default")
+        cursor.execute(
+            "ALTER INDEX mongo_pkey RENAME TO mongo_default_pkey")
+        cursor.execute(
+            "ALTER INDEX mongo_collection_id RENAME TO mongo_default_key")
+        for name, _ in INDEXES:
+            cursor.execute("ALTER INDEX {0} RENAME TO {1}".format(
+                name, name.replace('mongo_', 'mongo_default_', 1)))
+
+        # Indexes on a partitioned table with no partitions are created
+        # straight away, and attaching the old table adopts its matching
+        # indexes rather than building new ones
+        cursor.execute("""
+            CREATE TABLE mongo ({}, PRIMARY KEY (collection, id))
+            PARTITION BY LIST (collection)
+        """.format(COLUMNS))
+        for name, columns in INDEXES:
+            cursor.execute("CREATE INDEX {} ON mongo {}".format(
+                name, columns))
+        cursor.execute("ALTER TABLE mongo ATTACH PARTITION mongo_default "
+                       "DEFAULT")
+    connection.commit()
+
+
+def _missing_indexes(cursor, names):
+    cursor.execute("""
+        SELECT pg_class.relname FROM pg_index
+        JOIN pg_class ON pg_class.oid = pg_index.indexrelid
+        WHERE pg_class.relname = ANY(%(names)s) AND pg_index.indisvalid
+    """, {'names': names})
+    valid = set(name for (name,) in cursor)
+    return [name for name in names if name not in valid]
+
+
+def move(connection, collections):
+    with connection.cursor() as cursor:
+        if not collections:
+            cursor.execute("SELECT DISTINCT collection FROM mongo_default")
+            collections = [collection for (collection,) in cursor]
+        cursor.execute(CREATE_CHANGES_FUNCTION)
+    connection.commit()
+
+    for collection in collections:
+        moved = _move(connection, collection)
+        print("Moved {} rows of {} into {}".format(
+            moved, collection, partition_name(collection)))
+
+
+def _move(connection, collection):
+    """
+    The rows are copied into a table named apart from the partition, so
+    that backdrop doesn't write straight into it before it is attached.
+    Running this again after it was stopped part way carries on from where
+    it got to.
+    """
+    name = partition_name(collection)
+    moving = name + '_moving'
+    changes = name + '_changes'
+    params = {'collection': collection, 'changes': changes}
+
+    with connection.cursor() as cursor:
+        # The check lets the attach skip validating the new partition
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS {} ({}, PRIMARY KEY (collection, id),
+                                           CHECK (collection = %(collection)s))
+        """.format(moving, COLUMNS), params)
+        cursor.execute(
+            "CREATE TABLE IF NOT EXISTS {} (id VARCHAR PRIMARY KEY)".format(
+                changes))
+        cursor.execute(
+            "DROP TRIGGER IF EXISTS {} ON mongo_default".format(changes))
+        cursor.execute("""
+            CREATE TRIGGER {} AFTER INSERT OR UPDATE OR DELETE
+            ON mongo_default FOR EACH ROW
+            EXECUTE PROCEDURE mongo_move_changed(%(changes)s, %(collection)s)
+        """.format(changes), params)
+    connection.commit()
+
+    moved = _copy(connection, collection, moving)
+
+    with connection.cursor() as cursor:
+        for index, columns in INDEXES:
+            cursor.execute("CREATE INDEX IF NOT EXISTS {} ON {} {}".format(
+                index.replace('mongo', name, 1), moving, columns))
+    connection.commit()
+
+    for attempt in range(LOCK_ATTEMPTS):
+        while _apply_changes(connection, collection, moving, changes,
+                             BATCH_SIZE) == BATCH_SIZE:
+            pass
+        if _attach(connection, collection, moving, changes):
+            return moved
+        time.sleep(LOCK_RETRY_DELAY)
+
+    raise RuntimeError('Could not lock mongo to attach {}'.format(name))
+
+
+def _copy(connection, collection, moving):
+    """Copy the collection's rows in batches of BATCH_SIZE, in id order,
+    committing each batch"""
+    copied, after = 0, ''
+    while True:
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                WITH batch AS (
+                    SELECT * FROM mongo_default
+                    WHERE collection = %(collection)s AND id > %(after)s
+                    ORDER BY id LIMIT %(limit)s
+                ), copied AS (
+                    INSERT INTO {} SELECT * FROM batch
+                    ON CONFLICT DO NOTHING
+                )
+                SELECT count(*), max(id) FROM batch
+            """.format(moving), {'collection': collection, 'after': after,
+                                 'limit': BATCH_SIZE})
+            count, after = cursor.fetchone()
+        connection.commit()
+        if not count:
+            return copied
+        copied += count
+
+
+def _apply_changes(connection, collection, moving, changes, limit=None,
+                   commit=True):
+    """Copy the rows written to since they were copied again, up to limit
+    of them, and return how many there were. A row written to while this
+    runs has its id recorded again, once this commits."""
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            DELETE FROM {0} WHERE id IN (SELECT id FROM {0} LIMIT %(limit)s)
+            RETURNING id
+        """.format(changes), {'limit': limit})
+        ids = [id for (id,) in cursor]
+        if ids:
+            cursor.execute(
+                "DELETE FROM {} WHERE id = ANY(%(ids)s)".format(moving),
+                {'ids': ids})
+            cursor.execute("""
+                INSERT INTO {} SELECT * FROM mongo_default
+                WHERE collection = %(collection)s AND id = ANY(%(ids)s)
+            """.format(moving), {'collection': collection, 'ids': ids})
+    if commit:
+        connection.commit()
+    return len(ids)
+
+
+def _attach(connection, collection, moving, changes):
+    """Attach the partition, or return False if mongo couldn't be locked
+    within LOCK_TIMEOUT"""
+    name = partition_name(collection)
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL lock_timeout = %(timeout)s",
+                           {'timeout': LOCK_TIMEOUT})
+            # Attaching takes this lock on mongo anyway, and taking it first
+            # keeps writers, which lock mongo before mongo_default, from
+            # deadlocking with the move
+            cursor.execute("LOCK TABLE mongo IN ACCESS EXCLUSIVE MODE")
+    except psycopg2.OperationalError as e:
+        connection.rollback()
+        if e.pgcode != psycopg2.errorcodes.LOCK_NOT_AVAILABLE:
+            raise
+        return False
+
+    _apply_changes(connection, collection, moving, changes, commit=False)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "DROP TRIGGER {} ON mongo_default".format(changes))
+        cursor.execute("DROP TABLE {}".format(changes))
+        cursor.execute(
+            "DELETE FROM mongo_default WHERE collection = %(collection)s",
+            {'collection': collection})
+        cursor.execute("ALTER TABLE {} RENAME TO {}".format(moving, name))
+        cursor.execute(
+            "ALTER TABLE mongo ATTACH PARTITION {} "
+            "FOR VALUES IN (%(collection)s)".format(name),
+            {'collection': collection})
+    connection.commit()
+    return True
+
+
+def main(database_url, step, collections):
+    connection = psycopg2.connect(database_url)
+    try:
+        if step == 'prepare':
+            prepare(connection)
+        elif step == 'swap':
+            swap(connection)
+        elif step == 'move':
+            move(connection, collections)
+        else:
+            raise ValueError('Unknown step "{}"'.format(step))
+    finally:
+        connection.close()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 3:
+        main(sys.argv[1], sys.argv[2], sys.argv[3:])
+    else:
+        print("Usage: {} <database url> prepare|swap|move "
+              "[collection ...]".format(sys.argv[0]))
+        sys.exit(2)